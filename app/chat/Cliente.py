@@ -1,15 +1,22 @@
 import socket
 import threading
-import json
+import os
 
-from app.protocol.marshaller import marshall_message
-from app.protocol.unmarshaller import unmarshall
-from app.protocol.unmarshaller import unmarshall_with_length
-from app.protocol.message import create_message
+from app.protocol.marshaller import marshall_message, marshall_control, marshall_file
+from app.protocol.unmarshaller import unmarshall_frame
+from app.protocol.framing import FrameDecoder, FrameError
+from app.protocol.message import (
+    create_message, create_history_request, create_hello, create_search_request, create_join, create_leave
+)
+from app.protocol.compression import compress_frame, SUPPORTED_COMPRESSION, COMPRESSION_THRESHOLD
+from app.protocol.file_transfer import FileReceiver, file_digest, create_file_offer, create_file_request
+from app.chat.nameserver import resolvedor_para
+from app.chat.historico import CONVERSA_GERAL
 
 class ClienteChat:
 
-    def __init__(self, server_name='Servidor.com', name_server_host='0.0.0.0', name_server_port=50000):
+    def __init__(self, server_name='Servidor.com', name_server_host='0.0.0.0', name_server_port=50000,
+                 limiar_compressao=COMPRESSION_THRESHOLD):
         self.server_name = server_name
         self.name_server_host = name_server_host
         self.name_server_port = name_server_port
@@ -17,24 +24,29 @@ class ClienteChat:
         self.port = None
         self.cliente_socket = None
         self.nome_usuario = None
+        self.cursores_historico = {}  # Por sala, aponta para mensagens mais antigas que as já exibidas
+        self.sala_atual = CONVERSA_GERAL  # Sala para onde vão as mensagens digitadas
+        self.receptor_arquivos = FileReceiver()
+        self.anexos = {}  # Anexos anunciados pelo servidor, por prefixo do hash
+        self.confirmacao_upload = None  # Último file_ack recebido
+        self.evento_confirmacao = threading.Event()
+        self.compressao = None  # Compressão aceita pelo servidor no hello_ack
+        self.limiar_compressao = limiar_compressao  # Frames menores seguem sem comprimir
+        self.busca = None  # (consulta, cursor) da última busca com mais resultados
 
     def lookup_server(self):
+        # Endereços ficam em cache pelo TTL do registro; só a primeira
+        # consulta (ou uma já expirada) espera pelo Servidor de Nomes
         try:
             print(f"[*] Consultando o Servidor de Nomes em {self.name_server_host}:{self.name_server_port}...")
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(3)  # Add timeout
-                s.connect((self.name_server_host, self.name_server_port))
-                request = {'action': 'lookup', 'name': self.server_name}
-                s.send(json.dumps(request).encode('utf-8'))
-                response_data = s.recv(1024)
-                response = json.loads(response_data.decode('utf-8'))
-                if response.get('status') == 'found':
-                    self.host, self.port = response['address']
-                    print(f"[+] Servidor encontrado em {self.host}:{self.port}")
-                    return True
-                else:
-                    print(f"[AVISO] Servidor '{self.server_name}' não encontrado no Servidor de Nomes.")
-                    return False
+            endereco = resolvedor_para(self.name_server_host, self.name_server_port).resolver(self.server_name)
+            if endereco:
+                self.host, self.port = endereco
+                print(f"[+] Servidor encontrado em {self.host}:{self.port}")
+                return True
+            else:
+                print(f"[AVISO] Servidor '{self.server_name}' não encontrado no Servidor de Nomes.")
+                return False
         except socket.timeout:
             print(f"[AVISO] Tempo limite excedido ao contatar o Servidor de Nomes.")
         except ConnectionRefusedError:
@@ -50,58 +62,64 @@ class ClienteChat:
         return True
 
     def receber_mensagens(self):
-  
-        buffer = b""
-        
+        decoder = FrameDecoder()
+
         while True:
             try:
-                chunk = self.cliente_socket.recv(4096)
+                chunk = self.cliente_socket.recv(65536)
                 if not chunk:
                     print("\n[!] Conexão com o servidor perdida.")
                     self.cliente_socket.close()
                     break
-                    
-                buffer += chunk
-                
-                while buffer:
+
+                try:
+                    frames = decoder.feed(chunk)
+                except FrameError as e:
+                    print(f"[ERRO] Fluxo inválido recebido do servidor: {e}")
+                    self.cliente_socket.close()
+                    break
+
+                for frame in frames:
                     try:
-                        msg_dict, consumed = unmarshall_with_length(buffer)
-                        
-                        buffer = buffer[consumed:]
-                        
-                        if msg_dict.get("type") == "text":
-                            sender = msg_dict.get("sender_id", "Desconhecido")
-                            content = msg_dict.get("content", "")
-                            is_history = msg_dict.get("is_history", False)
-                            
-                            if sender == "Sistema":
-                                print(f"[Sistema] {content}")
-                            else:
-                                # Add [Histórico] prefix for history messages
-                                prefix = "[Histórico] " if is_history else ""
-                                print(f"{prefix}{sender}: {content}")
-                    
-                    except ValueError as e:
-                        if "desconhecido" in str(e).lower():
-                            print(f"[ERRO] {e}")
-                            buffer = b""
-                        else:
-                            print(f"[ERRO] Erro ao processar mensagem: {e}")
-                            break
-                            
-                    except json.JSONDecodeError as e:
-                        if "Expecting value" in str(e) or "Unterminated string" in str(e):
-                            break
-                        else:
-                            print(f"[ERRO] Erro de JSON: {e}")
-                            buffer = b""  
-                            break
-                            
+                        msg_dict = unmarshall_frame(frame)
                     except Exception as e:
                         print(f"[ERRO] Mensagem inválida recebida: {e}")
-                        buffer = b"" 
-                        break
-                        
+                        continue
+
+                    if msg_dict.get("type") == "text":
+                        sender = msg_dict.get("sender_id", "Desconhecido")
+                        content = msg_dict.get("content", "")
+                        is_history = msg_dict.get("is_history", False)
+
+                        if sender == "Sistema":
+                            print(f"[Sistema] {content}")
+                        else:
+                            # Add [Histórico] prefix for history messages
+                            prefix = "[Histórico] " if is_history else ""
+                            if msg_dict.get("to"):
+                                prefix += "[privado] "
+                            elif msg_dict.get("room") and msg_dict["room"] != CONVERSA_GERAL:
+                                prefix += f"[{msg_dict['room']}] "
+                            print(f"{prefix}{sender}: {content}")
+                    elif msg_dict.get("type") == "history":
+                        self.exibir_historico(msg_dict)
+                    elif msg_dict.get("type") == "search_results":
+                        self.exibir_busca(msg_dict)
+                    elif msg_dict.get("type") == "file":
+                        caminho = self.receptor_arquivos.write_chunk(msg_dict)
+                        if caminho:
+                            print(f"[Sistema] Arquivo salvo em {caminho}")
+                    elif msg_dict.get("type") == "hello_ack":
+                        self.compressao = msg_dict.get("compression")
+                    elif msg_dict.get("type") == "file_ack":
+                        self.confirmacao_upload = msg_dict
+                        self.evento_confirmacao.set()
+                    elif msg_dict.get("type") == "attachment":
+                        identificador = msg_dict["sha256"][:8]
+                        self.anexos[identificador] = msg_dict
+                        print(f"[Sistema] {msg_dict['sender_id']} compartilhou {msg_dict['filename']} "
+                              f"({msg_dict['filesize']} bytes). Digite /baixar {identificador} para baixar.")
+
             except ConnectionAbortedError:
                 break
             except Exception as e:
@@ -109,11 +127,89 @@ class ClienteChat:
                 self.cliente_socket.close()
                 break
 
+    def exibir_historico(self, msg_dict):
+        mensagens = msg_dict.get("messages", [])
+        sala = msg_dict.get("room") or CONVERSA_GERAL
+        self.cursores_historico[sala] = msg_dict.get("cursor")
+
+        if not mensagens:
+            print(f"[Sistema] Nenhuma mensagem no histórico de {sala}.")
+            return
+
+        prefixo = "[Histórico] " if sala == CONVERSA_GERAL else f"[Histórico {sala}] "
+        for mensagem in mensagens:
+            print(f"{prefixo}{mensagem.get('sender_id', 'Desconhecido')}: {mensagem.get('content', '')}")
+        print(f"[Sistema] Histórico carregado: {len(mensagens)} mensagens.")
+        if self.cursores_historico[sala]:
+            print("[Sistema] Digite /historico para ver mensagens anteriores.")
+
+    def exibir_busca(self, msg_dict):
+        mensagens = msg_dict.get("messages", [])
+        cursor = msg_dict.get("cursor")
+        self.busca = (msg_dict.get("query", ""), cursor, 20, msg_dict.get("room")) if cursor else None
+
+        if not mensagens:
+            print(f"[Sistema] Nenhuma mensagem encontrada para '{msg_dict.get('query', '')}'.")
+            return
+
+        for mensagem in mensagens:
+            print(f"[Busca] {mensagem.get('timestamp', '')[:16]} {mensagem.get('sender_id', 'Desconhecido')}: {mensagem.get('content', '')}")
+        if self.busca:
+            print("[Sistema] Digite /buscar para ver mais resultados.")
+
+    def enviar_arquivo(self, caminho):
+        if not os.path.isfile(caminho):
+            print(f"[ERRO] Arquivo não encontrado: {caminho}")
+            return
+
+        nome_arquivo = os.path.basename(caminho)
+        with open(caminho, "rb") as arquivo:
+            sha256 = file_digest(arquivo)
+            # O arquivo vai para a sala atual, como as mensagens digitadas
+            oferta = create_file_offer(self.nome_usuario, nome_arquivo, os.path.getsize(caminho), sha256,
+                                       room=self.sala_atual)
+
+            # O servidor informa de qual chunk continuar (ou que já tem o arquivo)
+            self.evento_confirmacao.clear()
+            self._enviar(marshall_control(oferta))
+            if not self.evento_confirmacao.wait(10):
+                print("[ERRO] Servidor não respondeu à oferta de arquivo.")
+                return
+            confirmacao = self.confirmacao_upload
+
+            if confirmacao.get("complete"):
+                print(f"[Sistema] Arquivo {nome_arquivo} já estava no servidor, envio dispensado.")
+                return
+
+            inicio = confirmacao.get("next_chunk", 0) if confirmacao.get("stored") else 0
+            if inicio:
+                print(f"[Sistema] Retomando envio de {nome_arquivo} a partir do chunk {inicio}.")
+            for frame in marshall_file(self.nome_usuario, nome_arquivo, arquivo,
+                                       message_id=sha256, start_chunk=inicio, room=self.sala_atual):
+                self.cliente_socket.sendall(frame)
+        print(f"[Sistema] Arquivo {nome_arquivo} enviado.")
+
+    def baixar_anexo(self, identificador):
+        anexo = self.anexos.get(identificador)
+        if not anexo:
+            print(f"[ERRO] Anexo desconhecido: {identificador}")
+            return
+        pedido = create_file_request(anexo["sha256"], anexo["filename"])
+        self._enviar(marshall_control(pedido))
+
+    def _enviar(self, dados):
+        if self.compressao:
+            dados = compress_frame(dados, self.limiar_compressao)
+        self.cliente_socket.sendall(dados)
+
     def enviar_mensagens(self):
+        # Anuncia as compressões suportadas; o servidor responde com hello_ack
+        self._enviar(marshall_control(create_hello(list(SUPPORTED_COMPRESSION))))
+
         # A primeira mensagem enviada será o nome do usuário
         message = f"({self.nome_usuario} entrou no chat)"
         mensagem_inicial = create_message(self.nome_usuario, message)
-        self.cliente_socket.send(marshall_message(mensagem_inicial))
+        self._enviar(marshall_message(mensagem_inicial))
 
         while True:
             try:
@@ -125,10 +221,67 @@ class ClienteChat:
                     print("[!] Saindo do chat...")
                     self.cliente_socket.close()
                     break
+
+                # Pede a página anterior do histórico da sala atual
+                if texto_mensagem.strip().lower() == '/historico':
+                    cursor = self.cursores_historico.get(self.sala_atual)
+                    if cursor:
+                        pedido = create_history_request(cursor, room=self.sala_atual)
+                        self._enviar(marshall_control(pedido))
+                    else:
+                        print("[Sistema] Não há mensagens anteriores.")
+                    continue
+
+                # Entra em uma sala e passa a enviar para ela: /entrar <sala>
+                if texto_mensagem.startswith('/entrar '):
+                    sala = texto_mensagem[len('/entrar '):].strip()
+                    self._enviar(marshall_control(create_join(sala)))
+                    self.sala_atual = sala
+                    print(f"[Sistema] Mensagens agora vão para a sala {sala}.")
+                    continue
+
+                # Sai de uma sala: /deixar <sala>
+                if texto_mensagem.startswith('/deixar '):
+                    sala = texto_mensagem[len('/deixar '):].strip()
+                    self._enviar(marshall_control(create_leave(sala)))
+                    if sala == self.sala_atual:
+                        self.sala_atual = CONVERSA_GERAL
+                    continue
+
+                # Mensagem direta: /msg <usuário> <texto>
+                if texto_mensagem.startswith('/msg '):
+                    partes = texto_mensagem[len('/msg '):].strip().split(' ', 1)
+                    if len(partes) < 2 or not partes[1].strip():
+                        print("[Sistema] Uso: /msg <usuário> <texto>")
+                    else:
+                        self._enviar(marshall_message(create_message(self.nome_usuario, partes[1], to=partes[0])))
+                    continue
+
+                # Busca no histórico: /buscar <termos>; sem termos, continua a última busca
+                if texto_mensagem.strip().lower().startswith('/buscar'):
+                    consulta = texto_mensagem.strip()[len('/buscar'):].strip()
+                    if consulta:
+                        self._enviar(marshall_control(create_search_request(consulta, room=self.sala_atual)))
+                    elif self.busca:
+                        self._enviar(marshall_control(create_search_request(*self.busca)))
+                    else:
+                        print("[Sistema] Uso: /buscar <termos>")
+                    continue
+
+                # Envia um arquivo: /arquivo <caminho>
+                if texto_mensagem.startswith('/arquivo '):
+                    self.enviar_arquivo(texto_mensagem[len('/arquivo '):].strip())
+                    continue
+
+                # Baixa um anexo anunciado: /baixar <id>
+                if texto_mensagem.startswith('/baixar '):
+                    self.baixar_anexo(texto_mensagem[len('/baixar '):].strip())
+                    continue
                 
                 # Formata a mensagem com o nome do usuário e envia
-                mensagem_completa = create_message(self.nome_usuario, texto_mensagem)
-                self.cliente_socket.send(marshall_message(mensagem_completa))
+                sala = self.sala_atual if self.sala_atual != CONVERSA_GERAL else None
+                mensagem_completa = create_message(self.nome_usuario, texto_mensagem, room=sala)
+                self._enviar(marshall_message(mensagem_completa))
             except (EOFError, KeyboardInterrupt):
                 # Lida com Ctrl+D ou Ctrl+C para sair
                 print("\n[!] Desconectando...")
@@ -153,6 +306,8 @@ class ClienteChat:
             print(f"[*] Conectado ao servidor de chat.")
             print("Digite 'sair' a qualquer momento para se desconectar.")
         except ConnectionRefusedError:
+            # O endereço em cache pode estar velho; a próxima tentativa consulta de novo
+            resolvedor_para(self.name_server_host, self.name_server_port).invalidar(self.server_name)
             print(f"[ERRO] Não foi possível se conectar ao servidor. Verifique se o servidor está rodando.")
             return
 
@@ -1,193 +1,648 @@
 import socket
 import threading
+import time
 import uuid
 from datetime import datetime
-import json
-import time
 
-from app.protocol.marshaller import marshall_message
-from app.protocol.unmarshaller import unmarshall
-from app.protocol.message import create_message
+from app.protocol.marshaller import marshall_message, marshall_history, marshall_control, marshall_file_chunk_header
+from app.protocol.unmarshaller import unmarshall_frame
+from app.protocol.framing import FrameDecoder, FrameError, frame_bytes, FRAME_TEXT, FRAME_FILE
+from app.protocol.message import (
+    create_message, create_history_batch, create_hello_ack, create_search_results, payload_has_routing
+)
+from app.protocol.compression import compress_frame, decompress_frame, COMPRESSION_ZLIB, COMPRESSION_THRESHOLD, FLAG_COMPRESSED
+from app.protocol.file_transfer import create_file_ack, create_attachment, file_chunk_meta_from_binary, DEFAULT_CHUNK_SIZE
+from app.chat.fila_saida import FilaSaida, EnvioArquivo, POLITICA_DESCARTAR_ANTIGAS
+from app.chat.historico import (
+    HistoricoRecente, entrada_historico, registro_decodificado,
+    conversa_direta, participantes, CONVERSA_GERAL, PREFIXO_DIRETA
+)
+from app.chat.nameserver import RegistroNomes
+from app.chat.sessao import SessaoCliente
+from app.chat.persistencia import FilaPersistencia, POLITICA_BLOQUEAR
+
+TAMANHO_RECV = 65536
+LIMITE_PAGINA_HISTORICO = 200
+INTERVALO_ACK_ARQUIVO = 16  # Chunks gravados entre confirmações de upload
+TAMANHO_MAXIMO_SALA = 64
 
 class ServidorChat:
-    def __init__(self, name="Servidor.com", host='0.0.0.0', port=55555, storage_api=None, name_server_host='127.0.0.1', name_server_port=50000):
+    def __init__(self, name="Servidor.com", host='0.0.0.0', port=55555, storage_api=None, name_server_host='127.0.0.1', name_server_port=50000,
+                 limite_fila_saida=1024, politica_consumidor_lento=POLITICA_DESCARTAR_ANTIGAS,
+                 capacidade_historico=50, attachment_store=None,
+                 compressao=True, limiar_compressao=COMPRESSION_THRESHOLD,
+                 limite_fila_persistencia=10000, politica_fila_persistencia=POLITICA_BLOQUEAR,
+                 espera_fila_persistencia=1.0):
         self.name = name
         self.host = host
         self.port = port
         self.servidor_socket = None
-        self.clientes_conectados = [] # Lista para armazenar os sockets dos clientes
-        self.lock = threading.Lock() # Lock para garantir acesso seguro à lista de clientes
+        self.sessoes = {} # Descritor -> SessaoCliente de cada conexão
+        self.lock = threading.Lock() # Protege o registro de sessões e os índices de salas e usuários
         self.storage_api = storage_api # API para armazenamento distribuído
-        self.usuario_por_socket = {} # Mapeia sockets para nomes de usuário
+        self.sessoes_por_usuario = {} # Usuário -> sessões, para mensagens diretas
+        self.salas = {} # Sala -> sessões inscritas; toda conexão começa na sala geral
         self.name_server_host = name_server_host
         self.name_server_port = name_server_port
+        self.registro_nomes = None # Mantém o registro vivo com heartbeats
+        self._amostra_cpu = (time.monotonic(), time.process_time()) # Última medição de CPU reportada
+        self.limite_fila_saida = limite_fila_saida
+        self.politica_consumidor_lento = politica_consumidor_lento
+        self.historico = HistoricoRecente( # Mensagens recentes servidas sem consultar o storage
+            capacidade_historico,
+            gerar_cursor=storage_api.cursor_for if storage_api else None,
+            limiar_compressao=limiar_compressao
+        )
+        self.attachment_store = attachment_store # Anexos guardados por hash de conteúdo
+        self.compressao = compressao # Aceita negociar compressão zlib no hello
+        self.limiar_compressao = limiar_compressao
+        # Com um journal local no storage, cada mensagem é gravada nele antes
+        # da entrega; sem ele, a fila de persistência grava depois, em segundo plano
+        self.gravar_antes_de_entregar = bool(storage_api and storage_api.journal)
+        self.fila_persistencia = None
+        if storage_api and not self.gravar_antes_de_entregar:
+            self.fila_persistencia = FilaPersistencia(
+                self._persistir_lote, limite_fila_persistencia, politica_fila_persistencia, espera_fila_persistencia
+            )
 
     def register_with_name_server(self):
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((self.name_server_host, self.name_server_port))
-                request = {'action': 'register', 'name': self.name, 'port': self.port}
-                s.send(json.dumps(request).encode('utf-8'))
-                response = s.recv(1024)
-                print(f"[*] Resposta do Servidor de Nomes: {response.decode('utf-8')}")
-        except Exception as e:
-            print(f"[ERRO] Falha ao registrar com o Servidor de Nomes: {e}")
+        # Registra e segue enviando heartbeats em segundo plano, para o
+        # registro não expirar enquanto o servidor estiver no ar
+        if self.registro_nomes is None:
+            self.registro_nomes = RegistroNomes(
+                self.name_server_host, self.name_server_port, self.name, self.port, self.host,
+                carga=self.carga
+            )
+        self.registro_nomes.registrar()
+
+    def carga(self):
+        # Enviada ao Servidor de Nomes em cada heartbeat; a CPU é a fração
+        # usada pelo processo desde a medição anterior
+        agora, cpu = time.monotonic(), time.process_time()
+        inicio, cpu_inicio = self._amostra_cpu
+        self._amostra_cpu = (agora, cpu)
+        with self.lock:
+            sessoes = list(self.sessoes.values())
+        clientes = len(sessoes)
+        fila = sum(len(sessao.fila) for sessao in sessoes)
+        return {
+            'clients': clientes,
+            'queue': fila,
+            'persist_queue': len(self.fila_persistencia) if self.fila_persistencia is not None else 0,
+            'cpu': round(min((cpu - cpu_inicio) / max(agora - inicio, 1e-6), 1.0), 3),
+        }
 
-    def transmitir_mensagem(self, mensagem, conexao_cliente):
+    def _montar_registro(self, frame, sessao, msg_dict=None, conversa=CONVERSA_GERAL):
+        registro = {
+            "id": str(uuid.uuid4()),  # Generate unique ID
+            "sender": sessao.nome,
+            "timestamp": datetime.now().isoformat(),
+            "type": "text",
+            "room": conversa
+        }
+        if msg_dict is not None:
+            registro["content"] = msg_dict.get("content", "")
+            if msg_dict.get("to"):
+                registro["to"] = msg_dict["to"]
+        else:
+            registro["frame"] = frame  # Decodificado só se for persistido ou exibido no histórico
+        return registro
 
+    def _persistir_mensagem(self, message_data):
         try:
-            msg_dict = unmarshall(mensagem)
+            return self.storage_api.store_message(message_data["id"], message_data)
         except Exception as e:
-            print(f"[ERRO] Falha ao desserializar mensagem: {e}")
+            print(f"[ERRO] Falha ao armazenar mensagem: {e}")
+            return None
+
+    def _persistir_lote(self, registros):
+        # Roda na thread da fila de persistência; retorna quantos registros foram gravados
+        mensagens = [registro_decodificado(registro) for registro in registros]
+        if self.storage_api.write_behind:
+            # Submete o lote inteiro antes de esperar, para o write-behind
+            # gravá-lo em uma transação por nó
+            futuros = [self.storage_api.store_message_async(m["id"], m) for m in mensagens]
+            resultados = [futuro.result() for futuro in futuros]
+        else:
+            resultados = [self._persistir_mensagem(m) for m in mensagens]
+
+        gravados = 0
+        for message_data, result in zip(mensagens, resultados):
+            if result:
+                gravados += 1
+            else:
+                print(f"[!] Failed to replicate message {message_data['id']}")
+        return gravados
+
+    def _rotear(self, sessao, msg_dict):
+        # (conversa, sessões de destino, erro) de uma mensagem de texto; o
+        # custo é proporcional aos destinatários, não a todos os conectados
+        sala = (msg_dict and msg_dict.get("room")) or CONVERSA_GERAL
+        para = msg_dict and msg_dict.get("to")
+        with self.lock:
+            if para:
+                usuario = sessao.usuario
+                if usuario is None:
+                    return None, None, "Entre no chat antes de enviar mensagens diretas."
+                sessoes = self.sessoes_por_usuario.get(para)
+                if not sessoes:
+                    return None, None, f"Usuário {para} não está conectado."
+                # As outras sessões do próprio remetente também recebem a mensagem
+                return conversa_direta(usuario, para), sessoes | self.sessoes_por_usuario.get(usuario, set()), None
+            if sala not in sessao.salas:
+                return None, None, f"Você não está na sala {sala}. Use /entrar {sala}."
+            return sala, set(self.salas[sala]), None
+
+    def _preparar_envio(self, frame, sessao, msg_dict):
+        conversa, destinos, erro = self._rotear(sessao, msg_dict)
+        if erro:
+            self._enviar_mensagem_sistema(sessao, erro)
+            return None
+        return self._montar_registro(frame, sessao, msg_dict, conversa), destinos
+
+    def _adicionar_historico(self, registro):
+        conversa = registro["room"]
+        if not conversa.startswith(PREFIXO_DIRETA):
+            # O histórico de conversas diretas vem sempre do storage; um
+            # buffer por par de usuários só cresceria sem nunca ser lido
+            self.historico.adicionar(registro, conversa)
+
+    def transmitir_mensagem(self, frame, sessao, msg_dict=None):
+        # Os destinatários recebem o frame original, sem re-serialização. O
+        # registro (id e timestamp atribuídos aqui) vai para o storage depois,
+        # pela fila de persistência, sem atrasar a entrega.
+        envio = self._preparar_envio(frame, sessao, msg_dict)
+        if envio is None:
             return
+        registro, destinos = envio
+
+        if self.gravar_antes_de_entregar and not self._gravar_no_journal(registro):
+            self._recusar_mensagem(sessao, registro)
+            return
+        self._entregar(frame, sessao, registro, destinos)
+
+    def _gravar_no_journal(self, registro):
+        # O journal agrupa o fsync de mensagens simultâneas
+        return self._persistir_mensagem(registro_decodificado(registro))
+
+    def _recusar_mensagem(self, sessao, registro):
+        # Sem a gravação no journal, nada guardaria a mensagem: ela não é entregue
+        print(f"[ERRO] Mensagem {registro['id']} não entregue: falha ao gravá-la no journal")
+        self._enviar_mensagem_sistema(sessao, "Mensagem não enviada: o servidor não conseguiu armazená-la.")
+
+    def _entregar(self, frame, sessao, registro, destinos):
+        self._adicionar_historico(registro)
+        self._difundir(frame_bytes(frame), sessao, destinos)
+        self._enfileirar_persistencia(registro)
+
+    def _enfileirar_persistencia(self, registro):
+        if self.fila_persistencia is not None and not self.fila_persistencia.enfileirar(registro):
+            print(f"[AVISO] Mensagem {registro['id']} descartada: fila de persistência cheia")
+
+    def encerrar_persistencia(self, timeout=10):
+        # Grava o que ainda estiver na fila antes de o processo sair
+        if self.fila_persistencia is None:
+            return
+        pendentes = len(self.fila_persistencia)
+        if pendentes:
+            print(f"[*] Gravando {pendentes} mensagens pendentes...")
+        if not self.fila_persistencia.encerrar(timeout):
+            print(f"[AVISO] {len(self.fila_persistencia)} mensagens não foram gravadas")
+        print(f"[*] Persistência: {self.fila_persistencia.metricas()}")
+
+    def _versao_para(self, sessao, dados):
+        # Frame comprimido ou não, conforme o que a conexão negociou
+        if sessao.comprimida:
+            return compress_frame(dados, self.limiar_compressao)
+        return decompress_frame(dados)
+
+    def _difundir(self, mensagem_bytes, origem=None, destinos=None):
+        # Só enfileira os mesmos bytes para cada sessão; o envio fica a cargo dos escritores.
+        # Sem `destinos`, vai para todas as sessões conectadas.
+        if destinos is None:
+            with self.lock:
+                destinos = list(self.sessoes.values())
+
+        # Cada versão (comprimida ou não) é gerada no máximo uma vez por difusão
+        versoes = {}
+        lentos = []
+        for sessao in destinos:
+            if sessao is origem:
+                continue
+            dados = versoes.get(sessao.comprimida)
+            if dados is None:
+                dados = versoes[sessao.comprimida] = self._versao_para(sessao, mensagem_bytes)
+            # Uma fila fechada é de uma sessão que já está saindo
+            if not sessao.fila.enfileirar(dados) and not sessao.fila.fechada:
+                lentos.append(sessao)
+        for sessao in lentos:
+            print(f"[!] Cliente {sessao.nome} excedeu a fila de saída.")
+            self.remover_cliente(sessao)
+
+    def enviar_para(self, sessao, dados):
+        if isinstance(dados, bytes):
+            dados = self._versao_para(sessao, dados)
+        if not sessao.fila.enfileirar(dados):
+            self.remover_cliente(sessao)
+
+    def _criar_fila_saida(self, sessao):
+        fila = FilaSaida(self.limite_fila_saida, self.politica_consumidor_lento)
+        escritor = threading.Thread(target=self._escritor_cliente, args=(sessao, fila))
+        escritor.daemon = True
+        escritor.start()
+        return fila
+
+    def _descritor(self, conexao):
+        return conexao.fileno()
 
-        if self.storage_api:
+    def _registrar_cliente(self, conexao, endereco):
+        sessao = SessaoCliente(conexao, self._descritor(conexao), endereco)
+        sessao.fila = self._criar_fila_saida(sessao)
+        with self.lock:
+            self.sessoes[sessao.fd] = sessao
+            self._inscrever(sessao, CONVERSA_GERAL)
+            total = len(self.sessoes)
+        return sessao, total
+
+    def _escritor_cliente(self, sessao, fila):
+        while True:
+            lote = fila.retirar_lote()
+            if fila.fechada:
+                break
+            if not lote:
+                continue
             try:
-                msg_id = str(uuid.uuid4())  # Generate unique ID
-                sender = self.usuario_por_socket.get(conexao_cliente, "Desconhecido")
-                timestamp = datetime.now().isoformat()
-                
-                message_data = {
-                    "id": msg_id,
-                    "sender": sender,
-                    "content": msg_dict.get("content", ""),
-                    "timestamp": timestamp,
-                    "type": "text"
-                }
-                
-                result = self.storage_api.store_message(msg_id, message_data)
-                
-                if result:
-                    print(f"[+] Message {msg_id} replicated to all nodes")
-                else:
-                    print(f"[!] Failed to replicate message {msg_id}")
-                    
-            except Exception as e:
-                print(f"[ERRO] Falha ao armazenar mensagem: {e}")
+                sessao.frames_enviados += len(lote)
+                self._enviar_lote(sessao.conexao, lote)
+            except (socket.error, OSError):
+                self.remover_cliente(sessao)
+                break
 
-        mensagem_bytes = marshall_message(msg_dict)
+    def _enviar_lote(self, conexao, lote):
+        pendentes = []
+        for item in lote:
+            if isinstance(item, EnvioArquivo):
+                if pendentes:
+                    conexao.sendall(b"".join(pendentes))
+                    pendentes = []
+                item.enviar(conexao)
+            else:
+                pendentes.append(item)
+        if pendentes:
+            conexao.sendall(b"".join(pendentes))
+
+    def _fechar_conexao(self, conexao):
+        try:
+            # Acorda a thread leitora bloqueada em recv
+            conexao.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        conexao.close()
 
+    def remover_cliente(self, sessao):
+        # Leitor, escritor e difusão podem pedir a remoção da mesma sessão;
+        # só o primeiro tem efeito. O custo depende das salas da sessão, não
+        # do número de conectados.
         with self.lock:
-            for cliente in self.clientes_conectados:
-                if cliente != conexao_cliente:
-                    try:
-                        cliente.send(mensagem_bytes)
-                    except socket.error:
-                        self.remover_cliente(cliente)
-
-    def remover_cliente(self, cliente_socket):
-        if cliente_socket in self.clientes_conectados:
-            usuario = self.usuario_por_socket.get(cliente_socket, "Desconhecido")
-            cliente_socket.close()
-            self.clientes_conectados.remove(cliente_socket)
-            
-            if cliente_socket in self.usuario_por_socket:
-                del self.usuario_por_socket[cliente_socket]
-                
-            print(f"[-] Cliente {usuario} desconectado. {len(self.clientes_conectados)} cliente(s) conectado(s).")
+            if self.sessoes.get(sessao.fd) is not sessao:
+                return
+            # Sai do registro antes de fechar o socket, para que o descritor
+            # reaproveitado por uma nova conexão não colida com esta sessão
+            del self.sessoes[sessao.fd]
+            for sala in sessao.salas:
+                self._remover_da_sala(sessao, sala)
+            if sessao.usuario is not None:
+                sessoes = self.sessoes_por_usuario.get(sessao.usuario)
+                if sessoes is not None:
+                    sessoes.discard(sessao)
+                    if not sessoes:
+                        del self.sessoes_por_usuario[sessao.usuario]
+            total = len(self.sessoes)
 
+        sessao.fila.fechar()
+        self._fechar_conexao(sessao.conexao)
+        if self.attachment_store:
+            # Uploads interrompidos ficam em disco e podem ser retomados
+            self.attachment_store.release(sessao)
+        print(f"[-] Cliente {sessao.nome} desconectado. {total} cliente(s) conectado(s).")
 
-    def lidar_cliente(self, conexao_cliente, endereco_cliente):
+    def lidar_cliente(self, sessao):
+        endereco_cliente = sessao.endereco
         print(f"[+] Nova conexão de {endereco_cliente[0]}:{endereco_cliente[1]}")
 
-        if self.storage_api:
-            try:
-                self.enviar_historico(conexao_cliente)
-            except Exception as e:
-                print(f"[ERRO] Falha ao enviar histórico: {e}")
+        decoder = FrameDecoder()
 
         while True:
             try:
-                mensagem = conexao_cliente.recv(4096)
-                if mensagem:
-                    try:
-                        msg_dict = unmarshall(mensagem)
-                        print(f"[*] Mensagem recebida de {endereco_cliente[0]}: {msg_dict.get('content', '')}")
-                    except Exception as e:
-                        print(f"[ERRO] Mensagem inválida recebida: {e}")
-                        continue
-
-                    if conexao_cliente not in self.usuario_por_socket:
-                        if msg_dict.get("type") == "text" and "entrou no chat" in msg_dict.get("content", ""):
-                            usuario = msg_dict.get("sender_id", "Desconhecido")
-                            self.usuario_por_socket[conexao_cliente] = usuario
-                            print(f"[*] Usuário identificado: {usuario}")
-
-                    self.transmitir_mensagem(mensagem, conexao_cliente)
-                else:
-                    self.remover_cliente(conexao_cliente)
+                dados = sessao.conexao.recv(TAMANHO_RECV)
+                if not dados:
+                    self.remover_cliente(sessao)
+                    break
+
+                try:
+                    frames = decoder.feed(dados)
+                except FrameError as e:
+                    print(f"[ERRO] Fluxo inválido de {endereco_cliente[0]}: {e}")
+                    self.remover_cliente(sessao)
                     break
+
+                for frame in frames:
+                    self._processar_frame(frame, sessao)
             except socket.error:
-                with self.lock:
-                    self.remover_cliente(conexao_cliente)
+                self.remover_cliente(sessao)
                 break
 
-    def enviar_historico(self, conexao_cliente, limite=50):
+    def _processar_frame(self, frame, sessao):
+        sessao.frames_recebidos += 1
+        self._tratar_frame(frame, sessao)
+        if sessao.aguardando_historico:
+            # O histórico vai depois do primeiro frame, que pode ser o hello que
+            # negocia a compressão; clientes antigos o recebem após entrar no chat
+            sessao.aguardando_historico = False
+            self.enviar_historico(sessao)
+
+    def _tratar_frame(self, frame, sessao):
+        if frame.type == FRAME_FILE:
+            if self.attachment_store:
+                self._responder(sessao, *self._gravar_chunk(frame))
+            else:
+                self.retransmitir_arquivo(frame, sessao)
+            return
+
+        if self._caminho_rapido(frame, sessao):
+            # Só o cabeçalho é lido e o frame segue como chegou para a sala geral
+            self.transmitir_mensagem(frame, sessao)
+            return
+
+        try:
+            msg_dict = unmarshall_frame(frame)
+            print(f"[*] Mensagem recebida: {msg_dict.get('type')} {msg_dict.get('content', '')}")
+        except Exception as e:
+            print(f"[ERRO] Mensagem inválida recebida: {e}")
+            return
+
+        self._processar_mensagem(msg_dict, sessao, frame)
+
+    def retransmitir_arquivo(self, frame, sessao):
+        # Chunks de arquivo seguem em binário, sem decodificar os dados, para
+        # a mesma sala ou destinatário que uma mensagem de texto teria
+        try:
+            meta = file_chunk_meta_from_binary(frame.payload)
+        except ValueError as e:
+            print(f"[ERRO] Chunk de arquivo inválido: {e}")
+            return
+        _, destinos, erro = self._rotear(sessao, meta)
+        if erro:
+            # Um aviso por arquivo, não um por chunk
+            if not meta.get("chunk_index"):
+                self._enviar_mensagem_sistema(sessao, erro)
+            return
+        self._difundir(frame_bytes(frame), sessao, destinos)
+
+    def _caminho_rapido(self, frame, sessao):
+        # Texto de usuário já identificado, sem sala nem destinatário no payload
+        return (
+            frame.type == FRAME_TEXT
+            and sessao.usuario is not None
+            and not frame.flags & FLAG_COMPRESSED
+            and not payload_has_routing(frame.payload)
+        )
+
+    def _identificar_usuario(self, msg_dict, sessao):
+        if sessao.usuario is None:
+            if msg_dict.get("type") == "text" and "entrou no chat" in msg_dict.get("content", ""):
+                usuario = msg_dict.get("sender_id", "Desconhecido")
+                with self.lock:
+                    if self.sessoes.get(sessao.fd) is not sessao:
+                        return  # Sessão já encerrada
+                    sessao.usuario = usuario
+                    self.sessoes_por_usuario.setdefault(usuario, set()).add(sessao)
+                print(f"[*] Usuário identificado: {usuario}")
+
+    def _inscrever(self, sessao, sala):
+        # Chamado com self.lock adquirido
+        self.salas.setdefault(sala, set()).add(sessao)
+        sessao.salas.add(sala)
+
+    def _remover_da_sala(self, sessao, sala):
+        # Chamado com self.lock adquirido; não altera sessao.salas
+        membros = self.salas.get(sala)
+        if membros is not None:
+            membros.discard(sessao)
+            if not membros:
+                del self.salas[sala]
+
+    def _entrar_sala(self, sessao, sala):
+        # Inscreve a conexão e responde com o histórico recente da sala
+        sala = sala.strip()
+        if not sala or sala.startswith(PREFIXO_DIRETA) or len(sala) > TAMANHO_MAXIMO_SALA:
+            return self._mensagem_sistema(f"Nome de sala inválido: {sala}")
+        with self.lock:
+            if self.sessoes.get(sessao.fd) is not sessao:
+                return None  # Sessão já encerrada
+            self._inscrever(sessao, sala)
+        if not self.historico.carregada(sala):
+            self.carregar_historico(sala)
+        return self.historico.frame(sala, comprimido=sessao.comprimida)
+
+    def _sair_sala(self, sessao, sala):
+        with self.lock:
+            if sala not in sessao.salas:
+                return self._mensagem_sistema(f"Você não está na sala {sala}.")
+            sessao.salas.discard(sala)
+            self._remover_da_sala(sessao, sala)
+        return self._mensagem_sistema(f"Você saiu da sala {sala}.")
+
+    def _pode_ler(self, sessao, conversa):
+        # Salas em que a sessão está inscrita e conversas diretas do próprio usuário
+        with self.lock:
+            if conversa in sessao.salas:
+                return True
+            return sessao.usuario in participantes(conversa)
+
+    def _pedido_historico(self, sessao, pedido):
+        sala = pedido.get("room") or CONVERSA_GERAL
+        if not self._pode_ler(sessao, sala):
+            return self._mensagem_sistema(f"Sem acesso ao histórico de {sala}.")
+        return self._frame_pagina_historico(pedido.get("cursor"), pedido.get("limit", 50), sala)
+
+    def _pedido_busca(self, sessao, pedido):
+        sala = pedido.get("room") or CONVERSA_GERAL
+        if not self._pode_ler(sessao, sala):
+            return self._mensagem_sistema(f"Sem acesso ao histórico de {sala}.")
+        return self._frame_busca(pedido["query"], pedido.get("cursor"), pedido.get("limit", 20), sala)
+
+    def _processar_mensagem(self, msg_dict, sessao, frame):
+        tipo = msg_dict.get("type")
+        if tipo == "hello":
+            self._negociar(msg_dict, sessao)
+            return
+        if tipo == "join":
+            self._responder(sessao, self._entrar_sala(sessao, msg_dict["room"]))
+            return
+        if tipo == "leave":
+            self._responder(sessao, self._sair_sala(sessao, msg_dict["room"]))
+            return
+        if tipo == "history_request":
+            self.enviar_para(sessao, self._pedido_historico(sessao, msg_dict))
+            return
+        if tipo == "search_request":
+            self.enviar_para(sessao, self._pedido_busca(sessao, msg_dict))
+            return
+        if tipo == "file_offer":
+            self._responder(sessao, *self._aceitar_upload(sessao, msg_dict))
+            return
+        if tipo == "file_request":
+            self.enviar_para(sessao, self._envio_anexo(msg_dict))
+            return
+
+        if tipo == "text":
+            self._identificar_usuario(msg_dict, sessao)
+            self.transmitir_mensagem(frame, sessao, msg_dict)
+
+    def _responder(self, sessao, resposta, anexo=None):
+        if resposta:
+            self.enviar_para(sessao, resposta)
+        if not anexo:
+            return
+        # O anúncio do anexo vai só para a sala (ou destinatário) do upload
+        _, destinos, erro = self._rotear(sessao, anexo)
+        if erro:
+            self._enviar_mensagem_sistema(sessao, erro)
+            return
+        self._difundir(self._anuncio_anexo(anexo), sessao, destinos)
+
+    def _anuncio_anexo(self, info):
+        return marshall_control(create_attachment(info["sender_id"], info["filename"], info["filesize"], info["sha256"],
+                                                  room=info.get("room"), to=info.get("to")))
+
+    def _aceitar_upload(self, sessao, oferta):
+        # Retorna (resposta ao remetente, anexo a anunciar aos demais clientes)
+        sha256 = oferta["sha256"]
+        if not self.attachment_store:
+            return marshall_control(create_file_ack(sha256, 0, stored=False)), None
+        try:
+            chunk_size = int(oferta.get("chunk_size") or DEFAULT_CHUNK_SIZE)
+            proximo = self.attachment_store.begin_upload(sha256, int(oferta["filesize"]), chunk_size, owner=sessao)
+        except (ValueError, OSError) as e:
+            print(f"[ERRO] Upload recusado: {e}")
+            return self._mensagem_sistema(f"Upload recusado: {e}"), None
+
+        total = (int(oferta["filesize"]) + chunk_size - 1) // chunk_size
+        if proximo >= total:
+            # Conteúdo já armazenado: nada precisa ser enviado de novo
+            print(f"[*] Anexo {sha256[:12]} já armazenado, upload dispensado")
+            return marshall_control(create_file_ack(sha256, total, complete=True)), oferta
+        if proximo:
+            print(f"[*] Retomando upload de {sha256[:12]} a partir do chunk {proximo}")
+        return marshall_control(create_file_ack(sha256, proximo)), None
+
+    def _gravar_chunk(self, frame):
+        try:
+            chunk = unmarshall_frame(frame)
+            sha256 = chunk["message_id"]
+            proximo, completo = self.attachment_store.write_chunk(sha256, chunk["chunk_index"], chunk["data"])
+        except (ValueError, KeyError, OSError) as e:
+            print(f"[ERRO] Chunk de arquivo rejeitado: {e}")
+            return self._mensagem_sistema(f"Chunk de arquivo rejeitado: {e}"), None
+
+        if completo:
+            print(f"[+] Anexo {chunk['filename']} ({sha256[:12]}) armazenado")
+            return marshall_control(create_file_ack(sha256, proximo, complete=True)), dict(chunk, sha256=sha256)
+        if proximo % INTERVALO_ACK_ARQUIVO == 0:
+            return marshall_control(create_file_ack(sha256, proximo)), None
+        return None, None
+
+    def _envio_anexo(self, pedido):
+        sha256 = pedido["sha256"]
+        if not self.attachment_store or not self.attachment_store.has_object(sha256):
+            return self._mensagem_sistema("Anexo não encontrado.")
+
+        tamanho = self.attachment_store.object_size(sha256)
+        total = (tamanho + DEFAULT_CHUNK_SIZE - 1) // DEFAULT_CHUNK_SIZE
+        meta = {
+            "type": "file",
+            "sender_id": "Sistema",
+            "timestamp": datetime.now().isoformat(),
+            "filename": pedido.get("filename") or sha256,
+            "filesize": tamanho,
+            "chunk_index": 0,
+            "chunk_size": DEFAULT_CHUNK_SIZE,
+            "total_chunks": total,
+            "message_id": sha256,
+        }
+        trechos = (
+            (marshall_file_chunk_header(dict(meta, chunk_index=indice), tamanho_chunk), offset, tamanho_chunk)
+            for indice, offset, tamanho_chunk in self.attachment_store.iter_ranges(sha256, DEFAULT_CHUNK_SIZE)
+        )
+        return EnvioArquivo(self.attachment_store.object_path(sha256), trechos)
+
+    def carregar_historico(self, conversa=CONVERSA_GERAL):
+        # Preenche o ring buffer da conversa com as mensagens mais recentes do storage
         if not self.storage_api:
-            self._enviar_mensagem_sistema(conexao_cliente, "Histórico de mensagens não disponível.")
             return
-            
         try:
-            print(f"[*] Enviando histórico de mensagens para cliente (limite: {limite})...")
-            self._enviar_mensagem_sistema(conexao_cliente, "Carregando histórico de mensagens...")
-            self.storage_api.verify_nodes()
-            
-            mensagens = self.storage_api.get_messages(limit=limite)
-            
-            if not mensagens or len(mensagens) == 0:
-                self._enviar_mensagem_sistema(conexao_cliente, "Nenhuma mensagem no histórico.")
-                return
-                
-            try:
-                mensagens.sort(key=lambda m: m.get('timestamp', ''), reverse=False)
-            except Exception as e:
-                print(f"[AVISO] Erro ao ordenar mensagens: {e}")
-            
-            mensagens_enviadas = 0
-            for msg in mensagens:
-                try:
-                    sender = msg.get('sender', 'Desconhecido')
-                    content = msg.get('content', '')
-                    
-                    history_msg = {
-                        'type': 'text',
-                        'sender_id': sender,
-                        'content': content,
-                        'timestamp': msg.get('timestamp', ''),
-                        'is_history': True
-                    }
-                    
-                    conexao_cliente.send(marshall_message(history_msg))
-                    mensagens_enviadas += 1
-                    
-                    time.sleep(0.01)
-                    
-                except Exception as e:
-                    print(f"[ERRO] Falha ao enviar mensagem do histórico: {e}")
-            
-            print(f"[+] Histórico enviado: {mensagens_enviadas} mensagens")
-            self._enviar_mensagem_sistema(conexao_cliente, f"Histórico carregado: {mensagens_enviadas} mensagens.")
-            
+            mensagens = self.storage_api.get_messages(limit=self.historico.capacidade, room=conversa)
+            mensagens.sort(key=lambda m: (m.get('timestamp', ''), m.get('id', '')))
+            self.historico.carregar(mensagens, conversa)
+            print(f"[+] Histórico recente de {conversa} carregado: {len(mensagens)} mensagens")
         except Exception as e:
-            print(f"[ERRO] Falha ao enviar histórico: {e}")
-            self._enviar_mensagem_sistema(conexao_cliente, "Erro ao carregar histórico de mensagens.")
+            print(f"[ERRO] Falha ao carregar histórico: {e}")
 
-    def _enviar_mensagem_sistema(self, conexao_cliente, conteudo):
+    def _frame_pagina_historico(self, cursor, limite, sala=CONVERSA_GERAL):
+        # Página mais antiga do histórico, pedida pelo cliente ao rolar para trás
+        if not self.storage_api:
+            return marshall_history(create_history_batch([], room=sala))
         try:
-            msg = {
-                'type': 'text',
-                'sender_id': 'Sistema',
-                'content': conteudo,
-                'timestamp': datetime.now().isoformat()
-            }
-            conexao_cliente.send(marshall_message(msg))
+            limite = max(1, min(int(limite), LIMITE_PAGINA_HISTORICO))
+            mensagens, proximo_cursor = self.storage_api.get_messages_before(cursor, limit=limite, room=sala)
+            mensagens.reverse()
+            return marshall_history(create_history_batch([entrada_historico(m) for m in mensagens], proximo_cursor, sala))
         except Exception as e:
-            print(f"[ERRO] Falha ao enviar mensagem de sistema: {e}")
+            print(f"[ERRO] Falha ao buscar página do histórico: {e}")
+            return self._mensagem_sistema("Erro ao carregar histórico de mensagens.")
+
+    def _frame_busca(self, consulta, cursor, limite, sala=CONVERSA_GERAL):
+        # Busca textual no histórico da sala, respondida pelo índice FTS do storage
+        if not self.storage_api:
+            return marshall_history(create_search_results(consulta, [], room=sala))
+        try:
+            limite = max(1, min(int(limite), LIMITE_PAGINA_HISTORICO))
+            mensagens, proximo_cursor = self.storage_api.search_messages(consulta, limit=limite, cursor=cursor, room=sala)
+            return marshall_history(create_search_results(consulta, [entrada_historico(m) for m in mensagens], proximo_cursor, sala))
+        except Exception as e:
+            print(f"[ERRO] Falha na busca: {e}")
+            return self._mensagem_sistema("Erro ao buscar mensagens.")
+
+    def enviar_historico(self, sessao):
+        # Um único frame pré-serializado (e, se negociado, pré-comprimido) com todo o histórico recente
+        self.enviar_para(sessao, self.historico.frame(comprimido=sessao.comprimida))
+
+    def _negociar(self, hello, sessao):
+        escolhida = None
+        if self.compressao and COMPRESSION_ZLIB in (hello.get("compression") or []):
+            escolhida = COMPRESSION_ZLIB
+        self.enviar_para(sessao, marshall_control(create_hello_ack(escolhida)))
+        if escolhida:
+            sessao.comprimida = True
+
+    def _mensagem_sistema(self, conteudo):
+        msg = {
+            'type': 'text',
+            'sender_id': 'Sistema',
+            'content': conteudo,
+            'timestamp': datetime.now().isoformat()
+        }
+        return marshall_message(msg)
+
+    def _enviar_mensagem_sistema(self, sessao, conteudo):
+        self.enviar_para(sessao, self._mensagem_sistema(conteudo))
 
 
 
     def iniciar_servidor(self):
         self.register_with_name_server()
+        self.carregar_historico()
         self.servidor_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.servidor_socket.bind((self.host, self.port))
         self.servidor_socket.listen()
@@ -198,23 +653,23 @@ class ServidorChat:
         while True:
             try:
                 # Aceita uma nova conexão
-                conexao_cliente, endereco_cliente = self.servidor_socket.accept()
+                conexao, endereco_cliente = self.servidor_socket.accept()
 
-                # Adiciona o novo cliente à lista de forma segura
-                with self.lock:
-                    self.clientes_conectados.append(conexao_cliente)
+                # Registra a sessão do novo cliente, junto com sua fila de saída
+                sessao, total = self._registrar_cliente(conexao, endereco_cliente)
                 
                 print(f"[!] Conexão aceita de {endereco_cliente[0]}:{endereco_cliente[1]}")
-                print(f"[*] Total de clientes conectados: {len(self.clientes_conectados)}")
+                print(f"[*] Total de clientes conectados: {total}")
 
                 # Cria e inicia uma nova thread para gerenciar a comunicação com o cliente
-                thread_cliente = threading.Thread(target=self.lidar_cliente, args=(conexao_cliente, endereco_cliente))
+                thread_cliente = threading.Thread(target=self.lidar_cliente, args=(sessao,))
                 thread_cliente.daemon = True # Permite que o programa principal saia mesmo que as threads estejam ativas
                 thread_cliente.start()
 
             except KeyboardInterrupt:
                 print("\n[!] Servidor sendo desligado...")
                 self.servidor_socket.close()
+                self.encerrar_persistencia()
                 break
             except Exception as e:
                 print(f"[ERRO] Ocorreu um erro: {e}")
@@ -1,5 +1,5 @@
-from .cliente import ClienteChat
-from .servidor import ServidorChat
+from .Cliente import ClienteChat
+from .Servidor import ServidorChat
 
 __all__ = [
     "ClienteChat",
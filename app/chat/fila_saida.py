@@ -0,0 +1,99 @@
+import threading
+from collections import deque
+
+POLITICA_DESCARTAR_ANTIGAS = 'drop_oldest'
+POLITICA_DESCONECTAR = 'disconnect'
+
+
+class FilaSaida:
+    """Fila de saída limitada de uma conexão.
+
+    O broadcast apenas enfileira referências aos bytes já serializados; um
+    escritor dedicado por conexão esvazia a fila. Quando a fila atinge o
+    limite, a política de consumidor lento decide entre descartar as
+    mensagens mais antigas ou desconectar o cliente.
+    """
+
+    __slots__ = ("limite", "politica", "descartadas", "fechada", "_itens", "_cond", "_notificar")
+
+    def __init__(self, limite=1024, politica=POLITICA_DESCARTAR_ANTIGAS, notificar=None):
+        if politica not in (POLITICA_DESCARTAR_ANTIGAS, POLITICA_DESCONECTAR):
+            raise ValueError(f"Política de consumidor lento desconhecida: {politica}")
+        self.limite = limite
+        self.politica = politica
+        self.descartadas = 0
+        self.fechada = False
+        self._itens = deque()
+        self._cond = threading.Condition()
+        self._notificar = notificar
+
+    def enfileirar(self, dados):
+        # Retorna False se o cliente deve ser desconectado
+        with self._cond:
+            if self.fechada:
+                return False
+            if len(self._itens) >= self.limite:
+                if self.politica == POLITICA_DESCONECTAR:
+                    return False
+                self._itens.popleft()
+                self.descartadas += 1
+            self._itens.append(dados)
+            self._cond.notify()
+        if self._notificar:
+            self._notificar()
+        return True
+
+    def retirar_lote(self, timeout=None):
+        # Bloqueia até haver itens; lista vazia indica fila fechada (ou timeout)
+        with self._cond:
+            if not self._itens and not self.fechada:
+                self._cond.wait(timeout)
+            return self._retirar()
+
+    def retirar_disponiveis(self):
+        with self._cond:
+            return self._retirar()
+
+    def _retirar(self):
+        itens = list(self._itens)
+        self._itens.clear()
+        return itens
+
+    def fechar(self):
+        with self._cond:
+            self.fechada = True
+            self._itens.clear()
+            self._cond.notify_all()
+        if self._notificar:
+            self._notificar()
+
+    def __len__(self):
+        return len(self._itens)
+
+
+class EnvioArquivo:
+    """Download enfileirado como um único item da fila de saída.
+
+    Guarda apenas o caminho e os trechos (cabeçalho do frame, offset,
+    tamanho); o escritor da conexão envia cada cabeçalho e copia o conteúdo
+    direto do arquivo para o socket com sendfile, sem passar pelo Python.
+    """
+
+    __slots__ = ("caminho", "trechos")
+
+    def __init__(self, caminho, trechos):
+        self.caminho = caminho
+        self.trechos = trechos
+
+    def enviar(self, conexao):
+        with open(self.caminho, "rb") as arquivo:
+            for cabecalho, offset, tamanho in self.trechos:
+                conexao.sendall(cabecalho)
+                conexao.sendfile(arquivo, offset, tamanho)
+
+    async def enviar_async(self, loop, escritor):
+        with open(self.caminho, "rb") as arquivo:
+            for cabecalho, offset, tamanho in self.trechos:
+                escritor.write(cabecalho)
+                await escritor.drain()
+                await loop.sendfile(escritor.transport, arquivo, offset, tamanho)
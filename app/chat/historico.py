@@ -0,0 +1,104 @@
+import threading
+from collections import deque
+
+from app.protocol.marshaller import marshall_history
+from app.protocol.message import create_history_batch
+from app.protocol.unmarshaller import unmarshall_frame
+from app.protocol.compression import compress_frame, COMPRESSION_THRESHOLD
+
+CONVERSA_GERAL = 'geral'
+PREFIXO_DIRETA = '@'  # Conversas diretas; nomes de sala não podem começar com ele
+
+
+def conversa_direta(usuario, outro):
+    # Mesma chave para os dois lados da conversa
+    return PREFIXO_DIRETA + '|'.join(sorted((usuario, outro)))
+
+
+def participantes(conversa):
+    if not conversa.startswith(PREFIXO_DIRETA):
+        return ()
+    return tuple(conversa[len(PREFIXO_DIRETA):].split('|'))
+
+
+def registro_decodificado(registro):
+    # Registros do caminho rápido guardam o frame original; o conteúdo
+    # só é extraído quando o registro é persistido ou exibido
+    if 'frame' not in registro:
+        return registro
+    decodificado = {chave: valor for chave, valor in registro.items() if chave != 'frame'}
+    try:
+        decodificado['content'] = unmarshall_frame(registro['frame']).get('content', '')
+    except (ValueError, KeyError):
+        decodificado['content'] = ''
+    return decodificado
+
+
+def entrada_historico(registro):
+    # Converte um registro do storage no formato enviado aos clientes
+    registro = registro_decodificado(registro)
+    return {
+        'sender_id': registro.get('sender', 'Desconhecido'),
+        'content': registro.get('content', ''),
+        'timestamp': registro.get('timestamp', ''),
+    }
+
+
+class HistoricoRecente:
+    """Ring buffer com as mensagens mais recentes de cada conversa.
+
+    É preenchido a partir do storage na inicialização e atualizado a cada
+    broadcast, de modo que novas conexões recebem o histórico sem tocar no
+    banco. O frame de histórico de cada conversa é serializado (e comprimido,
+    para conexões que negociaram compressão) uma única vez e reaproveitado
+    até chegar uma nova mensagem.
+    """
+
+    def __init__(self, capacidade=50, gerar_cursor=None, limiar_compressao=COMPRESSION_THRESHOLD):
+        self.capacidade = capacidade
+        self._gerar_cursor = gerar_cursor
+        self.limiar_compressao = limiar_compressao
+        self._conversas = {}
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def _buffer(self, conversa):
+        buffer = self._conversas.get(conversa)
+        if buffer is None:
+            buffer = self._conversas[conversa] = deque(maxlen=self.capacidade)
+        return buffer
+
+    def carregar(self, mensagens, conversa=CONVERSA_GERAL):
+        # `mensagens` em ordem cronológica (da mais antiga para a mais recente)
+        with self._lock:
+            buffer = self._buffer(conversa)
+            buffer.clear()
+            buffer.extend(mensagens)
+            self._frames.pop(conversa, None)
+
+    def adicionar(self, registro, conversa=CONVERSA_GERAL):
+        with self._lock:
+            self._buffer(conversa).append(registro)
+            self._frames.pop(conversa, None)
+
+    def carregada(self, conversa):
+        with self._lock:
+            return conversa in self._conversas
+
+    def mensagens(self, conversa=CONVERSA_GERAL):
+        with self._lock:
+            return list(self._conversas.get(conversa, ()))
+
+    def frame(self, conversa=CONVERSA_GERAL, comprimido=False):
+        with self._lock:
+            frames = self._frames.get(conversa)
+            if frames is None:
+                registros = list(self._conversas.get(conversa, ()))
+                cursor = None
+                if registros and self._gerar_cursor and len(registros) == self.capacidade:
+                    cursor = self._gerar_cursor(registros[0])
+                batch = create_history_batch([entrada_historico(r) for r in registros], cursor, conversa)
+                frames = self._frames[conversa] = {False: marshall_history(batch)}
+            if comprimido not in frames:
+                frames[comprimido] = compress_frame(frames[False], self.limiar_compressao)
+            return frames[comprimido]
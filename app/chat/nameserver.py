@@ -1,48 +1,168 @@
 import socket
 import threading
 import json
+import math
+import time
+
+TTL_PADRAO = 30  # Segundos que um registro vale sem heartbeat
+TTL_MAXIMO = 300
+TAMANHO_RESPOSTA = 4096
+TAMANHO_MAXIMO_PEDIDO = 64 * 1024  # Pedidos são pequenos; acima disso a conexão é recusada
+PESO_FILA = 64  # Mensagens pendentes na fila de saída que pesam como um cliente a mais
+
+# Campos de carga aceitos no registro: (conversão, mínimo, máximo)
+CAMPOS_CARGA = {
+    'clients': (int, 0, None),
+    'queue': (int, 0, None),
+    'persist_queue': (int, 0, None),
+    'cpu': (float, 0.0, 1.0),
+}
+
+
+def normalizar_carga(carga):
+    # Valida a carga informada por um servidor antes de guardá-la: um valor
+    # não numérico faria falhar todas as consultas pelo nome do serviço
+    if not isinstance(carga, dict):
+        raise ValueError("'load' deve ser um objeto")
+    normalizada = {}
+    for campo, (converter, minimo, maximo) in CAMPOS_CARGA.items():
+        if carga.get(campo) is None:
+            continue
+        try:
+            valor = converter(carga[campo])
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError(f"'load.{campo}' deve ser numérico") from None
+        if isinstance(valor, float) and not math.isfinite(valor) or valor < minimo or (maximo is not None and valor > maximo):
+            raise ValueError(f"'load.{campo}' fora do intervalo: {carga[campo]}")
+        normalizada[campo] = valor
+    return normalizada
+
+
+def pontuacao_carga(carga):
+    # Menor é melhor: clientes conectados (e fila pendente) escalados pela CPU livre
+    clientes = (carga.get('clients') or 0) + (carga.get('queue') or 0) / PESO_FILA
+    return (clientes + 1) / max(1.0 - (carga.get('cpu') or 0.0), 0.1)
+
+
+def ler_ate_eof(conexao, limite=None):
+    # O JSON pode chegar em vários segmentos TCP; o fim vem com o shutdown do outro lado
+    partes = []
+    total = 0
+    while True:
+        parte = conexao.recv(TAMANHO_RESPOSTA)
+        if not parte:
+            break
+        total += len(parte)
+        if limite is not None and total > limite:
+            raise ValueError(f"mais de {limite} bytes")
+        partes.append(parte)
+    return b"".join(partes)
+
+
+def requisitar(host, port, pedido, timeout=3):
+    # Uma requisição JSON por conexão, como o Servidor de Nomes espera
+    with socket.create_connection((host, port), timeout=timeout) as s:
+        s.sendall(json.dumps(pedido).encode('utf-8'))
+        s.shutdown(socket.SHUT_WR)
+        dados = ler_ate_eof(s)
+    return json.loads(dados.decode('utf-8'))
+
 
 class NameServer:
-    
-    def __init__(self, host='0.0.0.0', port=50000):
+    """Servidor de Nomes com várias instâncias por nome de serviço.
+
+    Cada servidor de chat registrado informa sua carga nos heartbeats; a
+    consulta devolve a instância viva menos carregada.
+    """
+
+    def __init__(self, host='0.0.0.0', port=50000, ttl_padrao=TTL_PADRAO, ttl_maximo=TTL_MAXIMO):
         self.host = host
         self.port = port
         self.server_socket = None
-        self.name_mapping = {}
+        self.name_mapping = {}  # nome -> {endereço: (expira_em, carga)}
         self.lock = threading.Lock()
+        self.ttl_padrao = ttl_padrao
+        self.ttl_maximo = ttl_maximo
 
-    def lookup_server(self):
+    def _ttl(self, request):
         try:
-            print(f"[*] Consultando o Servidor de Nomes em {self.name_server_host}:{self.name_server_port}...")
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(3)
-                s.connect((self.name_server_host, self.name_server_port))
-                request = {'action': 'lookup', 'name': self.server_name}
-                s.send(json.dumps(request).encode('utf-8'))
-                response_data = s.recv(1024)
-                response = json.loads(response_data.decode('utf-8'))
-                if response.get('status') == 'found':
-                    self.host, self.port = response['address']
-                    print(f"[+] Servidor encontrado em {self.host}:{self.port}")
-                    return True
+            ttl = float(request.get('ttl') or self.ttl_padrao)
+        except (TypeError, ValueError):
+            ttl = self.ttl_padrao
+        return max(1, min(ttl, self.ttl_maximo))
+
+    def register(self, request, addr):
+        # Sem 'host' no pedido, vale o IP de onde o registro veio
+        name = request['name']
+        address = (request.get('host') or addr[0], int(request['port']))
+        ttl = self._ttl(request)
+        carga = normalizar_carga(request.get('load') or {})
+        with self.lock:
+            instancias = self.name_mapping.setdefault(name, {})
+            novo = address not in instancias
+            instancias[address] = (time.monotonic() + ttl, carga)
+        if novo:
+            print(f"[+] Servidor '{name}' registrado em {address[0]}:{address[1]} (TTL {ttl:g}s, {len(instancias)} instância(s))")
+        return {'status': 'registered', 'ttl': ttl}
+
+    def heartbeat(self, request, addr):
+        # Renova o TTL; um servidor desconhecido (ex.: após reinício do
+        # Servidor de Nomes) é registrado de novo
+        return dict(self.register(request, addr), status='ok')
+
+    def _instancias_vivas(self, name, agora):
+        instancias = self.name_mapping.get(name, {})
+        for address, (expira_em, _) in list(instancias.items()):
+            if expira_em <= agora:
+                del instancias[address]
+                print(f"[*] Registro de '{name}' em {address[0]}:{address[1]} expirou")
+        if not instancias:
+            self.name_mapping.pop(name, None)
+        return instancias
+
+    def lookup(self, request, addr):
+        name = request['name']
+        agora = time.monotonic()
+        with self.lock:
+            instancias = self._instancias_vivas(name, agora)
+            if not instancias:
+                return {'status': 'not_found'}
+            address = min(instancias, key=lambda a: pontuacao_carga(instancias[a][1]))
+            expira_em, carga = instancias[address]
+            # Conta o cliente que vai chegar até o próximo heartbeat, para
+            # que consultas seguidas não mandem todos à mesma instância
+            instancias[address] = (expira_em, dict(carga, clients=carga.get('clients', 0) + 1))
+        return {'status': 'found', 'address': list(address), 'ttl': expira_em - agora, 'instances': len(instancias)}
+
+    ACTIONS = {
+        'register': register,
+        'heartbeat': heartbeat,
+        'lookup': lookup,
+    }
+
+    def handle_client(self, conn, addr):
+        with conn:
+            try:
+                conn.settimeout(5)
+                request = json.loads(ler_ate_eof(conn, TAMANHO_MAXIMO_PEDIDO).decode('utf-8'))
+                action = self.ACTIONS.get(request.get('action'))
+                if action is None:
+                    response = {'status': 'error', 'message': f"Ação desconhecida: {request.get('action')}"}
                 else:
-                    print(f"[AVISO] Servidor '{self.server_name}' não encontrado no Servidor de Nomes.")
-                    return False
-        except socket.timeout:
-            print(f"[AVISO] Tempo limite excedido ao contatar o Servidor de Nomes.")
-        except ConnectionRefusedError:
-            print(f"[AVISO] Servidor de Nomes não está aceitando conexões.")
-        except Exception as e:
-            print(f"[AVISO] Falha ao consultar o Servidor de Nomes: {e}")
-        
-        print(f"[*] Tentando conexão direta...")
-        self.host = '192.168.10.9'
-        self.port = 8080
-        print(f"[*] Usando endereço padrão: {self.host}:{self.port}")
-        return True
+                    response = action(self, request, addr)
+            except (ValueError, KeyError, TypeError) as e:
+                response = {'status': 'error', 'message': f"Pedido inválido: {e}"}
+            except socket.error as e:
+                print(f"[ERRO] Falha ao ler pedido de {addr[0]}:{addr[1]}: {e}")
+                return
+            try:
+                conn.sendall(json.dumps(response).encode('utf-8'))
+            except socket.error:
+                pass
 
     def start(self):
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((self.host, self.port))
         self.server_socket.listen()
         print(f"[*] Servidor de Nomes iniciado e escutando em {self.host}:{self.port}")
@@ -58,6 +178,134 @@ class NameServer:
         finally:
             self.server_socket.close()
 
+
+class ResolvedorNomes:
+    """Cache das consultas ao Servidor de Nomes, respeitando o TTL de cada registro.
+
+    Um endereço em cache é devolvido sem contatar o Servidor de Nomes;
+    passada metade do TTL, ele é renovado em segundo plano. Se o Servidor
+    de Nomes estiver fora do ar, o último endereço conhecido continua
+    sendo usado mesmo depois de expirado.
+    """
+
+    def __init__(self, host, port, timeout=3):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.entradas = {}  # nome -> (endereço, renovar_em, expira_em)
+        self.renovando = set()
+        self.lock = threading.Lock()
+
+    def _consultar(self, nome):
+        resposta = requisitar(self.host, self.port, {'action': 'lookup', 'name': nome}, self.timeout)
+        agora = time.monotonic()
+        with self.lock:
+            if resposta.get('status') != 'found':
+                self.entradas.pop(nome, None)
+                return None
+            endereco = tuple(resposta['address'])
+            ttl = float(resposta.get('ttl') or 0)
+            self.entradas[nome] = (endereco, agora + ttl / 2, agora + ttl)
+        return endereco
+
+    def _renovar(self, nome):
+        try:
+            self._consultar(nome)
+        except (socket.error, ValueError) as e:
+            print(f"[AVISO] Falha ao renovar o endereço de '{nome}': {e}")
+        finally:
+            with self.lock:
+                self.renovando.discard(nome)
+
+    def resolver(self, nome):
+        # Retorna (host, porta) ou None se o nome não estiver registrado;
+        # levanta socket.error se não houver resposta nem endereço em cache
+        agora = time.monotonic()
+        with self.lock:
+            entrada = self.entradas.get(nome)
+            if entrada and agora < entrada[2]:
+                if agora >= entrada[1] and nome not in self.renovando:
+                    self.renovando.add(nome)
+                    threading.Thread(target=self._renovar, args=(nome,), daemon=True).start()
+                return entrada[0]
+
+        try:
+            return self._consultar(nome)
+        except (socket.error, ValueError):
+            if entrada:
+                print(f"[AVISO] Servidor de Nomes indisponível; usando o último endereço de '{nome}'")
+                return entrada[0]
+            raise
+
+    def invalidar(self, nome):
+        # Descarta o endereço, por exemplo quando a conexão a ele falha
+        with self.lock:
+            self.entradas.pop(nome, None)
+
+
+_resolvedores = {}
+_resolvedores_lock = threading.Lock()
+
+
+def resolvedor_para(host, port):
+    # Um cache por Servidor de Nomes, compartilhado por todos os clientes do processo
+    with _resolvedores_lock:
+        resolvedor = _resolvedores.get((host, port))
+        if resolvedor is None:
+            resolvedor = _resolvedores[(host, port)] = ResolvedorNomes(host, port)
+        return resolvedor
+
+
+class RegistroNomes:
+    """Mantém um servidor registrado, enviando heartbeats a cada terço do TTL.
+
+    `carga`, se informada, é chamada a cada envio e sua resposta (clientes,
+    fila de saída, CPU) vai junto, para o Servidor de Nomes escolher a
+    instância menos carregada.
+    """
+
+    def __init__(self, host, port, nome, porta_servidor, host_servidor=None, ttl=TTL_PADRAO, carga=None):
+        self.host = host
+        self.port = port
+        self.pedido = {'name': nome, 'port': porta_servidor, 'ttl': ttl}
+        if host_servidor and host_servidor != '0.0.0.0':
+            self.pedido['host'] = host_servidor
+        self.ttl = ttl
+        self.carga = carga
+        self.parar = threading.Event()
+        self.thread = None
+
+    def _enviar(self, acao):
+        pedido = dict(self.pedido, action=acao)
+        if self.carga:
+            pedido['load'] = self.carga()
+        resposta = requisitar(self.host, self.port, pedido)
+        self.ttl = float(resposta.get('ttl') or self.ttl)
+        return resposta
+
+    def registrar(self):
+        try:
+            resposta = self._enviar('register')
+            print(f"[*] Resposta do Servidor de Nomes: {resposta}")
+        except (socket.error, ValueError) as e:
+            print(f"[ERRO] Falha ao registrar com o Servidor de Nomes: {e}")
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._manter, daemon=True)
+            self.thread.start()
+
+    def _manter(self):
+        # Continua tentando mesmo com o Servidor de Nomes fora do ar; o
+        # heartbeat registra de novo quando ele volta
+        while not self.parar.wait(self.ttl / 3):
+            try:
+                self._enviar('heartbeat')
+            except (socket.error, ValueError) as e:
+                print(f"[AVISO] Heartbeat ao Servidor de Nomes falhou: {e}")
+
+    def encerrar(self):
+        self.parar.set()
+
+
 if __name__ == '__main__':
     name_server = NameServer()
     name_server.start()
@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import deque
+
+POLITICA_BLOQUEAR = 'block'
+POLITICA_DESCARTAR_ANTIGAS = 'drop_oldest'
+POLITICA_DESCARTAR_NOVAS = 'drop_newest'
+POLITICAS = (POLITICA_BLOQUEAR, POLITICA_DESCARTAR_ANTIGAS, POLITICA_DESCARTAR_NOVAS)
+
+
+class FilaPersistencia:
+    """Fila limitada entre o broadcast e o storage.
+
+    O servidor enfileira o registro já com id e timestamp depois de
+    difundi-lo, e uma thread própria o grava em lotes com `gravar_lote`,
+    de modo que a latência de entrega não depende do disco. Com a fila
+    cheia, a política decide: `block` espera até `espera_maxima` segundos
+    por espaço (e descarta o registro se não houver), `drop_oldest`
+    descarta o registro mais antigo e `drop_newest`, o que está chegando.
+    """
+
+    def __init__(self, gravar_lote, limite=10000, politica=POLITICA_BLOQUEAR,
+                 espera_maxima=1.0, tamanho_lote=256):
+        if politica not in POLITICAS:
+            raise ValueError(f"Política de fila de persistência desconhecida: {politica}")
+        self.gravar_lote = gravar_lote
+        self.limite = limite
+        self.politica = politica
+        self.espera_maxima = espera_maxima
+        self.tamanho_lote = tamanho_lote
+
+        self._itens = deque()
+        self._cond = threading.Condition()
+        self._em_gravacao = 0
+        self._fechada = False
+        self._cheia = False  # Para avisar uma vez a cada vez que a fila enche
+
+        # Métricas de back-pressure
+        self.enfileirados = 0
+        self.gravados = 0
+        self.falhas = 0
+        self.descartados = 0
+        self.esperas = 0  # Vezes em que um produtor esperou por espaço
+        self.tempo_espera = 0.0
+        self.pico = 0
+
+        self._thread = threading.Thread(target=self._executar, daemon=True)
+        self._thread.start()
+
+    def enfileirar(self, registro):
+        # Retorna False se o registro foi descartado
+        with self._cond:
+            return self._enfileirar(registro)
+
+    def tentar_enfileirar(self, registro):
+        # Versão que nunca espera, para o event loop: retorna None quando a
+        # política 'block' precisaria esperar por espaço, sem contar nada;
+        # fora isso, o mesmo resultado de enfileirar
+        with self._cond:
+            if self.politica == POLITICA_BLOQUEAR and len(self._itens) >= self.limite and not self._fechada:
+                return None
+            return self._enfileirar(registro)
+
+    def _enfileirar(self, registro):
+        # Chamado com self._cond adquirido
+        if self._fechada:
+            self.descartados += 1
+            return False
+        if len(self._itens) >= self.limite and not self._abrir_espaco():
+            self.descartados += 1
+            return False
+        self._itens.append(registro)
+        self.enfileirados += 1
+        self.pico = max(self.pico, len(self._itens))
+        self._cond.notify_all()
+        return True
+
+    def _abrir_espaco(self):
+        # Chamado com a fila cheia e self._cond adquirido
+        if not self._cheia:
+            self._cheia = True
+            print(f"[AVISO] Fila de persistência cheia ({self.limite} registros); aplicando '{self.politica}'")
+        if self.politica == POLITICA_DESCARTAR_NOVAS:
+            return False
+        if self.politica == POLITICA_DESCARTAR_ANTIGAS:
+            self._itens.popleft()
+            self.descartados += 1
+            return True
+        self.esperas += 1
+        inicio = time.monotonic()
+        livre = self._cond.wait_for(lambda: len(self._itens) < self.limite or self._fechada, self.espera_maxima)
+        self.tempo_espera += time.monotonic() - inicio
+        return livre and not self._fechada
+
+    def _proximo_lote(self):
+        with self._cond:
+            while not self._itens:
+                if self._fechada:
+                    return None
+                self._cond.wait()
+            lote = [self._itens.popleft() for _ in range(min(self.tamanho_lote, len(self._itens)))]
+            self._em_gravacao = len(lote)
+            if self._cheia and len(self._itens) < self.limite // 2:
+                self._cheia = False
+            self._cond.notify_all()
+            return lote
+
+    def _executar(self):
+        while True:
+            lote = self._proximo_lote()
+            if lote is None:
+                return
+            try:
+                gravados = self.gravar_lote(lote)
+            except Exception as e:
+                print(f"[ERRO] Falha ao persistir {len(lote)} mensagens: {e}")
+                gravados = 0
+            with self._cond:
+                self.gravados += gravados
+                self.falhas += len(lote) - gravados
+                self._em_gravacao = 0
+                self._cond.notify_all()
+
+    def esvaziar(self, timeout=None):
+        # Espera até que tudo o que foi enfileirado tenha sido gravado
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._itens and not self._em_gravacao, timeout)
+
+    def encerrar(self, timeout=None):
+        esvaziada = self.esvaziar(timeout)
+        with self._cond:
+            self._fechada = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        return esvaziada
+
+    def __len__(self):
+        return len(self._itens)
+
+    def metricas(self):
+        with self._cond:
+            return {
+                'depth': len(self._itens) + self._em_gravacao,
+                'limit': self.limite,
+                'peak': self.pico,
+                'queued': self.enfileirados,
+                'stored': self.gravados,
+                'failed': self.falhas,
+                'dropped': self.descartados,
+                'waits': self.esperas,
+                'wait_seconds': round(self.tempo_espera, 3),
+            }
@@ -0,0 +1,223 @@
+import asyncio
+import socket
+
+from app.chat.Servidor import ServidorChat, TAMANHO_RECV
+from app.chat.fila_saida import FilaSaida, EnvioArquivo
+from app.protocol.unmarshaller import unmarshall_frame
+from app.protocol.framing import FrameDecoder, FrameError, frame_bytes, FRAME_FILE
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class ServidorChatAsync(ServidorChat):
+    """Motor asyncio do servidor de chat.
+
+    Mantém o mesmo comportamento do ServidorChat (registro no servidor de
+    nomes, histórico na conexão e broadcast), mas atende todas as conexões
+    em um único event loop em vez de uma thread por cliente. As chamadas
+    bloqueantes de storage rodam no executor padrão do loop.
+    """
+
+    def __init__(self, *args, backlog=4096, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.backlog = backlog
+        self.loop = None
+
+    def _aumentar_limite_descritores(self):
+        # Cada conexão ociosa ocupa um descritor; sobe o limite soft até o hard
+        if resource is None:
+            return
+        try:
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            if soft < hard:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+                print(f"[*] Limite de descritores elevado de {soft} para {hard}")
+        except (ValueError, OSError) as e:
+            print(f"[AVISO] Não foi possível elevar o limite de descritores: {e}")
+
+    async def transmitir_mensagem_async(self, frame, sessao, msg_dict=None):
+        envio = self._preparar_envio(frame, sessao, msg_dict)
+        if envio is None:
+            return
+        registro, destinos = envio
+
+        if self.gravar_antes_de_entregar:
+            # A decodificação e o fsync do journal rodam fora do loop; a entrega espera por eles
+            if not await self.loop.run_in_executor(None, self._gravar_no_journal, registro):
+                self._recusar_mensagem(sessao, registro)
+                return
+        self._adicionar_historico(registro)
+        self._difundir(frame_bytes(frame), sessao, destinos)
+
+        if self.fila_persistencia is None:
+            return
+        enfileirado = self.fila_persistencia.tentar_enfileirar(registro)
+        if enfileirado is None:
+            # Fila cheia com a política 'block': a espera por espaço fica numa
+            # thread do executor e só segura a leitura deste cliente, não o loop
+            await self.loop.run_in_executor(None, self._enfileirar_persistencia, registro)
+        elif not enfileirado:
+            print(f"[AVISO] Mensagem {registro['id']} descartada: fila de persistência cheia")
+
+    def _descritor(self, escritor):
+        return escritor.get_extra_info("socket").fileno()
+
+    def _criar_fila_saida(self, sessao):
+        evento = asyncio.Event()
+        fila = FilaSaida(self.limite_fila_saida, self.politica_consumidor_lento, notificar=evento.set)
+        self.loop.create_task(self._escritor_async(sessao, fila, evento))
+        return fila
+
+    async def _escritor_async(self, sessao, fila, evento):
+        try:
+            while True:
+                await evento.wait()
+                evento.clear()
+                lote = fila.retirar_disponiveis()
+                if fila.fechada:
+                    break
+                if lote:
+                    sessao.frames_enviados += len(lote)
+                    await self._enviar_lote_async(sessao.conexao, lote)
+        except (ConnectionError, socket.error):
+            pass
+        finally:
+            self.remover_cliente(sessao)
+
+    async def _enviar_lote_async(self, escritor, lote):
+        pendentes = []
+        for item in lote:
+            if isinstance(item, EnvioArquivo):
+                if pendentes:
+                    escritor.write(b"".join(pendentes))
+                    pendentes = []
+                await item.enviar_async(self.loop, escritor)
+            else:
+                pendentes.append(item)
+        if pendentes:
+            escritor.write(b"".join(pendentes))
+        await escritor.drain()
+
+    def _fechar_conexao(self, escritor):
+        escritor.close()
+
+    async def processar_frame_async(self, frame, sessao):
+        sessao.frames_recebidos += 1
+        await self._tratar_frame_async(frame, sessao)
+        if sessao.aguardando_historico:
+            sessao.aguardando_historico = False
+            self.enviar_historico(sessao)
+
+    async def _tratar_frame_async(self, frame, sessao):
+        if frame.type == FRAME_FILE:
+            if self.attachment_store:
+                self._responder(sessao, *await self.loop.run_in_executor(None, self._gravar_chunk, frame))
+            else:
+                self.retransmitir_arquivo(frame, sessao)
+            return
+
+        if self._caminho_rapido(frame, sessao):
+            await self.transmitir_mensagem_async(frame, sessao)
+            return
+
+        try:
+            msg_dict = unmarshall_frame(frame)
+            print(f"[*] Mensagem recebida: {msg_dict.get('type')} {msg_dict.get('content', '')}")
+        except Exception as e:
+            print(f"[ERRO] Mensagem inválida recebida: {e}")
+            return
+
+        await self.processar_mensagem_async(msg_dict, sessao, frame)
+
+    async def processar_mensagem_async(self, msg_dict, sessao, frame):
+        tipo = msg_dict.get("type")
+        if tipo == "hello":
+            self._negociar(msg_dict, sessao)
+            return
+        if tipo == "join":
+            # A primeira entrada em uma sala carrega o histórico dela do storage
+            self._responder(sessao, await self.loop.run_in_executor(None, self._entrar_sala, sessao, msg_dict["room"]))
+            return
+        if tipo == "leave":
+            self._responder(sessao, self._sair_sala(sessao, msg_dict["room"]))
+            return
+        if tipo == "history_request":
+            self.enviar_para(sessao, await self.loop.run_in_executor(None, self._pedido_historico, sessao, msg_dict))
+            return
+        if tipo == "search_request":
+            self.enviar_para(sessao, await self.loop.run_in_executor(None, self._pedido_busca, sessao, msg_dict))
+            return
+        if tipo == "file_offer":
+            self._responder(sessao, *await self.loop.run_in_executor(None, self._aceitar_upload, sessao, msg_dict))
+            return
+        if tipo == "file_request":
+            self.enviar_para(sessao, await self.loop.run_in_executor(None, self._envio_anexo, msg_dict))
+            return
+
+        if tipo == "text":
+            self._identificar_usuario(msg_dict, sessao)
+            await self.transmitir_mensagem_async(frame, sessao, msg_dict)
+
+    async def lidar_cliente_async(self, leitor, escritor):
+        endereco_cliente = escritor.get_extra_info("peername") or ("?", 0)
+        sessao, total = self._registrar_cliente(escritor, endereco_cliente)
+        print(f"[+] Nova conexão de {endereco_cliente[0]}:{endereco_cliente[1]}")
+        print(f"[*] Total de clientes conectados: {total}")
+
+        decoder = FrameDecoder()
+
+        try:
+            while True:
+                dados = await leitor.read(TAMANHO_RECV)
+                if not dados:
+                    break
+
+                try:
+                    frames = decoder.feed(dados)
+                except FrameError as e:
+                    print(f"[ERRO] Fluxo inválido de {endereco_cliente[0]}: {e}")
+                    break
+
+                for frame in frames:
+                    await self.processar_frame_async(frame, sessao)
+
+                # Cede o loop para os escritores esvaziarem as filas de saída
+                await asyncio.sleep(0)
+        except (ConnectionError, socket.error):
+            pass
+        finally:
+            self.remover_cliente(sessao)
+
+    async def _executar(self):
+        self.loop = asyncio.get_running_loop()
+        await self.loop.run_in_executor(None, self.register_with_name_server)
+        await self.loop.run_in_executor(None, self.carregar_historico)
+
+        servidor = await asyncio.start_server(
+            self.lidar_cliente_async, self.host, self.port,
+            backlog=self.backlog, reuse_address=True
+        )
+        self.servidor_socket = servidor
+
+        print(f"[*] Servidor de chat (asyncio) iniciado e escutando em {self.host}:{self.port}")
+        print(f"[*] Storage {'conectado' if self.storage_api else 'não disponível'}")
+
+        async with servidor:
+            await servidor.serve_forever()
+
+    def iniciar_servidor(self):
+        self._aumentar_limite_descritores()
+        try:
+            asyncio.run(self._executar())
+        except KeyboardInterrupt:
+            print("\n[!] Servidor sendo desligado...")
+        finally:
+            self.encerrar_persistencia()
+
+
+if __name__ == '__main__':
+    servidor_chat = ServidorChatAsync()
+    servidor_chat.iniciar_servidor()
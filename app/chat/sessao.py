@@ -0,0 +1,35 @@
+class SessaoCliente:
+    """Estado de uma conexão de cliente no servidor de chat.
+
+    Reúne o que antes ficava espalhado em listas e dicionários indexados
+    pelo socket: usuário, salas inscritas, fila de saída, compressão
+    negociada e contadores. Com __slots__, cada sessão ocupa um tamanho
+    fixo e pequeno mesmo com dezenas de milhares de conexões.
+
+    `conexao` é o socket (motor com threads) ou o StreamWriter (motor
+    asyncio); `fd` é o descritor, chave do registro de sessões do servidor.
+    """
+
+    __slots__ = (
+        "conexao", "fd", "endereco", "usuario", "salas", "fila",
+        "comprimida", "aguardando_historico", "frames_recebidos", "frames_enviados",
+    )
+
+    def __init__(self, conexao, fd, endereco=None):
+        self.conexao = conexao
+        self.fd = fd
+        self.endereco = endereco
+        self.usuario = None
+        self.salas = set()
+        self.fila = None
+        self.comprimida = False
+        self.aguardando_historico = True  # Até o primeiro frame, que pode negociar compressão
+        self.frames_recebidos = 0
+        self.frames_enviados = 0
+
+    @property
+    def nome(self):
+        return self.usuario or "Desconhecido"
+
+    def __repr__(self):
+        return f"SessaoCliente(fd={self.fd}, usuario={self.usuario!r}, salas={len(self.salas)})"
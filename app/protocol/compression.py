@@ -0,0 +1,75 @@
+import zlib
+
+from app.protocol.framing import (
+    HEADER, HEADER_SIZE, MAX_FRAME_SIZE, FRAME_FILE, FrameError, encode_frame
+)
+
+# Bit do campo flags do cabeçalho que indica payload comprimido
+FLAG_COMPRESSED = 0x0001
+
+COMPRESSION_ZLIB = "zlib"
+SUPPORTED_COMPRESSION = (COMPRESSION_ZLIB,)
+
+# Payloads menores que isso não compensam a compressão
+COMPRESSION_THRESHOLD = 256
+COMPRESSION_LEVEL = 6
+
+# Dicionário compartilhado com os trechos que se repetem em todo frame do
+# protocolo; os mais frequentes ficam no fim, onde o zlib os alcança com
+# distâncias menores.
+ZDICT = (
+    b'"filename": "", "filesize": , "chunk_index": , "total_chunks": , "sha256": "'
+    b'{"type": "history", "messages": [], "cursor": null}'
+    b'{"type": "history_request", "cursor": "", "limit": 50}'
+    b' entrou no chat)", "'
+    b'{"sender_id": "Sistema", "content": "", "timestamp": "2026-01-01T00:00:00.000000"}, '
+    b'{"type": "text", "sender_id": "", "timestamp": "2026-01-01T00:00:00.000000+00:00", '
+    b'"content": "", "message_id": ""}'
+)
+
+
+def compress_payload(payload: bytes) -> bytes:
+    # Deflate cru (sem cabeçalho zlib), sempre com o mesmo dicionário
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=ZDICT)
+    return compressor.compress(payload) + compressor.flush()
+
+
+def decompress_payload(data: bytes, max_size: int = MAX_FRAME_SIZE) -> bytes:
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=ZDICT)
+    try:
+        payload = decompressor.decompress(data, max_size)
+    except zlib.error as e:
+        raise FrameError(f"Payload comprimido inválido: {e}")
+    if decompressor.unconsumed_tail:
+        raise FrameError(f"Payload descomprimido excede o tamanho máximo: {max_size} bytes")
+    return payload
+
+
+def frame_payload(frame) -> bytes:
+    # Payload original de um frame decodificado, comprimido ou não
+    if frame.flags & FLAG_COMPRESSED:
+        return decompress_payload(frame.payload)
+    return frame.payload
+
+
+def compress_frame(data: bytes, threshold: int = COMPRESSION_THRESHOLD) -> bytes:
+    """Versão comprimida de um frame já serializado.
+
+    Frames de arquivo, já comprimidos ou menores que o limiar (ou que não
+    diminuem) são devolvidos sem alteração.
+    """
+    _, frame_type, flags, length = HEADER.unpack_from(data)
+    if frame_type == FRAME_FILE or flags & FLAG_COMPRESSED or length < threshold:
+        return data
+    comprimido = compress_payload(data[HEADER_SIZE:])
+    if len(comprimido) >= length:
+        return data
+    return encode_frame(frame_type, comprimido, flags | FLAG_COMPRESSED)
+
+
+def decompress_frame(data: bytes) -> bytes:
+    # Versão sem compressão de um frame serializado, para conexões que não a negociaram
+    _, frame_type, flags, _ = HEADER.unpack_from(data)
+    if not flags & FLAG_COMPRESSED:
+        return data
+    return encode_frame(frame_type, decompress_payload(data[HEADER_SIZE:]), flags & ~FLAG_COMPRESSED)
@@ -1,28 +1,114 @@
-from . import datetime, timezone
+import hashlib
+import os
+import struct
 
-def create_file_transfer(sender_id: str, filename: str, data_bytes: bytes, chunk_size: int = 65536) -> list:
-    total_size = len(data_bytes)
-    chunks = []
+from . import datetime, timezone, json
+
+# Payload de um frame FRAME_FILE: tamanho dos metadados (2 bytes),
+# metadados em JSON e, em seguida, os bytes crus do chunk.
+FILE_META_HEADER = struct.Struct("!H")
+DEFAULT_CHUNK_SIZE = 65536
+
+
+def _file_size(fileobj) -> int:
+    try:
+        return len(fileobj)  # mmap e objetos bytes-like
+    except TypeError:
+        posicao = fileobj.tell()
+        fileobj.seek(0, os.SEEK_END)
+        tamanho = fileobj.tell()
+        fileobj.seek(posicao)
+        return tamanho
+
+
+def file_digest(fileobj, block_size: int = 1024 * 1024) -> str:
+    # SHA-256 do conteúdo, lido em blocos; o arquivo volta para o início
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for block in iter(lambda: fileobj.read(block_size), b""):
+        digest.update(block)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def _routing(room: str = None, to: str = None) -> dict:
+    # Campos de destino opcionais, como em create_message
+    campos = {}
+    if room:
+        campos["room"] = room
+    if to:
+        campos["to"] = to
+    return campos
+
+
+def iter_file_chunks(sender_id: str, filename: str, fileobj, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                     message_id: str = "", start_chunk: int = 0, room: str = None, to: str = None):
+    # Lê o arquivo (ou mmap) sob demanda: só um chunk fica em memória por vez
+    destino = _routing(room, to)
+    total_size = _file_size(fileobj)
     total_chunks = (total_size + chunk_size - 1) // chunk_size
-    for idx in range(total_chunks):
-        start = idx * chunk_size
-        end = start + chunk_size
-        chunk_data = data_bytes[start:end]
-        chunks.append({
+    timestamp = datetime.now(timezone.utc).isoformat()
+    if start_chunk:
+        fileobj.seek(start_chunk * chunk_size)
+    for idx in range(start_chunk, total_chunks):
+        chunk_data = fileobj.read(chunk_size)
+        if not chunk_data:
+            raise ValueError(f"Arquivo terminou antes do esperado no chunk {idx}")
+        yield {
             "type": "file",
             "sender_id": sender_id,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "timestamp": timestamp,
             "filename": filename,
             "filesize": total_size,
             "chunk_index": idx,
+            "chunk_size": chunk_size,
             "total_chunks": total_chunks,
-            "data": chunk_data.hex(),  # converte bytes para hex para JSON
-            "message_id": "",
-        })
-    return chunks
+            "data": chunk_data,
+            "message_id": message_id,
+            **destino,
+        }
+
+
+def create_file_transfer(sender_id: str, filename: str, data_bytes: bytes, chunk_size: int = DEFAULT_CHUNK_SIZE) -> list:
+    # Mantido por compatibilidade; para arquivos grandes use iter_file_chunks
+    from io import BytesIO
+    return list(iter_file_chunks(sender_id, filename, BytesIO(data_bytes), chunk_size))
+
+
+def file_chunk_meta(chunk: dict) -> bytes:
+    # Prefixo do payload (tamanho + metadados); os bytes do chunk vêm logo depois
+    meta = {chave: valor for chave, valor in chunk.items() if chave != "data"}
+    meta_bytes = json.dumps(meta).encode("utf-8")
+    return FILE_META_HEADER.pack(len(meta_bytes)) + meta_bytes
 
 
-def file_dict_to_chunks(data: dict) -> dict:
+def file_chunk_to_binary(chunk: dict) -> bytes:
+    return file_chunk_meta(chunk) + chunk["data"]
+
+
+def _split_file_chunk(payload: bytes):
+    if len(payload) < FILE_META_HEADER.size:
+        raise ValueError("Chunk de arquivo truncado")
+    (meta_size,) = FILE_META_HEADER.unpack_from(payload)
+    inicio = FILE_META_HEADER.size + meta_size
+    if inicio > len(payload):
+        raise ValueError("Metadados do chunk de arquivo truncados")
+    return json.loads(payload[FILE_META_HEADER.size:inicio].decode("utf-8")), inicio
+
+
+def file_chunk_meta_from_binary(payload: bytes) -> dict:
+    # Só os metadados, sem copiar os bytes do chunk (usado para rotear o frame)
+    return _split_file_chunk(payload)[0]
+
+
+def binary_to_file_chunk(payload: bytes) -> dict:
+    data, inicio = _split_file_chunk(payload)
+    chunk = file_dict_to_chunks(data, payload[inicio:])
+    chunk["type"] = "file"
+    return chunk
+
+
+def file_dict_to_chunks(data: dict, raw: bytes = None) -> dict:
     if data.get("type") != "file":
         raise ValueError(f"Tipo inesperado: {data.get('type')}")
     return {
@@ -31,7 +117,127 @@ def file_dict_to_chunks(data: dict) -> dict:
         "filename": data["filename"],
         "filesize": data["filesize"],
         "chunk_index": data["chunk_index"],
+        "chunk_size": data.get("chunk_size", DEFAULT_CHUNK_SIZE),
         "total_chunks": data["total_chunks"],
-        "data": bytes.fromhex(data["data"]),
-        "message_id": "",
+        # Formato antigo (JSON) trazia os bytes em hex
+        "data": raw if raw is not None else bytes.fromhex(data["data"]),
+        "message_id": data.get("message_id", ""),
+        **_routing(data.get("room"), data.get("to")),
     }
+
+
+# Mensagens de controle do armazenamento de anexos no servidor
+FILE_CONTROL_FIELDS = {
+    # Cliente anuncia um upload; o servidor responde com file_ack
+    "file_offer": ("sender_id", "filename", "filesize", "sha256", "chunk_size"),
+    # Chunk a partir do qual o upload deve continuar
+    "file_ack": ("sha256", "next_chunk", "complete", "stored"),
+    # Pedido de download de um anexo já armazenado
+    "file_request": ("sha256", "filename"),
+    # Aviso de anexo disponível, difundido aos clientes da sala
+    "attachment": ("sender_id", "filename", "filesize", "sha256"),
+}
+
+# Sala ou destinatário do arquivo; sem eles, vale a sala geral
+FILE_ROUTING_FIELDS = ("room", "to")
+
+
+def create_file_offer(sender_id: str, filename: str, filesize: int, sha256: str,
+                      chunk_size: int = DEFAULT_CHUNK_SIZE, room: str = None, to: str = None) -> dict:
+    return {
+        "type": "file_offer",
+        "sender_id": sender_id,
+        "filename": filename,
+        "filesize": filesize,
+        "sha256": sha256,
+        "chunk_size": chunk_size,
+        **_routing(room, to),
+    }
+
+
+def create_file_ack(sha256: str, next_chunk: int, complete: bool = False, stored: bool = True) -> dict:
+    return {
+        "type": "file_ack",
+        "sha256": sha256,
+        "next_chunk": next_chunk,
+        "complete": complete,
+        "stored": stored,
+    }
+
+
+def create_file_request(sha256: str, filename: str = "") -> dict:
+    return {
+        "type": "file_request",
+        "sha256": sha256,
+        "filename": filename,
+    }
+
+
+def create_attachment(sender_id: str, filename: str, filesize: int, sha256: str,
+                      room: str = None, to: str = None) -> dict:
+    return {
+        "type": "attachment",
+        "sender_id": sender_id,
+        "filename": filename,
+        "filesize": filesize,
+        "sha256": sha256,
+        **_routing(room, to),
+    }
+
+
+def dict_to_file_control(data: dict) -> dict:
+    campos = FILE_CONTROL_FIELDS.get(data.get("type"))
+    if campos is None:
+        raise ValueError(f"Tipo inesperado: {data.get('type')}")
+    faltando = [campo for campo in campos if campo not in data]
+    if faltando:
+        raise ValueError(f"Campos ausentes em {data['type']}: {', '.join(faltando)}")
+    resultado = {"type": data["type"]}
+    for campo in campos:
+        resultado[campo] = data[campo]
+    for campo in FILE_ROUTING_FIELDS:
+        if data.get(campo):
+            resultado[campo] = data[campo]
+    return resultado
+
+
+class FileReceiver:
+    """Grava os chunks recebidos direto no disco, na posição de cada um.
+
+    Nada além do chunk atual fica em memória; o arquivo é fechado quando
+    todos os chunks da transferência chegam.
+    """
+
+    def __init__(self, directory: str = "downloads"):
+        self.directory = directory
+        self._transfers = {}
+
+    def write_chunk(self, chunk: dict):
+        # Retorna o caminho do arquivo quando a transferência termina, senão None
+        chave = (chunk["sender_id"], chunk["filename"], chunk.get("message_id", ""))
+        transfer = self._transfers.get(chave)
+        if transfer is None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, os.path.basename(chunk["filename"]) or "arquivo")
+            transfer = self._transfers[chave] = {
+                "path": path,
+                "file": open(path, "wb"),
+                "received": set(),
+            }
+
+        arquivo = transfer["file"]
+        arquivo.seek(chunk["chunk_index"] * chunk["chunk_size"])
+        arquivo.write(chunk["data"])
+        transfer["received"].add(chunk["chunk_index"])
+
+        if len(transfer["received"]) < chunk["total_chunks"]:
+            return None
+        arquivo.truncate(chunk["filesize"])
+        arquivo.close()
+        del self._transfers[chave]
+        return transfer["path"]
+
+    def close(self):
+        for transfer in self._transfers.values():
+            transfer["file"].close()
+        self._transfers.clear()
@@ -0,0 +1,92 @@
+import struct
+from collections import namedtuple
+
+# Cabeçalho fixo de cada frame: versão (1 byte), tipo (1 byte),
+# flags (2 bytes) e tamanho do payload (4 bytes), em network byte order.
+HEADER = struct.Struct("!BBHI")
+HEADER_SIZE = HEADER.size
+
+PROTOCOL_VERSION = 1
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+FRAME_TEXT = 1
+FRAME_FILE = 2
+FRAME_HISTORY = 3
+FRAME_CONTROL = 4
+
+# `raw` guarda os bytes do frame como chegaram (cabeçalho + payload)
+Frame = namedtuple("Frame", ["type", "flags", "payload", "raw"], defaults=(None,))
+
+
+class FrameError(ValueError):
+    pass
+
+
+def encode_frame_header(frame_type: int, length: int, flags: int = 0) -> bytes:
+    # Só o cabeçalho, para quem envia o payload separadamente (ex.: sendfile)
+    if length > MAX_FRAME_SIZE:
+        raise FrameError(f"Frame excede o tamanho máximo: {length} bytes")
+    return HEADER.pack(PROTOCOL_VERSION, frame_type, flags, length)
+
+
+def encode_frame(frame_type: int, payload: bytes, flags: int = 0) -> bytes:
+    return encode_frame_header(frame_type, len(payload), flags) + payload
+
+
+def frame_bytes(frame) -> bytes:
+    # Bytes de um frame recebido, prontos para serem retransmitidos como estão
+    if frame.raw is not None:
+        return frame.raw
+    return encode_frame(frame.type, frame.payload, frame.flags)
+
+
+def decode_frame(buffer, offset: int = 0, max_frame_size: int = MAX_FRAME_SIZE):
+    """Lê um frame de `buffer` a partir de `offset`.
+
+    Retorna (frame, próximo offset) ou (None, offset) se o frame ainda
+    não chegou por completo.
+    """
+    if len(buffer) - offset < HEADER_SIZE:
+        return None, offset
+    version, frame_type, flags, length = HEADER.unpack_from(buffer, offset)
+    if version != PROTOCOL_VERSION:
+        raise FrameError(f"Versão de protocolo desconhecida: {version}")
+    if length > max_frame_size:
+        raise FrameError(f"Frame excede o tamanho máximo: {length} bytes")
+    start = offset + HEADER_SIZE
+    end = start + length
+    if end > len(buffer):
+        return None, offset
+    raw = bytes(buffer[offset:end])
+    return Frame(frame_type, flags, raw[HEADER_SIZE:], raw), end
+
+
+class FrameDecoder:
+    """Decodificador incremental de frames.
+
+    Acumula os bytes recebidos do socket e devolve todos os frames
+    completos a cada chamada de `feed`, mantendo o restante para a
+    próxima leitura.
+    """
+
+    def __init__(self, max_frame_size: int = MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> list:
+        buffer = self._buffer
+        buffer += data
+        frames = []
+        offset = 0
+        while True:
+            frame, offset_seguinte = decode_frame(buffer, offset, self.max_frame_size)
+            if frame is None:
+                break
+            frames.append(frame)
+            offset = offset_seguinte
+        if offset:
+            del buffer[:offset]
+        return frames
+
+    def pending(self) -> int:
+        return len(self._buffer)
@@ -1,11 +1,35 @@
 from app.protocol.message import message_to_dict
+from app.protocol.file_transfer import file_chunk_to_binary, file_chunk_meta, iter_file_chunks, DEFAULT_CHUNK_SIZE
+from app.protocol.framing import encode_frame, encode_frame_header, FRAME_TEXT, FRAME_FILE, FRAME_HISTORY, FRAME_CONTROL
 from . import json
 
 def marshall_message(msg: dict) -> bytes:
     payload = message_to_dict(msg)
-    return json.dumps(payload).encode("utf-8")
+    return encode_frame(FRAME_TEXT, json.dumps(payload).encode("utf-8"))
 
 
 def marshall_file_chunk(file_chunk: dict) -> bytes:
-    # Supondo que file_chunk já esteja em formato de dicionário válido
-    return json.dumps(file_chunk).encode("utf-8")
+    # Bytes do chunk vão crus no frame, sem hex/JSON
+    return encode_frame(FRAME_FILE, file_chunk_to_binary(file_chunk))
+
+
+def marshall_file_chunk_header(chunk_meta: dict, data_size: int) -> bytes:
+    # Tudo o que precede os bytes do chunk no frame; o conteúdo pode ser
+    # enviado depois direto do disco (sendfile)
+    meta = file_chunk_meta(chunk_meta)
+    return encode_frame_header(FRAME_FILE, len(meta) + data_size) + meta
+
+
+def marshall_file(sender_id: str, filename: str, fileobj, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                  message_id: str = "", start_chunk: int = 0, room: str = None, to: str = None):
+    # Gerador de frames: o arquivo é lido e enviado um chunk por vez
+    for chunk in iter_file_chunks(sender_id, filename, fileobj, chunk_size, message_id, start_chunk, room, to):
+        yield marshall_file_chunk(chunk)
+
+
+def marshall_history(batch: dict) -> bytes:
+    return encode_frame(FRAME_HISTORY, json.dumps(batch).encode("utf-8"))
+
+
+def marshall_control(msg: dict) -> bytes:
+    return encode_frame(FRAME_CONTROL, json.dumps(msg).encode("utf-8"))
@@ -1,13 +1,30 @@
 from . import datetime, timezone
 
-def create_message(sender_id: str, content: str) -> dict:
-    return {
+# Chaves de roteamento de uma mensagem de texto, como aparecem no JSON.
+# Sem nenhuma delas a mensagem vai para a sala geral.
+ROUTING_KEYS = (b'"room"', b'"to"')
+
+
+def create_message(sender_id: str, content: str, room: str = None, to: str = None) -> dict:
+    # `room` envia para uma sala; `to`, direto para um usuário
+    msg = {
         "type": "text",
         "sender_id": sender_id,
         "timestamp": datetime.now(timezone.utc).isoformat(),
         "content": content,
         "message_id": "",
     }
+    if room:
+        msg["room"] = room
+    if to:
+        msg["to"] = to
+    return msg
+
+
+def payload_has_routing(payload: bytes) -> bool:
+    # Busca só pelos bytes das chaves, sem decodificar o JSON; um falso
+    # positivo (ex.: conteúdo igual a "room") só faz a mensagem ser decodificada
+    return any(chave in payload for chave in ROUTING_KEYS)
 
 
 def message_to_dict(msg: dict) -> dict:
@@ -24,4 +41,143 @@ def dict_to_message(data: dict) -> dict:
         "timestamp": data["timestamp"],
         "content": data["content"],
         "message_id": "",
+        "room": data.get("room"),
+        "to": data.get("to"),
+    }
+
+
+def create_history_batch(messages: list, cursor=None, room: str = None) -> dict:
+    # Lote de histórico enviado em um único frame; `cursor` aponta para a página anterior
+    return {
+        "type": "history",
+        "messages": messages,
+        "cursor": cursor,
+        "room": room,
+    }
+
+
+def create_history_request(cursor=None, limit: int = 50, room: str = None) -> dict:
+    return {
+        "type": "history_request",
+        "cursor": cursor,
+        "limit": limit,
+        "room": room,
+    }
+
+
+def dict_to_history(data: dict) -> dict:
+    if data.get("type") != "history":
+        raise ValueError(f"Tipo inesperado: {data.get('type')}")
+    return {
+        "type": data["type"],
+        "messages": data.get("messages", []),
+        "cursor": data.get("cursor"),
+        "room": data.get("room"),
+    }
+
+
+def dict_to_history_request(data: dict) -> dict:
+    if data.get("type") != "history_request":
+        raise ValueError(f"Tipo inesperado: {data.get('type')}")
+    return {
+        "type": data["type"],
+        "cursor": data.get("cursor"),
+        "limit": int(data.get("limit", 50)),
+        "room": data.get("room"),
+    }
+
+
+def create_search_request(query: str, cursor=None, limit: int = 20, room: str = None) -> dict:
+    return {
+        "type": "search_request",
+        "query": query,
+        "cursor": cursor,
+        "limit": limit,
+        "room": room,
+    }
+
+
+def create_search_results(query: str, messages: list, cursor=None, room: str = None) -> dict:
+    # Resultados mais recentes primeiro; `cursor` pede a próxima página da mesma busca
+    return {
+        "type": "search_results",
+        "query": query,
+        "messages": messages,
+        "cursor": cursor,
+        "room": room,
+    }
+
+
+def dict_to_search_request(data: dict) -> dict:
+    if data.get("type") != "search_request":
+        raise ValueError(f"Tipo inesperado: {data.get('type')}")
+    return {
+        "type": data["type"],
+        "query": str(data.get("query", "")),
+        "cursor": data.get("cursor"),
+        "limit": int(data.get("limit", 20)),
+        "room": data.get("room"),
+    }
+
+
+def dict_to_search_results(data: dict) -> dict:
+    if data.get("type") != "search_results":
+        raise ValueError(f"Tipo inesperado: {data.get('type')}")
+    return {
+        "type": data["type"],
+        "query": data.get("query", ""),
+        "messages": data.get("messages", []),
+        "cursor": data.get("cursor"),
+        "room": data.get("room"),
+    }
+
+
+def create_join(room: str) -> dict:
+    # Inscreve a conexão na sala; o servidor responde com o histórico dela
+    return {
+        "type": "join",
+        "room": room,
+    }
+
+
+def create_leave(room: str) -> dict:
+    return {
+        "type": "leave",
+        "room": room,
+    }
+
+
+def dict_to_room_control(data: dict) -> dict:
+    if data.get("type") not in ("join", "leave"):
+        raise ValueError(f"Tipo inesperado: {data.get('type')}")
+    if not isinstance(data.get("room"), str):
+        raise ValueError(f"Campo 'room' ausente em {data['type']}")
+    return {
+        "type": data["type"],
+        "room": data["room"],
+    }
+
+
+def create_hello(compression: list = None) -> dict:
+    # Primeira mensagem da conexão: capacidades suportadas pelo cliente
+    return {
+        "type": "hello",
+        "compression": list(compression or []),
+    }
+
+
+def create_hello_ack(compression=None) -> dict:
+    # Resposta do servidor com a compressão escolhida (None = sem compressão)
+    return {
+        "type": "hello_ack",
+        "compression": compression,
+    }
+
+
+def dict_to_hello(data: dict) -> dict:
+    if data.get("type") not in ("hello", "hello_ack"):
+        raise ValueError(f"Tipo inesperado: {data.get('type')}")
+    return {
+        "type": data["type"],
+        "compression": data.get("compression"),
     }
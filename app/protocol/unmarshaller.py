@@ -1,5 +1,10 @@
-from app.protocol.message import dict_to_message
-from app.protocol.file_transfer import file_dict_to_chunks
+from app.protocol.message import (
+    dict_to_message, dict_to_history, dict_to_history_request, dict_to_hello,
+    dict_to_search_request, dict_to_search_results, dict_to_room_control
+)
+from app.protocol.file_transfer import file_dict_to_chunks, binary_to_file_chunk, dict_to_file_control, FILE_CONTROL_FIELDS
+from app.protocol.framing import decode_frame, FRAME_FILE
+from app.protocol.compression import frame_payload
 from . import json
 
 def unmarshall(payload: bytes) -> dict:
@@ -9,35 +14,34 @@ def unmarshall(payload: bytes) -> dict:
         return dict_to_message(data)
     elif tipo == "file":
         return file_dict_to_chunks(data)
+    elif tipo == "history":
+        return dict_to_history(data)
+    elif tipo == "history_request":
+        return dict_to_history_request(data)
+    elif tipo == "search_request":
+        return dict_to_search_request(data)
+    elif tipo == "search_results":
+        return dict_to_search_results(data)
+    elif tipo in ("join", "leave"):
+        return dict_to_room_control(data)
+    elif tipo in ("hello", "hello_ack"):
+        return dict_to_hello(data)
+    elif tipo in FILE_CONTROL_FIELDS:
+        return dict_to_file_control(data)
     else:
         raise ValueError(f"Tipo desconhecido: {tipo}")
-    
+
+
+def unmarshall_frame(frame) -> dict:
+    if frame.type == FRAME_FILE:
+        return binary_to_file_chunk(frame.payload)
+    return unmarshall(frame_payload(frame))
+
 
 def unmarshall_with_length(buffer: bytes):
-    try:
-        buffer_str = buffer.decode("utf-8")
-        data = json.loads(buffer_str)
-        consumed = len(buffer_str.encode("utf-8"))
-        
-        tipo = data.get("type")
-        if tipo == "text":
-            return dict_to_message(data), consumed
-        elif tipo == "file":
-            return file_dict_to_chunks(data), consumed
-        else:
-            raise ValueError(f"Tipo desconhecido: {tipo}")
-            
-    except json.JSONDecodeError as e:
-        if "Extra data" in str(e):
-            valid_json = buffer[:e.pos].decode("utf-8")
-            data = json.loads(valid_json)
-            
-            tipo = data.get("type")
-            if tipo == "text":
-                return dict_to_message(data), e.pos
-            elif tipo == "file":
-                return file_dict_to_chunks(data), e.pos
-            else:
-                raise ValueError(f"Tipo desconhecido: {tipo}")
-        else:
-            raise
\ No newline at end of file
+    # Retorna (mensagem, bytes consumidos) ou (None, 0) se o frame
+    # ainda estiver incompleto no buffer.
+    frame, consumed = decode_frame(buffer)
+    if frame is None:
+        return None, 0
+    return unmarshall_frame(frame), consumed
@@ -2,10 +2,16 @@ from .database_node import DatabaseNode
 from .replication_manager import ReplicationManager
 from .cluster_coordinator import ClusterCoordinator
 from .storage_api import StorageAPI
+from .write_behind import WriteBehindQueue
+from .health_monitor import NodeHealthMonitor
+from .attachment_store import AttachmentStore
 
 __all__ = [
     "DatabaseNode",
     "ReplicationManager",
     "ClusterCoordinator",
     "StorageAPI",
+    "WriteBehindQueue",
+    "NodeHealthMonitor",
+    "AttachmentStore",
 ]
\ No newline at end of file
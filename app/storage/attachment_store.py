@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class AttachmentStore:
+    """Content-addressed store for uploaded files.
+
+    Completed files live under objects/<sha256[:2]>/<sha256>, so the same
+    content uploaded twice is kept once. Uploads in progress are appended
+    to partial/<sha256>.part next to a small metadata file; the number of
+    whole chunks already on disk is the point a dropped upload resumes from.
+
+    Each upload belongs to an owner (the uploading connection), which may
+    have at most max_uploads_per_owner of them open. Uploads idle for
+    idle_timeout_s, and those of an owner that is released, are closed;
+    their partial files stay on disk so a later offer can resume them.
+    """
+
+    def __init__(self, root_dir='data/attachments', read_block_size=1024 * 1024,
+                 max_uploads_per_owner=4, idle_timeout_s=300):
+        self.root_dir = root_dir
+        self.objects_dir = os.path.join(root_dir, 'objects')
+        self.partial_dir = os.path.join(root_dir, 'partial')
+        self.read_block_size = read_block_size
+        self.max_uploads_per_owner = max_uploads_per_owner
+        self.idle_timeout = idle_timeout_s
+
+        self._lock = threading.Lock()
+        self._uploads = {}
+
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.partial_dir, exist_ok=True)
+
+    def _check_digest(self, digest):
+        if not isinstance(digest, str) or not DIGEST_PATTERN.match(digest):
+            raise ValueError(f"Invalid attachment digest: {digest!r}")
+        return digest
+
+    def object_path(self, digest):
+        self._check_digest(digest)
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _partial_paths(self, digest):
+        self._check_digest(digest)
+        base = os.path.join(self.partial_dir, digest)
+        return base + '.part', base + '.json'
+
+    def has_object(self, digest):
+        return os.path.exists(self.object_path(digest))
+
+    def object_size(self, digest):
+        return os.path.getsize(self.object_path(digest))
+
+    def begin_upload(self, digest, filesize, chunk_size, owner=None):
+        """Registers an upload and returns the chunk index to resume from.
+
+        Returns the total number of chunks when the content is already
+        stored, in which case nothing needs to be sent. Raises ValueError
+        when the owner already has max_uploads_per_owner uploads open.
+        """
+        if filesize <= 0 or chunk_size <= 0:
+            raise ValueError(f"Invalid upload size for {digest}: {filesize} bytes in chunks of {chunk_size}")
+        total_chunks = (filesize + chunk_size - 1) // chunk_size
+        if self.has_object(digest):
+            return total_chunks
+
+        self.expire_idle()
+        part_path, meta_path = self._partial_paths(digest)
+        replaced = None
+        with self._lock:
+            upload = self._uploads.get(digest)
+            if upload is None or upload['owner'] != owner:
+                open_uploads = sum(1 for other in self._uploads.values() if other['owner'] == owner)
+                if owner is not None and open_uploads >= self.max_uploads_per_owner:
+                    raise ValueError(f"Too many uploads in progress ({self.max_uploads_per_owner})")
+            if upload is None or upload['chunk_size'] != chunk_size:
+                replaced = upload
+
+                next_chunk = 0
+                if os.path.exists(meta_path) and os.path.exists(part_path):
+                    with open(meta_path) as f:
+                        meta = json.load(f)
+                    if meta.get('filesize') == filesize and meta.get('chunk_size') == chunk_size:
+                        next_chunk = os.path.getsize(part_path) // chunk_size
+
+                with open(meta_path, 'w') as f:
+                    json.dump({'filesize': filesize, 'chunk_size': chunk_size}, f)
+
+                part = open(part_path, 'ab' if next_chunk else 'wb')
+                # Drop a trailing partial chunk so every chunk on disk is whole
+                part.truncate(next_chunk * chunk_size)
+                part.seek(next_chunk * chunk_size)
+
+                upload = self._uploads[digest] = {
+                    'file': part,
+                    'filesize': filesize,
+                    'chunk_size': chunk_size,
+                    'total_chunks': total_chunks,
+                    'next_chunk': next_chunk,
+                    'lock': threading.Lock(),
+                    'closed': False,
+                }
+            upload['owner'] = owner
+            upload['last_active'] = time.monotonic()
+            next_chunk = upload['next_chunk']
+        if replaced is not None:
+            self._close_upload(replaced)
+        return next_chunk
+
+    def _close_upload(self, upload):
+        # Only the open file is dropped; the partial files keep the progress
+        with upload['lock']:
+            upload['closed'] = True
+            upload['file'].close()
+
+    def _drop_uploads(self, selected):
+        with self._lock:
+            dropped = [(digest, upload) for digest, upload in self._uploads.items() if selected(upload)]
+            for digest, _ in dropped:
+                del self._uploads[digest]
+        # Closed outside self._lock: a chunk being written holds the
+        # upload's lock and may need self._lock to finalize
+        for _, upload in dropped:
+            self._close_upload(upload)
+        with self._lock:
+            for digest, upload in dropped:
+                if upload['next_chunk'] == 0 and digest not in self._uploads:
+                    # Nothing to resume from
+                    for path in self._partial_paths(digest):
+                        if os.path.exists(path):
+                            os.remove(path)
+        return len(dropped)
+
+    def expire_idle(self):
+        """Closes uploads that received nothing for idle_timeout_s."""
+        limit = time.monotonic() - self.idle_timeout
+        return self._drop_uploads(lambda upload: upload['last_active'] < limit)
+
+    def release(self, owner):
+        """Closes every upload of an owner, e.g. a connection that closed."""
+        return self._drop_uploads(lambda upload: upload['owner'] == owner)
+
+    def write_chunk(self, digest, chunk_index, data):
+        """Appends a chunk and returns (next_chunk, complete).
+
+        complete is True only for the chunk that finished the object. Chunks
+        must arrive in order; a chunk that is already stored is ignored so a
+        client can safely resend after reconnecting.
+        """
+        upload = self._uploads.get(digest)
+        if upload is None:
+            if self.has_object(digest):
+                # Another upload of the same content already finished
+                return chunk_index + 1, False
+            raise ValueError(f"No upload in progress for {digest}")
+
+        with upload['lock']:
+            if upload['closed']:
+                raise ValueError(f"Upload of {digest} was closed; offer the file again to resume it")
+            upload['last_active'] = time.monotonic()
+            if chunk_index < upload['next_chunk']:
+                return upload['next_chunk'], False
+            if chunk_index > upload['next_chunk']:
+                raise ValueError(
+                    f"Chunk {chunk_index} out of order for {digest}, expected {upload['next_chunk']}"
+                )
+
+            upload['file'].write(data)
+            upload['next_chunk'] += 1
+            if upload['next_chunk'] < upload['total_chunks']:
+                return upload['next_chunk'], False
+
+            upload['file'].close()
+            upload['closed'] = True
+            self._finalize(digest, upload)
+            return upload['next_chunk'], True
+
+    def _finalize(self, digest, upload):
+        part_path, meta_path = self._partial_paths(digest)
+        with self._lock:
+            self._uploads.pop(digest, None)
+
+        try:
+            if os.path.getsize(part_path) != upload['filesize'] or self._hash_file(part_path) != digest:
+                raise ValueError(f"Uploaded content does not match digest {digest}")
+
+            object_path = self.object_path(digest)
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            if os.path.exists(object_path):
+                os.remove(part_path)
+            else:
+                os.replace(part_path, object_path)
+        finally:
+            for path in (part_path, meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _hash_file(self, path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(self.read_block_size), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def upload_status(self, digest):
+        if self.has_object(digest):
+            return {'complete': True}
+        upload = self._uploads.get(digest)
+        if upload is None:
+            return None
+        return {
+            'complete': False,
+            'next_chunk': upload['next_chunk'],
+            'total_chunks': upload['total_chunks'],
+        }
+
+    def iter_ranges(self, digest, chunk_size):
+        # (chunk_index, offset, length) of every chunk of a stored object
+        size = self.object_size(digest)
+        total_chunks = (size + chunk_size - 1) // chunk_size
+        for index in range(total_chunks):
+            offset = index * chunk_size
+            yield index, offset, min(chunk_size, size - offset)
+
+    def close(self):
+        with self._lock:
+            for upload in self._uploads.values():
+                upload['file'].close()
+            self._uploads.clear()
@@ -1,33 +1,111 @@
+from collections import defaultdict
+
+from app.storage.hash_ring import HashRing, merge_ranges
+
 class ClusterCoordinator:
-    
-    def __init__(self, nodes=None):
-        self.nodes = nodes or [] 
-        
-    def add_node(self, node):
+    """Places records on nodes with a consistent-hash ring.
+
+    Every record is kept by replication_factor nodes (fewer if the cluster
+    is smaller). When a node joins or leaves, rebalance() moves only the
+    key ranges whose owners changed.
+    """
+
+    def __init__(self, nodes=None, replication_factor=3, virtual_nodes=64):
+        self.nodes = nodes or []
+        self.replication_factor = replication_factor
+        self.ring = HashRing([node.node_id for node in self.nodes], virtual_nodes)
+
+    def add_node(self, node, rebalance=False):
+        previous = self.ring.copy()
         self.nodes.append(node)
+        self.ring.add_node(node.node_id)
+        if rebalance:
+            self.rebalance(previous)
+        return previous
 
-    def remove_node(self, node):
+    def remove_node(self, node, rebalance=False):
+        # With rebalance, the leaving node is still used as a source for its ranges
+        previous = self.ring.copy()
         self.nodes.remove(node)
-        
+        self.ring.remove_node(node.node_id)
+        if rebalance:
+            self.rebalance(previous, departed=[node])
+        return previous
+
     def get_primary_node(self):
         if not self.nodes:
             raise Exception("Nenhum nó disponível no cluster.")
-        
+
         return self.nodes[0]
-        
-    def get_node_for_record(self, record_id):
+
+    def _node_by_id(self, extra_nodes=()):
+        return {node.node_id: node for node in list(self.nodes) + list(extra_nodes)}
+
+    def replica_count(self):
+        return min(self.replication_factor, len(self.nodes))
+
+    def is_partitioned(self):
+        # False when every node holds every record
+        return self.replica_count() < len(self.nodes)
+
+    def get_nodes_for_record(self, record_id):
         if not self.nodes:
             raise Exception("Nenhum nó disponível no cluster.")
-        
-        node_index = hash(record_id) % len(self.nodes)
-        return self.nodes[node_index]
+
+        nodes = self._node_by_id()
+        return [nodes[node_id] for node_id in self.ring.nodes_for_key(record_id, self.replication_factor)]
+
+    def get_node_for_record(self, record_id):
+        return self.get_nodes_for_record(record_id)[0]
+
+    def owned_ranges(self, node):
+        return self.ring.owned_ranges(node.node_id, self.replication_factor)
+
+    def rebalance(self, previous_ring, departed=()):
+        # Copies every range that gained an owner from one of its previous
+        # owners, then drops ranges from nodes that no longer own them
+        nodes = self._node_by_id(departed)
+        copies = defaultdict(list)
+        drops = defaultdict(list)
+
+        for start, end, before, after in self.ring.moved_ranges(previous_ring, self.replication_factor):
+            sources = [node_id for node_id in before if node_id in nodes]
+            for node_id in after:
+                if node_id not in before and sources:
+                    copies[(node_id, sources[0])].append((start, end))
+            for node_id in before:
+                if node_id not in after and node_id in self.ring.node_ids:
+                    drops[node_id].append((start, end))
+
+        transferred = 0
+        failed = False
+        for (target_id, source_id), ranges in copies.items():
+            target, source = nodes[target_id], nodes[source_id]
+            try:
+                for batch in source.records_in_ranges(merge_ranges(ranges)):
+                    stored = target.store_many(batch)
+                    if stored != len(batch):
+                        raise RuntimeError(f"stored {stored} of {len(batch)} records")
+                    transferred += stored
+            except Exception as e:
+                failed = True
+                print(f"[ERROR] Failed to move ranges from node {source_id} to node {target_id}: {e}")
+
+        # Nothing is dropped unless every copy succeeded
+        removed = 0
+        if not failed:
+            for node_id, ranges in drops.items():
+                removed += nodes[node_id].delete_ranges(merge_ranges(ranges))
+
+        print(f"[+] Rebalance moved {transferred} records and dropped {removed} stale copies")
+        return not failed
 
     def distribute_request(self, request):
         if not self.nodes:
             raise Exception("Nenhum nó disponível no cluster.")
-        
+
         node = self.nodes[0]
         return node.process_request(request)
 
     def get_cluster_status(self):
-        return [node.get_status() for node in self.nodes]
\ No newline at end of file
+        return [node.get_status() for node in self.nodes]
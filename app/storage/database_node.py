@@ -1,49 +1,289 @@
+import bisect
+import json
+import mmap
+import os
+import shutil
+import threading
+
+
 class DatabaseNode:
-    def __init__(self, node_id, storage_path):
+    """In-memory storage node.
+
+    Records are kept in data_store and in an ordered index of
+    (timestamp, key) entries, updated on every write, so listing reads a
+    slice of the index instead of sorting every key. indexed_fields adds
+    one ordered index per distinct value of each field (by sender and by
+    room, by default) for filtered listing.
+
+    With a storage_path, every mutation is appended to a log there and
+    the log is compacted into a snapshot every compact_every entries.
+    Compaction moves the log aside, so writes continue on a fresh one,
+    and writes the snapshot in a background thread. Startup loads the
+    snapshot and replays only the logs written since.
+    """
+
+    SNAPSHOT_FILE = "snapshot.jsonl"
+    LOG_FILE = "mutations.log"
+    COMPACTING_LOG_FILE = "mutations.compacting.log"
+
+    def __init__(self, node_id, storage_path, indexed_fields=("sender", "room"),
+                 compact_every=100000, fsync=False):
         self.node_id = node_id
         self.storage_path = storage_path
         self.data_store = {}
         self.connected_nodes = []
+        self.indexed_fields = tuple(indexed_fields)
+        self._order = []
+        self._secondary = {field: {} for field in self.indexed_fields}
 
-    def store_data(self, data):
-        key = data.get("id") or data.get("filename") or str(len(self.data_store))
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self._lock = threading.RLock()
+        self._log = None
+        self._log_entries = 0
+        self._compaction = None
+        if storage_path:
+            self._open_storage()
+
+    def _path(self, name):
+        return os.path.join(self.storage_path, name)
+
+    def _open_storage(self):
+        os.makedirs(self.storage_path, exist_ok=True)
+        loaded = self._load_snapshot()
+        # A log moved aside by an unfinished compaction is older than the current one
+        replayed = self._replay_log(self.COMPACTING_LOG_FILE) + self._replay_log(self.LOG_FILE)
+        self._log_entries = replayed
+        self._rebuild_indexes()
+        self._log = open(self._path(self.LOG_FILE), "ab")
+        print(f"[+] Node {self.node_id} loaded {loaded} records from snapshot and replayed {replayed} log entries")
+
+    def _load_snapshot(self):
+        # One [key, record] JSON line per record, read through mmap
+        path = self._path(self.SNAPSHOT_FILE)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return 0
+        loads = json.loads
+        data_store = self.data_store
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b""):
+                key, data = loads(line)
+                data_store[key] = data
+        return len(data_store)
+
+    def _replay_log(self, name):
+        path = self._path(name)
+        if not os.path.exists(path):
+            return 0
+        replayed = 0
+        valid_end = 0
+        with open(path, "rb") as f:
+            for line in f:
+                # A line without its newline is a torn write even when it
+                # parses; kept, the next append would be glued onto it
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn write from a crash; everything after it is dropped
+                    break
+                if entry[0] == "put":
+                    self.data_store[entry[1]] = entry[2]
+                else:
+                    self.data_store.pop(entry[1], None)
+                valid_end += len(line)
+                replayed += 1
+        if valid_end < os.path.getsize(path):
+            print(f"[WARNING] Node {self.node_id} discarded an incomplete log entry")
+            with open(path, "r+b") as f:
+                f.truncate(valid_end)
+        return replayed
+
+    def _rebuild_indexes(self):
+        # One sort over everything loaded instead of an insort per record
+        self._order = sorted(self._sort_key(key, data) for key, data in self.data_store.items())
+        self._secondary = {field: {} for field in self.indexed_fields}
+        for entry in self._order:
+            data = self.data_store[entry[1]]
+            for field, index in self._secondary.items():
+                if field in data:
+                    index.setdefault(data[field], []).append(entry)
+
+    def _append_log(self, entry):
+        if self._log is None:
+            return
+        self._log.write(json.dumps(entry).encode("utf-8") + b"\n")
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+        self._log_entries += 1
+        if self._log_entries >= self.compact_every:
+            self.compact(wait=False)
+
+    def compact(self, wait=True):
+        """Writes every record to a new snapshot and empties the log.
+
+        Only the log switch and a shallow copy of the records happen under
+        the write lock; the snapshot is written by a background thread.
+        """
+        with self._lock:
+            if self._log is None or self._compaction is not None:
+                compaction = self._compaction
+            else:
+                records = [(key, self.data_store[key]) for _, key in self._order]
+                self._switch_log()
+                compaction = self._compaction = threading.Thread(
+                    target=self._write_snapshot, args=(records,), daemon=True
+                )
+                compaction.start()
+        if wait and compaction is not None:
+            compaction.join()
+
+    def _switch_log(self):
+        # Called with self._lock held: moves the current log aside and
+        # starts an empty one for the writes that follow
+        self._log.close()
+        log_path = self._path(self.LOG_FILE)
+        compacting_path = self._path(self.COMPACTING_LOG_FILE)
+        if os.path.exists(compacting_path):
+            # Left over by a compaction that failed or was interrupted; its
+            # entries must survive until a snapshot covers them
+            with open(log_path, "rb") as src, open(compacting_path, "ab") as dst:
+                shutil.copyfileobj(src, dst)
+                dst.flush()
+                os.fsync(dst.fileno())
+            self._log = open(log_path, "wb")
+        else:
+            os.replace(log_path, compacting_path)
+            self._log = open(log_path, "ab")
+        self._log_entries = 0
+
+    def _write_snapshot(self, records):
+        path = self._path(self.SNAPSHOT_FILE)
+        temp_path = path + ".tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                dumps = json.dumps
+                for key, data in records:
+                    f.write(dumps([key, data]).encode("utf-8") + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+            # Replaying a log over a snapshot that already has its entries
+            # gives the same result, so a crash before the removal is harmless
+            os.replace(temp_path, path)
+            os.remove(self._path(self.COMPACTING_LOG_FILE))
+        except OSError as e:
+            print(f"[ERROR] Node {self.node_id} failed to compact its log: {e}")
+        finally:
+            with self._lock:
+                self._compaction = None
+
+    def close(self):
+        with self._lock:
+            compaction = self._compaction
+        if compaction is not None:
+            compaction.join()
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def _sort_key(self, key, data):
+        return (str(data.get("timestamp") or ""), str(key))
+
+    def _index(self, key, data):
+        entry = self._sort_key(key, data)
+        bisect.insort(self._order, entry)
+        for field, index in self._secondary.items():
+            if field in data:
+                bisect.insort(index.setdefault(data[field], []), entry)
+
+    def _unindex(self, key, data):
+        entry = self._sort_key(key, data)
+        self._remove_entry(self._order, entry)
+        for field, index in self._secondary.items():
+            if field not in data:
+                continue
+            entries = index.get(data[field])
+            if entries is not None:
+                self._remove_entry(entries, entry)
+                if not entries:
+                    del index[data[field]]
+
+    def _remove_entry(self, entries, entry):
+        position = bisect.bisect_left(entries, entry)
+        if position < len(entries) and entries[position] == entry:
+            del entries[position]
+
+    def _put(self, key, data):
+        previous = self.data_store.get(key)
+        if previous is not None:
+            self._unindex(key, previous)
         self.data_store[key] = data
-        return key
+        self._index(key, data)
+
+    def store_data(self, data):
+        with self._lock:
+            key = data.get("id") or data.get("filename") or str(len(self.data_store))
+            self._put(key, data)
+            self._append_log(["put", key, data])
+            return key
 
     def retrieve_data(self, key):
         return self.data_store.get(key, None)
         
     def update_data(self, key, data):
-        if key in self.data_store:
-            self.data_store[key] = data
-            return True
-        return False
+        with self._lock:
+            if key in self.data_store:
+                self._put(key, data)
+                self._append_log(["put", key, data])
+                return True
+            return False
         
     def delete_data(self, key):
-        if key in self.data_store:
-            del self.data_store[key]
-            return True
-        return False
+        with self._lock:
+            if key in self.data_store:
+                self._unindex(key, self.data_store.pop(key))
+                self._append_log(["del", key])
+                return True
+            return False
+
+    def _matches(self, data, criteria):
+        for k, v in criteria.items():
+            if k not in data or data[k] != v:
+                return False
+        return True
         
     def list_data(self, filter_criteria=None, limit=50, offset=0):
+        # Newest first. An indexed field in the criteria picks that field's
+        # index, so a page costs O(log n + page) instead of a full sort.
+        criteria = dict(filter_criteria or {})
+        entries = self._order
+        for field in self.indexed_fields:
+            if field in criteria:
+                entries = self._secondary[field].get(criteria.pop(field), [])
+                break
+
+        if not criteria:
+            end = max(len(entries) - offset, 0)
+            page = entries[max(end - limit, 0):end]
+            return [self.data_store[key] for _, key in reversed(page)]
+
+        # Remaining criteria are checked while walking the index, before
+        # offset and limit are applied, so pages are never short
         results = []
-        all_keys = sorted(self.data_store.keys(), reverse=True)
-        if offset < len(all_keys):
-            all_keys = all_keys[offset:]
-        else:
-            return []
-        all_keys = all_keys[:limit]
-        for key in all_keys:
+        skipped = 0
+        for _, key in reversed(entries):
             data = self.data_store[key]
-            if filter_criteria is not None:
-                match = True
-                for k, v in filter_criteria.items():
-                    if k not in data or data[k] != v:
-                        match = False
-                        break
-                if not match:
-                    continue
+            if not self._matches(data, criteria):
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
             results.append(data)
+            if len(results) >= limit:
+                break
         return results
 
     def connect_to_node(self, other_node):
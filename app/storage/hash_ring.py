@@ -0,0 +1,145 @@
+import bisect
+import hashlib
+
+# Ring positions are 63-bit so they fit a signed SQLite INTEGER
+RING_SIZE = 1 << 63
+TOKEN_MIN = -1  # Exclusive lower bound of the first range on the ring
+# Nodes keep a sync digest per fixed slice of the token space
+RING_SLICE_SHIFT = 63 - 16
+
+
+def ring_token(key):
+    # Stable across processes, unlike the built-in hash()
+    digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') >> 1
+
+
+def merge_ranges(ranges):
+    # Coalesces adjacent (start, end] ranges
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and merged[-1][1] == start:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def intersect_ranges(first, second):
+    # Overlap of two sorted lists of disjoint (start, end] ranges
+    overlap = []
+    i = j = 0
+    while i < len(first) and j < len(second):
+        start = max(first[i][0], second[j][0])
+        end = min(first[i][1], second[j][1])
+        if start < end:
+            overlap.append((start, end))
+        if first[i][1] < second[j][1]:
+            i += 1
+        else:
+            j += 1
+    return overlap
+
+
+def ring_slice(token):
+    return token >> RING_SLICE_SHIFT
+
+
+def slice_part(index, start, end):
+    # Part of the (start, end] range inside a slice, and whether it is the whole slice
+    low = (index << RING_SLICE_SHIFT) - 1
+    high = ((index + 1) << RING_SLICE_SHIFT) - 1
+    return (max(start, low), min(end, high)), start <= low and end >= high
+
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes.
+
+    Each node is placed on the ring virtual_nodes times. A key belongs to
+    the first `count` distinct nodes found walking clockwise from its
+    token, so adding or removing a node only changes the owners of the
+    ranges next to that node's positions.
+    """
+
+    def __init__(self, node_ids=(), virtual_nodes=64):
+        self.virtual_nodes = virtual_nodes
+        self._tokens = []
+        self._owners = []
+        self.node_ids = set()
+        for node_id in node_ids:
+            self.add_node(node_id)
+
+    def copy(self):
+        ring = HashRing(virtual_nodes=self.virtual_nodes)
+        ring._tokens = list(self._tokens)
+        ring._owners = list(self._owners)
+        ring.node_ids = set(self.node_ids)
+        return ring
+
+    def add_node(self, node_id):
+        if node_id in self.node_ids:
+            return
+        self.node_ids.add(node_id)
+        for replica in range(self.virtual_nodes):
+            token = ring_token(f"{node_id}#{replica}")
+            index = bisect.bisect_left(self._tokens, token)
+            self._tokens.insert(index, token)
+            self._owners.insert(index, node_id)
+
+    def remove_node(self, node_id):
+        if node_id not in self.node_ids:
+            return
+        self.node_ids.discard(node_id)
+        kept = [(t, o) for t, o in zip(self._tokens, self._owners) if o != node_id]
+        self._tokens = [t for t, _ in kept]
+        self._owners = [o for _, o in kept]
+
+    def preference_list(self, token, count):
+        # First `count` distinct nodes clockwise from token
+        if not self._tokens:
+            return []
+        count = min(count, len(self.node_ids))
+        owners = []
+        index = bisect.bisect_left(self._tokens, token)
+        for step in range(len(self._tokens)):
+            owner = self._owners[(index + step) % len(self._tokens)]
+            if owner not in owners:
+                owners.append(owner)
+                if len(owners) == count:
+                    break
+        return owners
+
+    def nodes_for_key(self, key, count):
+        return self.preference_list(ring_token(key), count)
+
+    def _segments(self, tokens):
+        # Elementary (start, end] ranges between consecutive tokens; every key
+        # inside one of them has the same owners. The wrap-around segment is
+        # split at the ends of the token space.
+        tokens = sorted(set(tokens))
+        if not tokens:
+            return []
+        segments = [(TOKEN_MIN, tokens[0])]
+        segments += list(zip(tokens, tokens[1:]))
+        if tokens[-1] < RING_SIZE - 1:
+            segments.append((tokens[-1], RING_SIZE - 1))
+        return segments
+
+    def owned_ranges(self, node_id, count):
+        return merge_ranges(
+            (start, end) for start, end in self._segments(self._tokens)
+            if node_id in self.preference_list(end, count)
+        )
+
+    def moved_ranges(self, previous, count):
+        """Ranges whose owners differ between `previous` and this ring.
+
+        Returns [(start, end, previous owners, current owners)].
+        """
+        moved = []
+        for start, end in self._segments(self._tokens + previous._tokens):
+            before = previous.preference_list(end, count)
+            after = self.preference_list(end, count)
+            if set(before) != set(after):
+                moved.append((start, end, before, after))
+        return moved
@@ -0,0 +1,102 @@
+import threading
+import time
+
+
+class NodeHealthMonitor:
+    """Keeps a cached, timestamped health state for every storage node.
+
+    The state is refreshed by a background thread every check_interval
+    seconds, and immediately after a read or write reports an error, so the
+    storage hot paths only ever read the cache instead of probing the nodes.
+    Unhealthy nodes are handed to the ReplicationManager for recovery, and
+    nodes that are healthy again get the writes they missed replayed from
+    the hinted-handoff queue.
+    """
+
+    def __init__(self, replication_manager, check_interval=5, start=True):
+        self.replication_manager = replication_manager
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._state = {}
+        self._refresh_requested = threading.Event()
+        self._stopped = False
+
+        replication_manager.health_monitor = self
+        self.check_nodes()
+
+        self._thread = None
+        if start:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _set_state(self, node, healthy, error=None):
+        with self._lock:
+            previous = self._state.get(node.node_id)
+            self._state[node.node_id] = {
+                'healthy': healthy,
+                'checked_at': time.time(),
+                'error': error,
+            }
+        if previous is not None and previous['healthy'] != healthy:
+            print(f"[*] Node {node.node_id} is now {'healthy' if healthy else 'unhealthy'}")
+
+    def is_healthy(self, node):
+        state = self._state.get(node.node_id)
+        return state is not None and state['healthy']
+
+    def healthy_nodes(self):
+        return [n for n in self.replication_manager.nodes if self.is_healthy(n)]
+
+    def report_failure(self, node, error=None):
+        self._set_state(node, False, str(error) if error else None)
+        self._refresh_requested.set()
+
+    def status(self):
+        with self._lock:
+            return {node_id: dict(state) for node_id, state in self._state.items()}
+
+    def check_nodes(self):
+        nodes = self.replication_manager.nodes
+        unhealthy = []
+        for node in nodes:
+            try:
+                healthy = node.exists()
+                error = None if healthy else "database missing or corrupted"
+            except Exception as e:
+                healthy, error = False, str(e)
+            self._set_state(node, healthy, error)
+            if not healthy:
+                unhealthy.append(node)
+
+        healthy_sources = [n for n in nodes if n not in unhealthy]
+        for node in unhealthy:
+            if not healthy_sources:
+                print(f"[ERROR] No healthy nodes available to recover node {node.node_id}")
+                break
+            if self.replication_manager.recover_node(node, source_nodes=healthy_sources):
+                self._set_state(node, node.exists())
+
+        hints = self.replication_manager.hints
+        for node in nodes:
+            if self.is_healthy(node) and hints.has_hints(node):
+                self.replication_manager.replay_hints(node)
+
+        return not unhealthy
+
+    def stop(self):
+        self._stopped = True
+        self._refresh_requested.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped:
+            self._refresh_requested.wait(self.check_interval)
+            self._refresh_requested.clear()
+            if self._stopped:
+                break
+            try:
+                self.check_nodes()
+            except Exception as e:
+                print(f"[ERROR] Node health check failed: {e}")
@@ -0,0 +1,105 @@
+import threading
+from collections import OrderedDict
+
+
+class HintedHandoff:
+    """Writes that missed a replica, kept until the replica is back.
+
+    Hints are held per node in insertion order and keyed by record key, so
+    repeated writes to one key keep a single hint with the latest value.
+    When a node's backlog grows past max_hints_per_node its hints are
+    dropped and the node is flagged for a full recovery instead.
+    """
+
+    def __init__(self, max_hints_per_node=100000, batch_size=500):
+        self.max_hints_per_node = max_hints_per_node
+        self.batch_size = batch_size
+        self._hints = {}
+        self._overflowed = set()
+        self._lock = threading.Lock()
+
+        self.hints_recorded = 0
+        self.hints_replayed = 0
+
+    def add(self, node, records):
+        with self._lock:
+            if node.node_id in self._overflowed:
+                return
+            hints = self._hints.setdefault(node.node_id, OrderedDict())
+            for key, data in records:
+                hints[key] = data
+                hints.move_to_end(key)
+            self.hints_recorded += len(records)
+            if len(hints) <= self.max_hints_per_node:
+                return
+        print(f"[!] Hint backlog for node {node.node_id} overflowed; it will be fully recovered")
+        self.flag_for_recovery(node)
+
+    def flag_for_recovery(self, node):
+        with self._lock:
+            self._hints.pop(node.node_id, None)
+            self._overflowed.add(node.node_id)
+
+    def discard(self, node, keys):
+        # A direct write carries newer data than any hint for the same key
+        if node.node_id not in self._hints:
+            return
+        with self._lock:
+            hints = self._hints.get(node.node_id)
+            if hints is None:
+                return
+            for key in keys:
+                hints.pop(key, None)
+            if not hints:
+                del self._hints[node.node_id]
+
+    def has_hints(self, node):
+        return node.node_id in self._hints or node.node_id in self._overflowed
+
+    def needs_recovery(self, node):
+        return node.node_id in self._overflowed
+
+    def pending(self, node):
+        with self._lock:
+            return len(self._hints.get(node.node_id, ()))
+
+    def peek(self, node):
+        # The oldest batch_size hints, left in place until remove() confirms them
+        with self._lock:
+            hints = self._hints.get(node.node_id)
+            if not hints:
+                return []
+            batch = []
+            for key, data in hints.items():
+                batch.append((key, data))
+                if len(batch) == self.batch_size:
+                    break
+            return batch
+
+    def remove(self, node, batch):
+        # Hints rewritten since peek() keep their newer value
+        with self._lock:
+            hints = self._hints.get(node.node_id)
+            if hints is None:
+                return
+            for key, data in batch:
+                if hints.get(key) is data:
+                    del hints[key]
+            self.hints_replayed += len(batch)
+            if not hints:
+                del self._hints[node.node_id]
+
+    def reset(self, node):
+        # Called before a full recovery; writes from then on are hinted again
+        with self._lock:
+            self._hints.pop(node.node_id, None)
+            self._overflowed.discard(node.node_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': {node_id: len(hints) for node_id, hints in self._hints.items()},
+                'overflowed': sorted(self._overflowed),
+                'recorded': self.hints_recorded,
+                'replayed': self.hints_replayed,
+            }
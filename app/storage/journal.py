@@ -0,0 +1,282 @@
+import bisect
+import json
+import os
+import struct
+import threading
+import zlib
+
+# Entry header: payload length and CRC32 of the payload
+ENTRY_HEADER = struct.Struct("!II")
+
+
+class MessageJournal:
+    """Local append-only journal in front of the ReplicationManager.
+
+    append() writes the record to the active segment and returns once it
+    is fsynced; concurrent appends share one fsync (group commit). A
+    background replayer pushes the journaled records to the nodes in
+    batches and records how far it got in a committed-offset file.
+    Offsets are global byte positions: each segment is named after the
+    offset of its first entry, and a new segment is started once the
+    active one reaches segment_bytes. Segments entirely below the
+    committed offset are deleted.
+
+    On startup a torn entry at the end of the last segment is truncated
+    and replay resumes from the committed offset. Writes are upserts, so
+    entries replayed twice after a crash are harmless.
+    """
+
+    SEGMENT_PREFIX = "segment-"
+    SEGMENT_SUFFIX = ".log"
+    OFFSET_FILE = "committed.offset"
+
+    def __init__(self, replication_manager, directory, segment_bytes=64 * 1024 * 1024,
+                 batch_size=500, retry_interval_s=1.0, fsync=True):
+        self.replication_manager = replication_manager
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval_s
+        self.fsync = fsync
+
+        self._cond = threading.Condition()
+        self._sync_lock = threading.Lock()
+        self._segments = []
+        self._active = None
+        self._active_size = 0
+        self._end = 0
+        self._synced = 0
+        self._committed = 0
+        self._closed = False
+
+        self.entries_appended = 0
+        self.entries_replayed = 0
+        self.fsyncs = 0
+
+        self._open()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _segment_path(self, base):
+        return self._path(f"{self.SEGMENT_PREFIX}{base:020d}{self.SEGMENT_SUFFIX}")
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._segments = sorted(
+            int(name[len(self.SEGMENT_PREFIX):-len(self.SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.startswith(self.SEGMENT_PREFIX) and name.endswith(self.SEGMENT_SUFFIX)
+        )
+        self._committed = self._read_committed()
+        if not self._segments:
+            self._segments = [self._committed]
+
+        base = self._segments[-1]
+        path = self._segment_path(base)
+        self._active_size = self._valid_length(path)
+        if os.path.exists(path) and self._active_size < os.path.getsize(path):
+            print(f"[WARNING] Journal discarded an incomplete entry in {os.path.basename(path)}")
+            with open(path, "r+b") as f:
+                f.truncate(self._active_size)
+        self._active = open(path, "ab")
+        self._sync_directory()
+        self._end = self._synced = base + self._active_size
+        self._committed = min(max(self._committed, self._segments[0]), self._end)
+
+        pending = self._end - self._committed
+        if pending:
+            print(f"[*] Journal has {pending} bytes to replay from offset {self._committed}")
+
+    def _read_committed(self):
+        try:
+            with open(self._path(self.OFFSET_FILE)) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _sync_directory(self):
+        # Makes created, renamed and removed files in the journal directory durable
+        if not self.fsync or not hasattr(os, "O_DIRECTORY"):
+            return
+        fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _write_committed(self, offset):
+        # The temp file is synced before the rename so the offset file is
+        # never seen empty after a crash
+        temp_path = self._path(self.OFFSET_FILE + ".tmp")
+        with open(temp_path, "w") as f:
+            f.write(str(offset))
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, self._path(self.OFFSET_FILE))
+        self._sync_directory()
+
+    def _valid_length(self, path):
+        # Length of the prefix made of complete entries with a matching CRC
+        if not os.path.exists(path):
+            return 0
+        valid = 0
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(ENTRY_HEADER.size)
+                if len(header) < ENTRY_HEADER.size:
+                    break
+                length, crc = ENTRY_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                valid += ENTRY_HEADER.size + length
+        return valid
+
+    def _rotate(self):
+        # Called with self._cond held; the closed segment is fsynced first so
+        # that later syncs only need to cover the new one
+        self._active.flush()
+        if self.fsync:
+            os.fsync(self._active.fileno())
+        self._active.close()
+        self._segments.append(self._end)
+        self._active = open(self._segment_path(self._end), "ab")
+        self._active_size = 0
+        # Without this the new segment's entry could be lost with fsynced
+        # data in it
+        self._sync_directory()
+
+    def append(self, key, data):
+        """Journals one record and returns its end offset once it is durable."""
+        payload = json.dumps([key, data]).encode("utf-8")
+        entry = ENTRY_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("MessageJournal is closed")
+            if self._active_size and self._active_size + len(entry) > self.segment_bytes:
+                self._rotate()
+            self._active.write(entry)
+            self._active_size += len(entry)
+            self._end += len(entry)
+            offset = self._end
+            self.entries_appended += 1
+        self._sync(offset)
+        return offset
+
+    def _sync(self, offset):
+        # Whoever gets the lock first syncs everything written so far, so
+        # appends waiting behind it usually find their entry already synced
+        with self._sync_lock:
+            if self._synced >= offset:
+                return
+            with self._cond:
+                self._active.flush()
+                target = self._end
+                fd = os.dup(self._active.fileno()) if self.fsync else None
+            if fd is not None:
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                self.fsyncs += 1
+            with self._cond:
+                self._synced = max(self._synced, target)
+                self._cond.notify_all()
+
+    def _read_batch(self, segments, start, limit):
+        # Records between start and limit, at most batch_size of them,
+        # and the offset right after the last one
+        records = []
+        position = start
+        while position < limit and len(records) < self.batch_size:
+            index = bisect.bisect_right(segments, position) - 1
+            base = segments[index]
+            segment_end = segments[index + 1] if index + 1 < len(segments) else limit
+            with open(self._segment_path(base), "rb") as f:
+                f.seek(position - base)
+                while position < min(segment_end, limit) and len(records) < self.batch_size:
+                    length, _ = ENTRY_HEADER.unpack(f.read(ENTRY_HEADER.size))
+                    records.append(tuple(json.loads(f.read(length))))
+                    position += ENTRY_HEADER.size + length
+        return records, position
+
+    def _drop_replayed_segments(self):
+        # Called with self._cond held; the active segment is always kept
+        while len(self._segments) > 1 and self._segments[1] <= self._committed:
+            base = self._segments.pop(0)
+            try:
+                os.remove(self._segment_path(base))
+            except OSError as e:
+                print(f"[WARNING] Could not remove journal segment {base}: {e}")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._committed >= self._synced and not self._closed:
+                    self._cond.wait()
+                if self._committed >= self._synced:
+                    return
+                start, limit = self._committed, self._synced
+                segments = list(self._segments)
+
+            # Only the replayer removes segments, and nothing past `limit`
+            # is read, so the files can be read without holding the lock
+            records, position = self._read_batch(segments, start, limit)
+
+            try:
+                success = self.replication_manager.store_batch_with_replication(records)
+            except Exception as e:
+                print(f"[ERROR] Journal replay failed: {e}")
+                success = False
+
+            if not success:
+                # Entries stay in the journal until the nodes accept them
+                with self._cond:
+                    if self._closed:
+                        return
+                    self._cond.wait(self.retry_interval)
+                continue
+
+            self._write_committed(position)
+            with self._cond:
+                self._committed = position
+                self.entries_replayed += len(records)
+                self._drop_replayed_segments()
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        # Blocks until everything appended before this call has been replayed
+        with self._cond:
+            target = self._end
+        self._sync(target)
+        with self._cond:
+            return self._cond.wait_for(lambda: self._committed >= target, timeout)
+
+    def close(self, timeout=None):
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        with self._cond:
+            self._active.close()
+
+    def pending_bytes(self):
+        with self._cond:
+            return self._end - self._committed
+
+    def stats(self):
+        with self._cond:
+            return {
+                'end_offset': self._end,
+                'committed_offset': self._committed,
+                'pending_bytes': self._end - self._committed,
+                'segments': len(self._segments),
+                'appended': self.entries_appended,
+                'replayed': self.entries_replayed,
+                'fsyncs': self.fsyncs,
+            }
@@ -1,48 +1,339 @@
 import os
 import time
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from app.storage.sync_utils import DeltaSync
+from app.storage.hinted_handoff import HintedHandoff
+from app.storage.hash_ring import intersect_ranges
 
 class ReplicationManager:
-    def __init__(self, nodes):
+    def __init__(self, nodes, write_quorum=None, read_quorum=1, max_workers=None,
+                 slow_node_threshold_ms=200, latency_smoothing=0.2, coordinator=None,
+                 max_hints_per_node=100000):
         self.nodes = nodes
-        print(f"[+] ReplicationManager initialized with {len(nodes)} nodes")
+        # With a coordinator each key lives only on its replicas in the hash ring
+        self.coordinator = coordinator
+        replica_count = coordinator.replica_count() if coordinator else len(nodes)
+        # Default W is a majority of the replicas
+        self.write_quorum = write_quorum or (replica_count // 2 + 1)
+        self.read_quorum = read_quorum
+        self.slow_node_threshold_ms = slow_node_threshold_ms
+        self.latency_smoothing = latency_smoothing
+        
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or max(4, len(nodes) * 4),
+            thread_name_prefix="replication"
+        )
+        self.node_latency_ms = {}
+        self.slow_node_ids = set()
+        self._latency_lock = threading.Lock()
+        self._recovery_lock = threading.RLock()
+        self.health_monitor = None  # Set by NodeHealthMonitor when one is attached
+        self.delta_sync = DeltaSync()
+        # Writes that missed a replica, replayed when it is back
+        self.hints = HintedHandoff(max_hints_per_node)
+        self._replaying = set()
+        self._replay_lock = threading.Lock()
+        
+        print(f"[+] ReplicationManager initialized with {len(nodes)} nodes, {replica_count} replicas per key (W={self.write_quorum}, R={self.read_quorum})")
     
-    def store_with_replication(self, key, data):
-        success_count = 0
+    def _record_latency(self, node, elapsed_ms):
+        with self._latency_lock:
+            previous = self.node_latency_ms.get(node.node_id)
+            if previous is None:
+                current = elapsed_ms
+            else:
+                current = previous + self.latency_smoothing * (elapsed_ms - previous)
+            self.node_latency_ms[node.node_id] = current
+            
+            if current > self.slow_node_threshold_ms and node.node_id not in self.slow_node_ids:
+                self.slow_node_ids.add(node.node_id)
+                print(f"[!] Node {node.node_id} flagged as slow ({current:.1f} ms average)")
+            elif current <= self.slow_node_threshold_ms and node.node_id in self.slow_node_ids:
+                self.slow_node_ids.discard(node.node_id)
+                print(f"[+] Node {node.node_id} is no longer slow ({current:.1f} ms average)")
+    
+    def slow_nodes(self):
+        with self._latency_lock:
+            return [n for n in self.nodes if n.node_id in self.slow_node_ids]
+    
+    def _timed_call(self, node, operation):
+        start = time.monotonic()
+        try:
+            return True, operation(node), None
+        except Exception as e:
+            if self.health_monitor:
+                self.health_monitor.report_failure(node, e)
+            return False, None, e
+        finally:
+            self._record_latency(node, (time.monotonic() - start) * 1000)
+    
+    def _quorum_call(self, operation, quorum, accept=None, nodes=None):
+        # Runs operation(node) on every node concurrently and returns as soon as
+        # `quorum` nodes succeeded; the remaining calls finish in the background.
+        # Replies rejected by `accept` neither count towards the quorum nor fail.
+        nodes = self.available_nodes() if nodes is None else self._healthy(nodes)
+        futures = {self.executor.submit(self._timed_call, node, operation): node for node in nodes}
+        successes = []
         errors = []
         
-        for node in self.nodes:
-            try:
+        for future in as_completed(futures):
+            node = futures[future]
+            ok, result, error = future.result()
+            if ok:
+                if accept is not None and not accept(result):
+                    continue
+                successes.append((node, result))
+                if len(successes) >= quorum:
+                    break
+            else:
+                errors.append(f"Error on node {node.node_id}: {error}")
+        
+        for future, node in futures.items():
+            if not future.done():
+                future.add_done_callback(lambda f, node=node: self._report_late_failure(f, node))
+        
+        return successes, errors
+    
+    def _report_late_failure(self, future, node):
+        ok, _, error = future.result()
+        if not ok:
+            print(f"[WARNING] Background replication to node {node.node_id} failed: {error}")
+    
+    def available_nodes(self):
+        # With a health monitor attached, nodes known to be down are skipped
+        if self.health_monitor:
+            return self.health_monitor.healthy_nodes()
+        return self.nodes
+    
+    def _healthy(self, nodes):
+        if self.health_monitor:
+            return [n for n in nodes if self.health_monitor.is_healthy(n)]
+        return nodes
+    
+    def is_partitioned(self):
+        return self.coordinator is not None and self.coordinator.is_partitioned()
+    
+    def replicas_for(self, key):
+        if self.coordinator:
+            return self.coordinator.get_nodes_for_record(key)
+        return self.nodes
+    
+    def add_node(self, node):
+        # With a coordinator only the key ranges the new node takes over are copied to it
+        if self.coordinator:
+            self.coordinator.add_node(node, rebalance=True)
+        elif node.count_records() == 0 and self.nodes:
+            self.recover_node(node)
+        if node not in self.nodes:
+            self.nodes.append(node)
+    
+    def remove_node(self, node):
+        # The leaving node's ranges are handed to their new owners before it goes
+        if self.coordinator and node in self.coordinator.nodes:
+            self.coordinator.remove_node(node, rebalance=True)
+        if node in self.nodes:
+            self.nodes.remove(node)
+    
+    def _ensure_node(self, node):
+        if self.health_monitor:
+            return
+        if not node.exists():
+            with self._recovery_lock:
                 if not node.exists():
                     self.recover_node(node)
-                
-                result = node.store_data(key, data)
-                if result:
-                    success_count += 1
-                else:
-                    errors.append(f"Node {node.node_id} returned None")
-            except Exception as e:
-                errors.append(f"Error on node {node.node_id}: {str(e)}")
+    
+    def _effective_quorum(self, quorum, replica_count=None):
+        return max(1, min(quorum, len(self.nodes) if replica_count is None else replica_count))
+    
+    def _hint_unavailable(self, nodes, records):
+        # Replicas skipped because they are known to be down
+        if self.health_monitor:
+            for node in nodes:
+                if not self.health_monitor.is_healthy(node):
+                    self.hints.add(node, records)
+    
+    def _written(self, node, keys):
+        # The direct write supersedes any hint for these keys; a node that
+        # accepts writes again gets its remaining hints replayed
+        if self.hints.has_hints(node):
+            self.hints.discard(node, keys)
+            if not self.health_monitor:
+                self._schedule_replay(node)
+    
+    def store_with_replication(self, key, data):
+        def write(node):
+            try:
+                self._ensure_node(node)
+                if not node.store_data(key, data):
+                    raise RuntimeError("store returned None")
+            except Exception:
+                self.hints.add(node, [(key, data)])
+                raise
+            self._written(node, (key,))
+            return True
+        
+        replicas = self.replicas_for(key)
+        self._hint_unavailable(replicas, [(key, data)])
+        quorum = self._effective_quorum(self.write_quorum, len(replicas))
+        successes, errors = self._quorum_call(write, quorum, nodes=replicas)
         
-        if success_count == len(self.nodes):
-            print(f"[+] Data with key '{key}' successfully replicated to all {len(self.nodes)} nodes")
+        if len(successes) >= quorum:
             return True
-        elif success_count > 0:
-            print(f"[!] Partial replication: Data saved to {success_count} of {len(self.nodes)} nodes")
-            print(f"[!] Errors: {', '.join(errors)}")
+        
+        if successes:
+            print(f"[!] Write quorum not reached for key '{key}': {len(successes)} of {quorum} acknowledgements")
+        print(f"[ERROR] Replication failed: {', '.join(errors)}")
+        return False
+    
+    def _write_batch(self, node, records):
+        try:
+            self._ensure_node(node)
+            stored = node.store_many(records)
+            if stored != len(records):
+                raise RuntimeError(f"stored {stored} of {len(records)} records")
+        except Exception:
+            self.hints.add(node, records)
+            raise
+        self._written(node, [key for key, _ in records])
+        return stored
+    
+    def store_batch_with_replication(self, records):
+        if self.is_partitioned():
+            return self._store_partitioned_batch(records)
+        
+        self._hint_unavailable(self.nodes, records)
+        
+        def write(node):
+            return self._write_batch(node, records)
+        
+        quorum = self._effective_quorum(self.write_quorum)
+        successes, errors = self._quorum_call(write, quorum)
+        
+        if len(successes) >= quorum:
             return True
-        else:
-            print(f"[ERROR] Replication failed: {', '.join(errors)}")
-            return False
+        
+        print(f"[ERROR] Batch replication of {len(records)} records failed quorum ({len(successes)} of {quorum}): {', '.join(errors)}")
+        return False
     
-    def retrieve_with_fallback(self, key):
-        for node in self.nodes:
+    def _store_partitioned_batch(self, records):
+        # Every node gets one batch with just the records it owns; the batch
+        # succeeds once each record has been acknowledged by its write quorum
+        by_node = defaultdict(list)
+        needed = []
+        for index, (key, _) in enumerate(records):
+            replicas = self.replicas_for(key)
+            needed.append(self._effective_quorum(self.write_quorum, len(replicas)))
+            healthy = self._healthy(replicas)
+            for node in replicas:
+                if node in healthy:
+                    by_node[node].append(index)
+                else:
+                    self.hints.add(node, [records[index]])
+        
+        futures = {
+            self.executor.submit(
+                self._timed_call, node,
+                lambda n, indexes=indexes: self._write_batch(n, [records[i] for i in indexes])
+            ): (node, indexes)
+            for node, indexes in by_node.items()
+        }
+        acks = [0] * len(records)
+        satisfied = 0
+        errors = []
+        
+        for future in as_completed(futures):
+            node, indexes = futures[future]
+            ok, _, error = future.result()
+            if not ok:
+                errors.append(f"Error on node {node.node_id}: {error}")
+                continue
+            for i in indexes:
+                acks[i] += 1
+                if acks[i] == needed[i]:
+                    satisfied += 1
+            if satisfied == len(records):
+                break
+        
+        for future, (node, _) in futures.items():
+            if not future.done():
+                future.add_done_callback(lambda f, node=node: self._report_late_failure(f, node))
+        
+        if satisfied == len(records):
+            return True
+        
+        print(f"[ERROR] Batch replication failed quorum for {len(records) - satisfied} of {len(records)} records: {', '.join(errors)}")
+        return False
+    
+    def replay_hints(self, node):
+        # Sends the node the writes it missed, in batches; a node whose hint
+        # backlog overflowed is fully recovered first
+        with self._replay_lock:
+            if node.node_id in self._replaying:
+                return False
+            self._replaying.add(node.node_id)
+        try:
+            return self._replay_hints(node)
+        finally:
+            with self._replay_lock:
+                self._replaying.discard(node.node_id)
+    
+    def _replay_hints(self, node):
+        if self.hints.needs_recovery(node):
+            # Writes made during the recovery are hinted again and replayed below
+            self.hints.reset(node)
+            if not self.recover_node(node):
+                self.hints.flag_for_recovery(node)
+                return False
+        
+        replayed = 0
+        start = time.monotonic()
+        while True:
+            batch = self.hints.peek(node)
+            if not batch:
+                break
             try:
-                if node.exists():
-                    data = node.retrieve_data(key)
-                    if data:
-                        return data
+                stored = node.store_many(batch)
             except Exception as e:
-                print(f"[WARNING] Failed to retrieve from node {node.node_id}: {e}")
+                stored, error = 0, e
+            else:
+                error = f"stored {stored} of {len(batch)} records"
+            if stored != len(batch):
+                print(f"[WARNING] Hint replay to node {node.node_id} stopped after {replayed} records: {error}")
+                return False
+            self.hints.remove(node, batch)
+            replayed += len(batch)
+        
+        if replayed:
+            print(f"[+] Replayed {replayed} hinted writes to node {node.node_id} in {time.monotonic() - start:.2f} s")
+        return True
+    
+    def _schedule_replay(self, node):
+        if node.node_id not in self._replaying:
+            self.executor.submit(self.replay_hints, node)
+    
+    def retrieve_with_fallback(self, key):
+        def read(node):
+            if not self.health_monitor and not node.exists():
+                raise RuntimeError("node unavailable")
+            return node.retrieve_data(key)
+        
+        # Nodes that don't have the key keep the read going on the others
+        replicas = self.replicas_for(key)
+        quorum = self._effective_quorum(self.read_quorum, len(replicas))
+        successes, errors = self._quorum_call(read, quorum, accept=bool, nodes=replicas)
+        
+        for error in errors:
+            print(f"[WARNING] Failed to retrieve: {error}")
+        if successes and len(successes) < quorum:
+            print(f"[WARNING] Read quorum not reached for key '{key}': {len(successes)} of {quorum} replies")
+        
+        # Among the replies, the most recent version wins
+        versions = [data for _, data in successes]
+        if versions:
+            return max(versions, key=lambda d: d.get('timestamp', ''))
         
         print(f"[WARNING] Data with key '{key}' not found on any node")
         return None
@@ -78,13 +369,20 @@ class ReplicationManager:
         return True
         
     def recover_node(self, node_to_recover, source_nodes=None):
+        with self._recovery_lock:
+            return self._recover_node(node_to_recover, source_nodes)
+    
+    def _recover_node(self, node_to_recover, source_nodes=None):
         print(f"[*] Attempting to recover node {node_to_recover.node_id}...")
         
         if source_nodes is None:
             source_nodes = [n for n in self.nodes if n != node_to_recover]
         
+        if self.is_partitioned():
+            return self._recover_partitioned_node(node_to_recover, source_nodes)
+        
         best_source = None
-        max_records = 0
+        max_records = -1
         
         for source in source_nodes:
             if source.exists():
@@ -107,54 +405,84 @@ class ReplicationManager:
             os.makedirs(os.path.dirname(node_to_recover.db_file), exist_ok=True)
             
             records_copied = node_to_recover.copy_from(best_source)
+            # Writes to the source during the copy change its count, so the
+            # copy is checked against the source's digests after a catch-up pass
+            records_copied += self.delta_sync.sync(best_source, node_to_recover)
+            recovered = node_to_recover.exists() and (
+                records_copied >= max_records or self.delta_sync.in_sync([best_source, node_to_recover])
+            )
             
-            if records_copied > 0:
+            if recovered:
                 print(f"[+] Successfully recovered node {node_to_recover.node_id} with {records_copied} records")
                 return True
             else:
-                print(f"[ERROR] Recovery copied 0 records to node {node_to_recover.node_id}")
+                print(f"[ERROR] Recovery copied {records_copied} of {max_records} records to node {node_to_recover.node_id}")
                 return False
                 
         except Exception as e:
             print(f"[ERROR] Failed to recover node {node_to_recover.node_id}: {e}")
             return False
     
+    def _recover_partitioned_node(self, node_to_recover, source_nodes):
+        # Only the ranges the node owns are rebuilt, from whichever replicas share them
+        ranges = self.coordinator.owned_ranges(node_to_recover)
+        sources = [n for n in source_nodes if n.exists()]
+        if not sources:
+            print("[ERROR] No valid source node found for recovery")
+            return False
+        
+        try:
+            os.makedirs(os.path.dirname(node_to_recover.db_file), exist_ok=True)
+            node_to_recover.reset()
+            copied = sum(self.delta_sync.sync_ranges(source, node_to_recover, ranges) for source in sources)
+        except Exception as e:
+            print(f"[ERROR] Failed to recover node {node_to_recover.node_id}: {e}")
+            return False
+        
+        if not node_to_recover.exists():
+            return False
+        print(f"[+] Successfully recovered node {node_to_recover.node_id} with {copied} records from {len(sources)} replicas")
+        return True
+    
+    def _synchronize_partitioned(self):
+        # Each node pulls its own ranges from the other replicas of them
+        transferred = 0
+        owned = {node.node_id: self.coordinator.owned_ranges(node) for node in self.nodes}
+        digests = {node.node_id: node.ring_slice_digests() for node in self.nodes}
+        for node in self.nodes:
+            for other in self.nodes:
+                if other is not node:
+                    shared = intersect_ranges(owned[node.node_id], owned[other.node_id])
+                    transferred += self.delta_sync.sync_ranges(
+                        other, node, shared, digests[other.node_id], digests[node.node_id]
+                    )
+        return transferred
+    
     def synchronize_nodes(self):
         print("[*] Synchronizing data across all nodes...")
         
         if not self.verify_nodes():
             print("[ERROR] Cannot synchronize because some nodes are unhealthy")
             return False
-            
-        node_records = {}
-        for node in self.nodes:
+        
+        if self.is_partitioned():
             try:
-                count = node.count_records()
-                node_records[node.node_id] = count
-                print(f"[*] Node {node.node_id} has {count} records")
+                transferred = self._synchronize_partitioned()
             except Exception as e:
-                print(f"[ERROR] Failed to count records in node {node.node_id}: {e}")
+                print(f"[ERROR] Failed to synchronize nodes: {e}")
                 return False
+            print(f"[+] All replicas synchronized successfully ({transferred} records transferred)")
+            return True
         
-        best_node_id = max(node_records, key=node_records.get)
-        best_node = next(n for n in self.nodes if n.node_id == best_node_id)
-        best_count = node_records[best_node_id]
-        
-        print(f"[+] Node {best_node_id} has the most records ({best_count})")
-        
-        if all(count == best_count for count in node_records.values()):
+        if self.delta_sync.in_sync(self.nodes):
             print("[+] All nodes are already in sync")
             return True
-            
-        for node in self.nodes:
-            if node.node_id != best_node_id:
-                print(f"[*] Syncing node {node.node_id} from {best_node_id}...")
-                try:
-                    records_copied = node.copy_from(best_node)
-                    print(f"[+] Copied {records_copied} records to node {node.node_id}")
-                except Exception as e:
-                    print(f"[ERROR] Failed to sync node {node.node_id}: {e}")
-                    return False
         
-        print("[+] All nodes synchronized successfully")
-        return True
\ No newline at end of file
+        try:
+            transferred = self.delta_sync.synchronize(self.nodes)
+        except Exception as e:
+            print(f"[ERROR] Failed to synchronize nodes: {e}")
+            return False
+        
+        print(f"[+] All nodes synchronized successfully ({transferred} records transferred)")
+        return True
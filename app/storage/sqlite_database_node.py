@@ -3,51 +3,404 @@ import json
 import os
 import datetime
 import shutil
+import threading
+import hashlib
+import weakref
+
+from app.storage.sync_utils import DeltaSync
+from app.storage.hash_ring import ring_token, RING_SLICE_SHIFT
+
+SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+class _ThreadConnection:
+    # Kept in the owning thread's local storage, so it is collected when the
+    # thread exits; a finalizer then closes the connection
+    __slots__ = ('conn', 'generation', '__weakref__')
+
+    def __init__(self, conn, generation):
+        self.conn = conn
+        self.generation = generation
+
+# Room of rows written before messages carried one (the chat's general room)
+DEFAULT_ROOM = 'geral'
+
+# Sync buckets group rows by the hour prefix of their ISO timestamp
+BUCKET_PREFIX_LENGTH = 13
+ROW_HASH_MASK = (1 << 62) - 1
+
+def row_hash(key, data_json):
+    # 62-bit hash so SQLite can XOR digests as (a | b) - (a & b) without overflow
+    digest = hashlib.blake2b(f"{key}\0{data_json}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') & ROW_HASH_MASK
+
+def bucket_for(timestamp):
+    return (timestamp or '')[:BUCKET_PREFIX_LENGTH]
+
+def fts_query(text):
+    # Every word becomes a quoted FTS5 string, so user input can't be parsed
+    # as query syntax; all words must match
+    return " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
 
 class SQLiteDatabaseNode:
 
-    def __init__(self, node_id, db_file):
+    INSERT_SQL = """
+        INSERT INTO messages (id, content, timestamp, sender, data_json, row_hash, ring_token, room)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET
+            content = excluded.content,
+            timestamp = excluded.timestamp,
+            sender = excluded.sender,
+            data_json = excluded.data_json,
+            row_hash = excluded.row_hash,
+            room = excluded.room
+    """
+    SELECT_BY_ID_SQL = "SELECT data_json FROM messages WHERE id = ?"
+    COUNT_SQL = "SELECT COUNT(*) FROM messages"
+
+    def __init__(self, node_id, db_file, journal_mode='WAL', synchronous='NORMAL',
+                 cache_size=-16000, mmap_size=256 * 1024 * 1024, busy_timeout=5000,
+                 cached_statements=256):
+        if synchronous.upper() not in SYNCHRONOUS_LEVELS:
+            raise ValueError(f"Invalid synchronous level: {synchronous}")
+        
         self.node_id = node_id
         self.db_file = db_file
         self.connected_nodes = []
         
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous.upper()
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        
+        # One connection per thread, closed when the thread exits; the
+        # generation is bumped whenever the database file is replaced so
+        # every thread reopens its connection.
+        self._local = threading.local()
+        self._pool_lock = threading.Lock()
+        self._connections = set()
+        self._generation = 0
+        
         os.makedirs(os.path.dirname(self.db_file), exist_ok=True)
         
         self._initialize_database()
         
         print(f"[+] SQLite node {node_id} initialized at {db_file}")
     
+    def _open_connection(self):
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+    
+    def _get_connection(self):
+        local = self._local
+        handle = getattr(local, 'handle', None)
+        if handle is None or handle.generation != self._generation:
+            with self._pool_lock:
+                conn = self._open_connection()
+                self._connections.add(conn)
+                handle = _ThreadConnection(conn, self._generation)
+            weakref.finalize(handle, self._release_connection, conn)
+            local.handle = handle
+        return handle.conn
+    
+    def _release_connection(self, conn):
+        with self._pool_lock:
+            self._connections.discard(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    
+    def open_connections(self):
+        with self._pool_lock:
+            return len(self._connections)
+    
+    def _reset_connections(self):
+        with self._pool_lock:
+            self._generation += 1
+            connections, self._connections = self._connections, set()
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+    
+    def close(self):
+        self._reset_connections()
+    
+    def _remove_database_files(self):
+        self._reset_connections()
+        for suffix in ('', '-wal', '-shm'):
+            path = self.db_file + suffix
+            if os.path.exists(path):
+                os.remove(path)
+    
     def _initialize_database(self):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS messages (
-                    id TEXT PRIMARY KEY,
-                    content TEXT,
-                    timestamp TEXT,
-                    sender TEXT,
-                    data_json TEXT
-                )
-            """)
+            conn = self._get_connection()
             
-            conn.commit()
-            conn.close()
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS messages (
+                        id TEXT PRIMARY KEY,
+                        content TEXT,
+                        timestamp TEXT,
+                        sender TEXT,
+                        data_json TEXT
+                    )
+                """)
+            
+            self._migrate_schema(conn)
         except sqlite3.Error as e:
             print(f"[ERROR] Failed to initialize SQLite database: {e}")
     
+    def _migrate_schema(self, conn):
+        # Migrations run in order and are tracked with PRAGMA user_version
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for target, migration in enumerate(self.MIGRATIONS, start=1):
+            if version < target:
+                print(f"[*] Migrating node {self.node_id} schema to version {target}...")
+                migration(self, conn)
+                conn.execute(f"PRAGMA user_version = {target}")
+                conn.commit()
+    
+    def _columns(self, conn, table):
+        return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    
+    def _migrate_sync_digests(self, conn, batch_size=5000):
+        # Per-row hashes plus per-bucket XOR digests, kept current by triggers,
+        # let anti-entropy find divergent buckets without scanning the table.
+        with conn:
+            if 'row_hash' not in self._columns(conn, 'messages'):
+                conn.execute("ALTER TABLE messages ADD COLUMN row_hash INTEGER")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sync_buckets (
+                    bucket TEXT PRIMARY KEY,
+                    digest INTEGER NOT NULL,
+                    row_count INTEGER NOT NULL
+                )
+            """)
+        
+        # Backfill existing rows in small transactions so the node stays usable
+        while True:
+            rows = conn.execute(
+                "SELECT rowid, id, data_json FROM messages WHERE row_hash IS NULL LIMIT ?",
+                (batch_size,)
+            ).fetchall()
+            if not rows:
+                break
+            with conn:
+                conn.executemany(
+                    "UPDATE messages SET row_hash = ? WHERE rowid = ?",
+                    [(row_hash(key, data_json), rowid) for rowid, key, data_json in rows]
+                )
+        
+        buckets = {}
+        for timestamp, hashed in conn.execute("SELECT timestamp, row_hash FROM messages"):
+            digest, count = buckets.get(bucket_for(timestamp), (0, 0))
+            buckets[bucket_for(timestamp)] = (digest ^ hashed, count + 1)
+        
+        with conn:
+            conn.execute("DELETE FROM sync_buckets")
+            conn.executemany(
+                "INSERT INTO sync_buckets (bucket, digest, row_count) VALUES (?, ?, ?)",
+                [(bucket, digest, count) for bucket, (digest, count) in buckets.items()]
+            )
+        conn.executescript(f"""
+            CREATE TRIGGER IF NOT EXISTS messages_sync_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO sync_buckets (bucket, digest, row_count)
+                VALUES (substr(NEW.timestamp, 1, {BUCKET_PREFIX_LENGTH}), NEW.row_hash, 1)
+                ON CONFLICT(bucket) DO UPDATE SET
+                    digest = (digest | excluded.digest) - (digest & excluded.digest),
+                    row_count = row_count + 1;
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS messages_sync_delete AFTER DELETE ON messages BEGIN
+                UPDATE sync_buckets SET
+                    digest = (digest | OLD.row_hash) - (digest & OLD.row_hash),
+                    row_count = row_count - 1
+                WHERE bucket = substr(OLD.timestamp, 1, {BUCKET_PREFIX_LENGTH});
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS messages_sync_update AFTER UPDATE ON messages BEGIN
+                UPDATE sync_buckets SET
+                    digest = (digest | OLD.row_hash) - (digest & OLD.row_hash),
+                    row_count = row_count - 1
+                WHERE bucket = substr(OLD.timestamp, 1, {BUCKET_PREFIX_LENGTH});
+                INSERT INTO sync_buckets (bucket, digest, row_count)
+                VALUES (substr(NEW.timestamp, 1, {BUCKET_PREFIX_LENGTH}), NEW.row_hash, 1)
+                ON CONFLICT(bucket) DO UPDATE SET
+                    digest = (digest | excluded.digest) - (digest & excluded.digest),
+                    row_count = row_count + 1;
+            END;
+        """)
+    
+    def _migrate_history_indexes(self, conn):
+        with conn:
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_timestamp_id ON messages (timestamp, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_sender_timestamp ON messages (sender, timestamp, id)")
+        conn.execute("ANALYZE messages")
+    
+    def _migrate_ring_tokens(self, conn, batch_size=5000):
+        # Position of each row on the consistent-hash ring, so rebalancing
+        # can select a key range with an index scan
+        with conn:
+            if 'ring_token' not in self._columns(conn, 'messages'):
+                conn.execute("ALTER TABLE messages ADD COLUMN ring_token INTEGER")
+        
+        while True:
+            rows = conn.execute(
+                "SELECT rowid, id FROM messages WHERE ring_token IS NULL LIMIT ?",
+                (batch_size,)
+            ).fetchall()
+            if not rows:
+                break
+            with conn:
+                conn.executemany(
+                    "UPDATE messages SET ring_token = ? WHERE rowid = ?",
+                    [(ring_token(key), rowid) for rowid, key in rows]
+                )
+        
+        with conn:
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_ring_token ON messages (ring_token)")
+    
+    def _migrate_search_index(self, conn):
+        # External-content FTS5 index over messages.content; triggers keep it
+        # current for every write path, including batch copies during recovery
+        conn.executescript("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                content,
+                content='messages',
+                content_rowid='rowid',
+                tokenize='unicode61 remove_diacritics 2'
+            );
+            
+            CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts (rowid, content) VALUES (NEW.rowid, NEW.content);
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', OLD.rowid, OLD.content);
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', OLD.rowid, OLD.content);
+                INSERT INTO messages_fts (rowid, content) VALUES (NEW.rowid, NEW.content);
+            END;
+        """)
+        with conn:
+            conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+    
+    def _migrate_rooms(self, conn, batch_size=5000):
+        # Each room's history is its own index range, so paging one room
+        # never touches the others
+        with conn:
+            if 'room' not in self._columns(conn, 'messages'):
+                conn.execute("ALTER TABLE messages ADD COLUMN room TEXT")
+        
+        while True:
+            with conn:
+                updated = conn.execute(
+                    """
+                    UPDATE messages SET room = COALESCE(json_extract(data_json, '$.room'), ?)
+                    WHERE rowid IN (SELECT rowid FROM messages WHERE room IS NULL LIMIT ?)
+                    """,
+                    (DEFAULT_ROOM, batch_size)
+                ).rowcount
+            if not updated:
+                break
+        
+        with conn:
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_room_timestamp ON messages (room, timestamp, id)")
+        conn.execute("ANALYZE messages")
+    
+    def _migrate_ring_digests(self, conn):
+        # XOR digests per fixed slice of the ring, so partitioned anti-entropy
+        # can compare the slices of a shared key range without reading rows
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sync_ring_slices (
+                slice INTEGER PRIMARY KEY,
+                digest INTEGER NOT NULL,
+                row_count INTEGER NOT NULL
+            )
+        """)
+        slices = {}
+        for token, hashed in conn.execute("SELECT ring_token, row_hash FROM messages"):
+            digest, count = slices.get(token >> RING_SLICE_SHIFT, (0, 0))
+            slices[token >> RING_SLICE_SHIFT] = (digest ^ hashed, count + 1)
+        
+        with conn:
+            conn.execute("DELETE FROM sync_ring_slices")
+            conn.executemany(
+                "INSERT INTO sync_ring_slices (slice, digest, row_count) VALUES (?, ?, ?)",
+                [(index, digest, count) for index, (digest, count) in slices.items()]
+            )
+        conn.executescript(f"""
+            CREATE TRIGGER IF NOT EXISTS messages_ring_sync_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO sync_ring_slices (slice, digest, row_count)
+                VALUES (NEW.ring_token >> {RING_SLICE_SHIFT}, NEW.row_hash, 1)
+                ON CONFLICT(slice) DO UPDATE SET
+                    digest = (digest | excluded.digest) - (digest & excluded.digest),
+                    row_count = row_count + 1;
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS messages_ring_sync_delete AFTER DELETE ON messages BEGIN
+                UPDATE sync_ring_slices SET
+                    digest = (digest | OLD.row_hash) - (digest & OLD.row_hash),
+                    row_count = row_count - 1
+                WHERE slice = OLD.ring_token >> {RING_SLICE_SHIFT};
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS messages_ring_sync_update AFTER UPDATE ON messages BEGIN
+                UPDATE sync_ring_slices SET
+                    digest = (digest | OLD.row_hash) - (digest & OLD.row_hash),
+                    row_count = row_count - 1
+                WHERE slice = OLD.ring_token >> {RING_SLICE_SHIFT};
+                INSERT INTO sync_ring_slices (slice, digest, row_count)
+                VALUES (NEW.ring_token >> {RING_SLICE_SHIFT}, NEW.row_hash, 1)
+                ON CONFLICT(slice) DO UPDATE SET
+                    digest = (digest | excluded.digest) - (digest & excluded.digest),
+                    row_count = row_count + 1;
+            END;
+        """)
+    
+    MIGRATIONS = [
+        _migrate_sync_digests,
+        _migrate_history_indexes,
+        _migrate_ring_tokens,
+        _migrate_search_index,
+        _migrate_rooms,
+        _migrate_ring_digests,
+    ]
+    
+    def reset(self):
+        # Drops the database files and recreates an empty, current schema
+        self._remove_database_files()
+        self._initialize_database()
+    
     def exists(self):
         if not os.path.exists(self.db_file):
             print(f"[!] Database file for node {self.node_id} doesn't exist")
+            # Drop pooled handles to the deleted file so recovery starts clean
+            self._reset_connections()
             return False
             
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM sqlite_master")
-            result = cursor.fetchone()
-            conn.close()
+            conn = self._get_connection()
+            conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
             return True
         except sqlite3.Error:
             print(f"[!] Database file for node {self.node_id} exists but is corrupted")
@@ -55,39 +408,47 @@ class SQLiteDatabaseNode:
     
     def store_data(self, key, value):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            content = value.get('content', '')
-            timestamp = value.get('timestamp', datetime.datetime.now().isoformat())
-            sender = value.get('sender', 'Unknown')
-            
-            data_json = json.dumps(value)
+            conn = self._get_connection()
             
-            sql = """
-                INSERT OR REPLACE INTO messages (id, content, timestamp, sender, data_json)
-                VALUES (?, ?, ?, ?, ?)
-            """
-            
-            cursor.execute(sql, (key, content, timestamp, sender, data_json))
-            
-            conn.commit()
-            conn.close()
+            with conn:
+                conn.execute(self.INSERT_SQL, self._row_for(key, value))
             return key
             
         except sqlite3.Error as e:
             print(f"[ERROR] Failed to store data in SQLite node {self.node_id}: {e}")
             return None
     
-    def retrieve_data(self, key):
+    def _row_for(self, key, value):
+        data_json = json.dumps(value)
+        return (
+            key,
+            value.get('content', ''),
+            value.get('timestamp', datetime.datetime.now().isoformat()),
+            value.get('sender', 'Unknown'),
+            data_json,
+            row_hash(key, data_json),
+            ring_token(key),
+            value.get('room') or DEFAULT_ROOM
+        )
+    
+    def store_many(self, records):
+        # Writes every (key, value) pair in a single transaction
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
+            conn = self._get_connection()
+            rows = [self._row_for(key, value) for key, value in records]
             
-            cursor.execute("SELECT data_json FROM messages WHERE id = ?", (key,))
-            result = cursor.fetchone()
+            with conn:
+                conn.executemany(self.INSERT_SQL, rows)
+            return len(rows)
             
-            conn.close()
+        except sqlite3.Error as e:
+            print(f"[ERROR] Failed to store batch in SQLite node {self.node_id}: {e}")
+            return 0
+    
+    def retrieve_data(self, key):
+        try:
+            conn = self._get_connection()
+            result = conn.execute(self.SELECT_BY_ID_SQL, (key,)).fetchone()
             
             if result:
                 return json.loads(result[0])
@@ -99,29 +460,18 @@ class SQLiteDatabaseNode:
     
     def list_data(self, filter_criteria=None, limit=100, offset=0):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
+            conn = self._get_connection()
+            
+            where_clauses, params = self._filter_clauses(filter_criteria)
             
             sql = "SELECT data_json FROM messages"
-            params = []
-            
-            if filter_criteria:
-                where_clauses = []
-                for key, value in filter_criteria.items():
-                    if key in ['id', 'sender']:
-                        where_clauses.append(f"{key} = ?")
-                        params.append(value)
-                
-                if where_clauses:
-                    sql += " WHERE " + " AND ".join(where_clauses)
-            
-            sql += " ORDER BY timestamp DESC LIMIT ? OFFSET ?"
+            if where_clauses:
+                sql += " WHERE " + " AND ".join(where_clauses)
+            
+            sql += " ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?"
             params.extend([limit, offset])
             
-            cursor.execute(sql, params)
-            results = cursor.fetchall()
-            
-            conn.close()
+            results = conn.execute(sql, params).fetchall()
             
             return [json.loads(row[0]) for row in results]
             
@@ -129,13 +479,75 @@ class SQLiteDatabaseNode:
             print(f"[ERROR] Failed to list data from SQLite node {self.node_id}: {e}")
             return []
     
+    def _filter_clauses(self, filter_criteria):
+        where_clauses = []
+        params = []
+        if filter_criteria:
+            for key, value in filter_criteria.items():
+                if key in ['id', 'sender', 'room']:
+                    where_clauses.append(f"{key} = ?")
+                    params.append(value)
+        return where_clauses, params
+    
+    def list_before(self, cursor=None, limit=50, filter_criteria=None):
+        # Keyset pagination: rows strictly older than cursor = (timestamp, id),
+        # newest first. Each page is an index range scan, however deep.
+        try:
+            conn = self._get_connection()
+            
+            where_clauses, params = self._filter_clauses(filter_criteria)
+            if cursor is not None:
+                where_clauses.append("(timestamp, id) < (?, ?)")
+                params.extend(cursor)
+            
+            sql = "SELECT data_json FROM messages"
+            if where_clauses:
+                sql += " WHERE " + " AND ".join(where_clauses)
+            sql += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+            params.append(limit)
+            
+            return [json.loads(row[0]) for row in conn.execute(sql, params).fetchall()]
+            
+        except sqlite3.Error as e:
+            print(f"[ERROR] Failed to page data from SQLite node {self.node_id}: {e}")
+            return []
+    
+    def search(self, query, cursor=None, limit=50, room=None):
+        # Matches for `query`, newest first. The FTS index only finds the
+        # matching rows; order and the `cursor` = (timestamp, id) keyset are
+        # the same as list_before, so pages merged across nodes stay sorted
+        # no matter when each node received its copy of a row.
+        match = fts_query(query)
+        if not match:
+            return []
+        try:
+            conn = self._get_connection()
+            
+            sql = """
+                SELECT m.data_json FROM messages_fts AS f
+                JOIN messages AS m ON m.rowid = f.rowid
+                WHERE messages_fts MATCH ?
+            """
+            params = [match]
+            if room is not None:
+                sql += " AND m.room = ?"
+                params.append(room)
+            if cursor is not None:
+                sql += " AND (m.timestamp, m.id) < (?, ?)"
+                params.extend(cursor)
+            sql += " ORDER BY m.timestamp DESC, m.id DESC LIMIT ?"
+            params.append(limit)
+            
+            return [json.loads(row[0]) for row in conn.execute(sql, params).fetchall()]
+            
+        except sqlite3.Error as e:
+            print(f"[ERROR] Failed to search SQLite node {self.node_id}: {e}")
+            return []
+    
     def count_records(self):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM messages")
-            result = cursor.fetchone()
-            conn.close()
+            conn = self._get_connection()
+            result = conn.execute(self.COUNT_SQL).fetchone()
             return result[0] if result else 0
         except sqlite3.Error as e:
             print(f"[ERROR] Failed to count records in SQLite node {self.node_id}: {e}")
@@ -148,24 +560,112 @@ class SQLiteDatabaseNode:
             if self not in other_node.connected_nodes:
                 other_node.connected_nodes.append(self)
     
+    def bucket_digests(self):
+        # {bucket: (xor digest, row count)} for every non-empty bucket
+        try:
+            conn = self._get_connection()
+            rows = conn.execute(
+                "SELECT bucket, digest, row_count FROM sync_buckets WHERE row_count > 0"
+            ).fetchall()
+            return {bucket: (digest, count) for bucket, digest, count in rows}
+        except sqlite3.Error as e:
+            print(f"[ERROR] Failed to read sync buckets from SQLite node {self.node_id}: {e}")
+            return None
+    
+    def ring_slice_digests(self):
+        # {slice: (xor digest, row count)} for every non-empty ring slice
+        try:
+            conn = self._get_connection()
+            rows = conn.execute(
+                "SELECT slice, digest, row_count FROM sync_ring_slices WHERE row_count > 0"
+            ).fetchall()
+            return {index: (digest, count) for index, digest, count in rows}
+        except sqlite3.Error as e:
+            print(f"[ERROR] Failed to read ring digests from SQLite node {self.node_id}: {e}")
+            return None
+    
+    def bucket_row_hashes(self, bucket):
+        conn = self._get_connection()
+        rows = conn.execute(
+            """
+            SELECT id, row_hash FROM messages
+            WHERE timestamp >= ? AND timestamp < ? AND substr(timestamp, 1, ?) = ?
+            """,
+            (bucket, bucket + '\uffff', BUCKET_PREFIX_LENGTH, bucket)
+        ).fetchall()
+        return dict(rows)
+    
+    def _select_in(self, sql, keys, chunk_size=500):
+        conn = self._get_connection()
+        keys = list(keys)
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            placeholders = ", ".join("?" * len(chunk))
+            yield from conn.execute(sql.format(placeholders=placeholders), chunk)
+    
+    def row_hashes(self, keys):
+        return dict(self._select_in("SELECT id, row_hash FROM messages WHERE id IN ({placeholders})", keys))
+    
+    def fetch_records(self, keys):
+        return [
+            (key, json.loads(data_json))
+            for key, data_json in self._select_in("SELECT id, data_json FROM messages WHERE id IN ({placeholders})", keys)
+        ]
+    
+    def _range_clause(self, ranges):
+        # Ring ranges are (start, end] pairs of tokens
+        clauses = " OR ".join("(ring_token > ? AND ring_token <= ?)" for _ in ranges)
+        params = [bound for token_range in ranges for bound in token_range]
+        return clauses, params
+    
+    def _range_chunks(self, ranges, chunk_size=200):
+        ranges = list(ranges)
+        for start in range(0, len(ranges), chunk_size):
+            yield ranges[start:start + chunk_size]
+    
+    def records_in_ranges(self, ranges, batch_size=1000):
+        # Yields lists of (key, record) for every row whose token is in ranges
+        conn = self._get_connection()
+        for chunk in self._range_chunks(ranges):
+            clauses, params = self._range_clause(chunk)
+            cursor = conn.execute(f"SELECT id, data_json FROM messages WHERE {clauses}", params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [(key, json.loads(data_json)) for key, data_json in rows]
+    
+    def range_row_hashes(self, ranges):
+        conn = self._get_connection()
+        hashes = {}
+        for chunk in self._range_chunks(ranges):
+            clauses, params = self._range_clause(chunk)
+            hashes.update(conn.execute(f"SELECT id, row_hash FROM messages WHERE {clauses}", params))
+        return hashes
+    
+    def delete_ranges(self, ranges):
+        try:
+            conn = self._get_connection()
+            deleted = 0
+            with conn:
+                for chunk in self._range_chunks(ranges):
+                    clauses, params = self._range_clause(chunk)
+                    deleted += conn.execute(f"DELETE FROM messages WHERE {clauses}", params).rowcount
+            return deleted
+        except sqlite3.Error as e:
+            print(f"[ERROR] Failed to delete ranges from SQLite node {self.node_id}: {e}")
+            return 0
+    
     def copy_from(self, source_node):
+        # Rebuilds this node from scratch, transferring the source in batches
         if not source_node.exists():
             print(f"[ERROR] Source node {source_node.node_id} doesn't exist")
             return 0
             
         try:
-            if os.path.exists(self.db_file):
-                os.remove(self.db_file)
-            
-            self._initialize_database()
-            
-            records = source_node.list_data(limit=10000) 
+            self.reset()
             
-            count = 0
-            for record in records:
-                if 'id' in record:
-                    self.store_data(record['id'], record)
-                    count += 1
+            count = DeltaSync().sync(source_node, self)
             
             print(f"[+] Copied {count} records from node {source_node.node_id} to node {self.node_id}")
             return count
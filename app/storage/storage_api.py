@@ -1,40 +1,175 @@
 import time
+import json
+import base64
+import heapq
+
+
+def encode_cursor(message):
+    # Opaque keyset cursor pointing just past `message` in (timestamp, id) order
+    key = json.dumps([message.get('timestamp', ''), message.get('id', '')])
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid history cursor: {cursor}") from e
+    return timestamp, message_id
+
 
 class StorageAPI:
 
-    def __init__(self, replication_manager, cluster_coordinator=None):
+    def __init__(self, replication_manager, cluster_coordinator=None, write_behind=None, journal=None):
         self.replication_manager = replication_manager
         self.cluster_coordinator = cluster_coordinator
+        self.write_behind = write_behind
+        self.journal = journal
     
     def store_message(self, message_id, message_data):
-        self.verify_nodes()
+        if self.journal:
+            # Durable once fsynced locally; the journal replays it to the nodes
+            self.journal.append(message_id, message_data)
+            return message_id
+        
+        if self.write_behind:
+            return self.store_message_async(message_id, message_data).result()
+        
+        if not self.replication_manager.health_monitor:
+            self.verify_nodes()
         
         success = self.replication_manager.store_with_replication(message_id, message_data)
         if success:
             return message_id
         return None
     
+    def store_message_async(self, message_id, message_data):
+        # Returns a Future resolving to message_id, or None if the write failed
+        if not self.write_behind:
+            raise RuntimeError("Asynchronous storage requires a write-behind queue")
+        return self.write_behind.submit(message_id, message_data)
+    
+    def flush(self, timeout=None):
+        if self.journal:
+            return self.journal.flush(timeout)
+        if self.write_behind:
+            return self.write_behind.flush(timeout)
+        return True
+    
     def get_message(self, message_id):
         return self.replication_manager.retrieve_with_fallback(message_id)
     
-    def get_messages(self, limit=50):
+    def _readable_nodes(self):
+        # Uses the cached health state when a monitor is attached
+        if self.replication_manager.health_monitor:
+            return self.replication_manager.available_nodes()
         self.verify_nodes()
+        return [node for node in self.replication_manager.nodes if node.exists()]
+    
+    def _gather(self, fetch, limit):
+        # Partitioned clusters: every node holds only part of the history, so
+        # each returns its newest `limit` rows and the pages are merged
+        pages = []
+        for node in self._readable_nodes():
+            try:
+                pages.append(fetch(node))
+            except Exception as e:
+                print(f"[WARNING] Failed to read messages from node {node.node_id}: {e}")
+                if self.replication_manager.health_monitor:
+                    self.replication_manager.health_monitor.report_failure(node, e)
+        
+        merged = []
+        seen = set()
+        for message in heapq.merge(*pages, key=lambda m: (m.get('timestamp', ''), m.get('id', '')), reverse=True):
+            if message.get('id') in seen:
+                continue
+            seen.add(message.get('id'))
+            merged.append(message)
+            if len(merged) == limit:
+                break
+        return merged
+    
+    def _room_filter(self, room):
+        return {'room': room} if room is not None else None
+    
+    def get_messages(self, limit=50, room=None):
+        criteria = self._room_filter(room)
+        if self.replication_manager.is_partitioned():
+            return self._gather(lambda node: node.list_data(criteria, limit=limit), limit)
         
-        for node in self.replication_manager.nodes:
+        for node in self._readable_nodes():
             try:
-                if node.exists():
-                    messages = node.list_data(limit=limit)
-                    if messages and len(messages) > 0:
-                        print(f"[+] Retrieved {len(messages)} messages from node {node.node_id}")
-                        return messages
+                messages = node.list_data(criteria, limit=limit)
+                if messages and len(messages) > 0:
+                    print(f"[+] Retrieved {len(messages)} messages from node {node.node_id}")
+                    return messages
             except Exception as e:
                 print(f"[WARNING] Failed to get messages from node {node.node_id}: {e}")
+                if self.replication_manager.health_monitor:
+                    self.replication_manager.health_monitor.report_failure(node, e)
         
         print("[WARNING] No messages found in any node")
         return []
     
+    def cursor_for(self, message):
+        return encode_cursor(message)
+    
+    def get_messages_before(self, cursor=None, limit=50, room=None):
+        # Returns (messages newest first, cursor for the next older page or None)
+        position = decode_cursor(cursor) if cursor else None
+        criteria = self._room_filter(room)
+        
+        if self.replication_manager.is_partitioned():
+            messages = self._gather(lambda node: node.list_before(position, limit=limit, filter_criteria=criteria), limit)
+            next_cursor = encode_cursor(messages[-1]) if len(messages) == limit else None
+            return messages, next_cursor
+        
+        for node in self._readable_nodes():
+            try:
+                messages = node.list_before(position, limit=limit, filter_criteria=criteria)
+            except Exception as e:
+                print(f"[WARNING] Failed to page messages from node {node.node_id}: {e}")
+                if self.replication_manager.health_monitor:
+                    self.replication_manager.health_monitor.report_failure(node, e)
+                continue
+            
+            next_cursor = encode_cursor(messages[-1]) if len(messages) == limit else None
+            return messages, next_cursor
+        
+        return [], None
+    
+    def search_messages(self, query, limit=50, cursor=None, room=None):
+        # Full-text search; returns (matches, cursor for the next page or None)
+        position = decode_cursor(cursor) if cursor else None
+        
+        if self.replication_manager.is_partitioned():
+            messages = self._gather(lambda node: node.search(query, position, limit=limit, room=room), limit)
+            next_cursor = encode_cursor(messages[-1]) if len(messages) == limit else None
+            return messages, next_cursor
+        
+        for node in self._readable_nodes():
+            try:
+                messages = node.search(query, position, limit=limit, room=room)
+            except Exception as e:
+                print(f"[WARNING] Failed to search messages on node {node.node_id}: {e}")
+                if self.replication_manager.health_monitor:
+                    self.replication_manager.health_monitor.report_failure(node, e)
+                continue
+            
+            next_cursor = encode_cursor(messages[-1]) if len(messages) == limit else None
+            return messages, next_cursor
+        
+        return [], None
+    
     def verify_nodes(self):
+        if self.replication_manager.health_monitor:
+            return self.replication_manager.health_monitor.check_nodes()
         return self.replication_manager.verify_nodes()
     
+    def node_health(self):
+        if self.replication_manager.health_monitor:
+            return self.replication_manager.health_monitor.status()
+        return None
+    
     def synchronize(self):
         return self.replication_manager.synchronize_nodes()
\ No newline at end of file
@@ -0,0 +1,125 @@
+import threading
+import time
+from concurrent.futures import Future
+
+# The handle resolves as soon as the message is queued (may be lost on crash)
+DURABILITY_QUEUED = 'queued'
+# The handle resolves once the batch is committed on the replica nodes
+DURABILITY_COMMITTED = 'committed'
+
+
+class WriteBehindQueue:
+    """Group-commit stage in front of the ReplicationManager.
+
+    Collects individual writes and flushes them to every node as one
+    executemany transaction, either when batch_size messages are pending
+    or flush_interval_ms after the oldest pending one arrived.
+    """
+
+    def __init__(self, replication_manager, batch_size=500, flush_interval_ms=20,
+                 durability=DURABILITY_COMMITTED):
+        if durability not in (DURABILITY_QUEUED, DURABILITY_COMMITTED):
+            raise ValueError(f"Unknown durability level: {durability}")
+
+        self.replication_manager = replication_manager
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.durability = durability
+
+        self._pending = []
+        self._oldest_at = None
+        self._cond = threading.Condition()
+        self._submitted = 0
+        self._completed = 0
+        self._flush_requested = False
+        self._closed = False
+
+        self.batches_written = 0
+        self.records_written = 0
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, key, data):
+        committed = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("WriteBehindQueue is closed")
+            first = not self._pending
+            if first:
+                self._oldest_at = time.monotonic()
+            self._pending.append((key, data, committed))
+            self._submitted += 1
+            if first or len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+
+        if self.durability == DURABILITY_QUEUED:
+            queued = Future()
+            queued.set_result(key)
+            return queued
+        return committed
+
+    def flush(self, timeout=None):
+        # Blocks until everything submitted before this call has been written
+        with self._cond:
+            target = self._submitted
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._completed >= target, timeout)
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def pending(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                if self._closed:
+                    return None
+                self._cond.wait()
+
+            deadline = self._oldest_at + self.flush_interval
+            while len(self._pending) < self.batch_size and not self._flush_requested and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = self._pending[:self.batch_size]
+            del self._pending[:self.batch_size]
+            if self._pending:
+                self._oldest_at = time.monotonic()
+            else:
+                self._flush_requested = False
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            records = [(key, data) for key, data, _ in batch]
+            try:
+                success = self.replication_manager.store_batch_with_replication(records)
+            except Exception as e:
+                print(f"[ERROR] Write-behind flush failed: {e}")
+                success = False
+
+            if success:
+                self.batches_written += 1
+                self.records_written += len(batch)
+
+            for key, _, committed in batch:
+                committed.set_result(key if success else None)
+
+            with self._cond:
+                self._completed += len(batch)
+                self._cond.notify_all()
@@ -0,0 +1,18 @@
+# Chat Server Configuration
+CHAT_CONFIG = {
+    'engine': 'threads',  # 'threads' (uma thread por cliente) ou 'asyncio' (event loop único)
+    'host': '192.168.10.9',
+    'port': 8080,
+    'backlog': 4096,  # Fila de conexões pendentes do motor asyncio
+    'outbound_queue_limit': 1024,  # Mensagens pendentes por cliente antes de aplicar a política
+    'slow_consumer_policy': 'drop_oldest',  # 'drop_oldest' ou 'disconnect'
+    'compression_enabled': True,  # Aceita negociar compressão zlib com os clientes
+    'compression_threshold': 256,  # Payloads a partir deste tamanho (bytes) são comprimidos
+    'attachments_enabled': True,  # Guarda anexos no servidor (None/False apenas retransmite os chunks)
+    'attachments_dir': 'attachments',  # Relativo ao diretório de dados
+    'max_uploads_per_connection': 4,  # Uploads de anexos abertos ao mesmo tempo por conexão
+    'upload_idle_timeout_s': 300,  # Uploads sem chunks por este tempo são fechados (e podem ser retomados)
+    'persistence_queue_limit': 10000,  # Mensagens aguardando gravação no storage antes de aplicar a política
+    'persistence_full_policy': 'block',  # 'block', 'drop_oldest' ou 'drop_newest'
+    'persistence_block_timeout_ms': 1000,  # Espera máxima por espaço na fila com a política 'block'
+}
@@ -9,4 +9,14 @@ SQLITE_CONFIG = {
     'node1_db': os.path.join(BASE_DIR, 'data', 'chat_node1.db'),
     'node2_db': os.path.join(BASE_DIR, 'data', 'chat_node2.db'),
     'node3_db': os.path.join(BASE_DIR, 'data', 'chat_node3.db')
-}
\ No newline at end of file
+}
+
+# Connection pool and pragma tuning applied to every SQLiteDatabaseNode connection
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',  # OFF, NORMAL, FULL or EXTRA
+    'cache_size': -16000,  # Negative values are KiB (about 16 MB per connection)
+    'mmap_size': 256 * 1024 * 1024,
+    'busy_timeout': 5000,  # in milliseconds
+    'cached_statements': 256,  # Prepared statements kept per connection
+}
@@ -0,0 +1,27 @@
+# Distributed Storage Configuration
+STORAGE_CONFIG = {
+    # Group-commit write-behind stage in front of the replicas
+    'write_behind_enabled': True,
+    'write_behind_batch_size': 500,  # Flush after this many messages...
+    'write_behind_flush_interval_ms': 20,  # ...or this long after the oldest pending one
+    'write_behind_durability': 'committed',  # 'queued' or 'committed'
+
+    # Local append-only journal: messages are acknowledged once fsynced here and
+    # replayed to the replicas in the background. When enabled it replaces both
+    # write-behind and the chat server's persistence queue, and delivery waits
+    # for the fsync, so it trades latency for crash safety
+    'journal_enabled': False,
+    'journal_dir': 'journal',  # Relative to the data directory
+    'journal_segment_bytes': 64 * 1024 * 1024,  # Start a new segment file past this size
+    'journal_batch_size': 500,  # Records per replay batch
+    'journal_fsync': True,
+
+    # Quorum replication (None means a majority of the nodes)
+    'write_quorum': None,
+    'read_quorum': 1,
+    'slow_node_threshold_ms': 200,  # Average latency above which a node is flagged as slow
+    'max_hints_per_node': 100000,  # Missed writes kept per node before falling back to a full recovery
+
+    # Background node health monitoring
+    'health_check_interval_s': 5,
+}
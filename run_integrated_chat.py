@@ -9,7 +9,16 @@ from app.storage.sqlite_database_node import SQLiteDatabaseNode
 from app.storage.cluster_coordinator import ClusterCoordinator
 from app.storage.storage_api import StorageAPI
 from app.storage.replication_manager import ReplicationManager
-from app.chat.servidor import ServidorChat
+from app.storage.write_behind import WriteBehindQueue
+from app.storage.journal import MessageJournal
+from app.storage.health_monitor import NodeHealthMonitor
+from app.storage.attachment_store import AttachmentStore
+from app.chat.Servidor import ServidorChat
+from app.chat.servidor_async import ServidorChatAsync
+from config.chat_config import CHAT_CONFIG
+from config.sqlite_config import SQLITE_PRAGMAS
+from config.storage_config import STORAGE_CONFIG
+from config.settings_template import REPLICATION_FACTOR
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
 NODE1_DB = os.path.join(DATA_DIR, 'chat_node1.db')
@@ -37,9 +46,9 @@ def health_check_thread(storage_api):
 def create_storage_system():
     print("[*] Initializing distributed storage system...")
     
-    node1 = SQLiteDatabaseNode(node_id="node1", db_file=NODE1_DB)
-    node2 = SQLiteDatabaseNode(node_id="node2", db_file=NODE2_DB)
-    node3 = SQLiteDatabaseNode(node_id="node3", db_file=NODE3_DB)
+    node1 = SQLiteDatabaseNode(node_id="node1", db_file=NODE1_DB, **SQLITE_PRAGMAS)
+    node2 = SQLiteDatabaseNode(node_id="node2", db_file=NODE2_DB, **SQLITE_PRAGMAS)
+    node3 = SQLiteDatabaseNode(node_id="node3", db_file=NODE3_DB, **SQLITE_PRAGMAS)
     
     node1.connect_to_node(node2)
     node2.connect_to_node(node3)
@@ -47,16 +56,50 @@ def create_storage_system():
     
     print(f"[+] Created 3 SQLite storage nodes")
     
-    coordinator = ClusterCoordinator()
+    coordinator = ClusterCoordinator(replication_factor=REPLICATION_FACTOR)
     coordinator.add_node(node1)
     coordinator.add_node(node2)
     coordinator.add_node(node3)
     
-    replication_manager = ReplicationManager([node1, node2, node3])
+    replication_manager = ReplicationManager(
+        [node1, node2, node3],
+        write_quorum=STORAGE_CONFIG['write_quorum'],
+        read_quorum=STORAGE_CONFIG['read_quorum'],
+        slow_node_threshold_ms=STORAGE_CONFIG['slow_node_threshold_ms'],
+        coordinator=coordinator,
+        max_hints_per_node=STORAGE_CONFIG['max_hints_per_node']
+    )
+    
+    NodeHealthMonitor(
+        replication_manager,
+        check_interval=STORAGE_CONFIG['health_check_interval_s']
+    )
+    
+    # The journal replays to the replicas itself, so write-behind would go unused
+    write_behind = None
+    if STORAGE_CONFIG['write_behind_enabled'] and not STORAGE_CONFIG['journal_enabled']:
+        write_behind = WriteBehindQueue(
+            replication_manager,
+            batch_size=STORAGE_CONFIG['write_behind_batch_size'],
+            flush_interval_ms=STORAGE_CONFIG['write_behind_flush_interval_ms'],
+            durability=STORAGE_CONFIG['write_behind_durability']
+        )
+    
+    journal = None
+    if STORAGE_CONFIG['journal_enabled']:
+        journal = MessageJournal(
+            replication_manager,
+            os.path.join(DATA_DIR, STORAGE_CONFIG['journal_dir']),
+            segment_bytes=STORAGE_CONFIG['journal_segment_bytes'],
+            batch_size=STORAGE_CONFIG['journal_batch_size'],
+            fsync=STORAGE_CONFIG['journal_fsync']
+        )
     
     storage_api = StorageAPI(
         replication_manager=replication_manager,
-        cluster_coordinator=coordinator
+        cluster_coordinator=coordinator,
+        write_behind=write_behind,
+        journal=journal
     )
     
     print("[*] Verifying node health and synchronizing data...")
@@ -76,11 +119,33 @@ def main():
     )
     health_thread.start()
     
-    host = '192.168.10.9'  # Accept connections from any IP
-    port = 8080       # Higher port to avoid permission issues
+    host = CHAT_CONFIG['host']
+    port = CHAT_CONFIG['port']
+    engine = CHAT_CONFIG['engine']
     
-    print(f"[*] Starting chat server on {host}:{port} with integrated storage...")
-    chat_server = ServidorChat(host=host, port=port, storage_api=storage_api)
+    print(f"[*] Starting chat server ({engine} engine) on {host}:{port} with integrated storage...")
+    server_options = {
+        'host': host,
+        'port': port,
+        'storage_api': storage_api,
+        'limite_fila_saida': CHAT_CONFIG['outbound_queue_limit'],
+        'politica_consumidor_lento': CHAT_CONFIG['slow_consumer_policy'],
+        'compressao': CHAT_CONFIG['compression_enabled'],
+        'limiar_compressao': CHAT_CONFIG['compression_threshold'],
+        'limite_fila_persistencia': CHAT_CONFIG['persistence_queue_limit'],
+        'politica_fila_persistencia': CHAT_CONFIG['persistence_full_policy'],
+        'espera_fila_persistencia': CHAT_CONFIG['persistence_block_timeout_ms'] / 1000,
+    }
+    if CHAT_CONFIG['attachments_enabled']:
+        server_options['attachment_store'] = AttachmentStore(
+            os.path.join(DATA_DIR, CHAT_CONFIG['attachments_dir']),
+            max_uploads_per_owner=CHAT_CONFIG['max_uploads_per_connection'],
+            idle_timeout_s=CHAT_CONFIG['upload_idle_timeout_s']
+        )
+    if engine == 'asyncio':
+        chat_server = ServidorChatAsync(backlog=CHAT_CONFIG['backlog'], **server_options)
+    else:
+        chat_server = ServidorChat(**server_options)
     
     try:
         chat_server.iniciar_servidor()
@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.storage.cluster_coordinator import ClusterCoordinator
+from app.storage.replication_manager import ReplicationManager
+from app.storage.sqlite_database_node import SQLiteDatabaseNode
+from app.storage.storage_api import StorageAPI
+
+
+def _record(i, **fields):
+    key = f"m{i:05d}"
+    data = {
+        "id": key,
+        "sender": "x",
+        "content": f"mensagem {i}",
+        "timestamp": f"2026-01-01T{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}",
+        "type": "text",
+    }
+    data.update(fields)
+    return key, data
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def record():
+    # record(i, **fields) -> (key, message), ids and timestamps increasing with i
+    return _record
+
+
+@pytest.fixture
+def wait_for():
+    return _wait_for
+
+
+@pytest.fixture
+def make_node(tmp_path):
+    def make(i):
+        return SQLiteDatabaseNode(f"n{i}", str(tmp_path / f"n{i}.db"))
+    return make
+
+
+@pytest.fixture
+def cluster(make_node):
+    # Three full replicas; a small hint limit so overflow is cheap to reach
+    nodes = [make_node(i) for i in range(3)]
+    manager = ReplicationManager(nodes, max_hints_per_node=20)
+    yield manager, nodes
+    manager.executor.shutdown(wait=True)
+
+
+@pytest.fixture
+def partitioned_cluster(make_node):
+    # Four nodes, two replicas per key
+    coordinator = ClusterCoordinator([make_node(i) for i in range(4)], replication_factor=2)
+    manager = ReplicationManager(list(coordinator.nodes), coordinator=coordinator)
+    yield coordinator, manager, StorageAPI(manager, coordinator)
+    manager.executor.shutdown(wait=True)
@@ -0,0 +1,68 @@
+import hashlib
+import os
+
+import pytest
+
+from app.storage.attachment_store import AttachmentStore
+
+CHUNK = 4
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = AttachmentStore(str(tmp_path), max_uploads_per_owner=2, idle_timeout_s=60)
+    yield store
+    store.close()
+
+
+def digest_of(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def test_uploads_are_capped_per_owner(store):
+    store.begin_upload(digest_of(b"a"), 8, CHUNK, owner="s1")
+    store.begin_upload(digest_of(b"b"), 8, CHUNK, owner="s1")
+    with pytest.raises(ValueError):
+        store.begin_upload(digest_of(b"c"), 8, CHUNK, owner="s1")
+
+    # Re-offering an open upload and other owners are not affected
+    assert store.begin_upload(digest_of(b"a"), 8, CHUNK, owner="s1") == 0
+    assert store.begin_upload(digest_of(b"c"), 8, CHUNK, owner="s2") == 0
+
+
+def test_idle_upload_is_closed_and_resumes_from_the_partial_file(store):
+    content = b"0123456789ab"
+    digest = digest_of(content)
+    store.begin_upload(digest, len(content), CHUNK, owner="s1")
+    store.write_chunk(digest, 0, content[:CHUNK])
+    empty = digest_of(b"never sent")
+    store.begin_upload(empty, 8, CHUNK, owner="s1")
+
+    store.idle_timeout = 0
+    assert store.expire_idle() == 2
+    assert store.upload_status(digest) is None
+    with pytest.raises(ValueError):
+        store.write_chunk(digest, 1, content[CHUNK:2 * CHUNK])
+    # Only the upload with chunks on disk keeps its partial file
+    assert all(os.path.exists(path) for path in store._partial_paths(digest))
+    assert not any(os.path.exists(path) for path in store._partial_paths(empty))
+
+    store.idle_timeout = 60
+    assert store.begin_upload(digest, len(content), CHUNK, owner="s2") == 1
+    store.write_chunk(digest, 1, content[CHUNK:2 * CHUNK])
+    assert store.write_chunk(digest, 2, content[2 * CHUNK:]) == (3, True)
+    assert store.has_object(digest)
+
+
+def test_release_closes_only_the_owners_uploads(store):
+    mine, other = digest_of(b"mine"), digest_of(b"other")
+    store.begin_upload(mine, 8, CHUNK, owner="s1")
+    store.write_chunk(mine, 0, b"mine")
+    store.begin_upload(other, 8, CHUNK, owner="s2")
+
+    assert store.release("s1") == 1
+    assert store.upload_status(mine) is None
+    assert store.upload_status(other)["next_chunk"] == 0
+    # The released owner's slots are free again
+    store.begin_upload(digest_of(b"x"), 8, CHUNK, owner="s1")
+    assert store.begin_upload(mine, 8, CHUNK, owner="s1") == 1
@@ -0,0 +1,92 @@
+import json
+import os
+
+import pytest
+
+from app.storage.database_node import DatabaseNode
+
+
+@pytest.fixture
+def open_node(tmp_path):
+    nodes = []
+
+    def open_node(**options):
+        node = DatabaseNode("d0", str(tmp_path), **options)
+        nodes.append(node)
+        return node
+
+    yield open_node
+    for node in nodes:
+        node.close()
+
+
+def stored_keys(node):
+    return sorted(node.data_store)
+
+
+@pytest.mark.parametrize("torn", [b"complete json", b"truncated json"])
+def test_replay_drops_a_torn_last_line(open_node, record, tmp_path, torn):
+    node = open_node()
+    for i in range(3):
+        node.store_data(record(i)[1])
+    node.close()
+
+    log_path = tmp_path / DatabaseNode.LOG_FILE
+    size = os.path.getsize(log_path)
+    line = json.dumps(["put", "m00003", record(3)[1]]).encode("utf-8")
+    with open(log_path, "ab") as f:
+        # A write cut off before its newline, even if what was written parses
+        f.write(line if torn == b"complete json" else line[:-5])
+
+    node = open_node()
+    assert stored_keys(node) == ["m00000", "m00001", "m00002"]
+    assert os.path.getsize(log_path) == size
+
+    # The next append starts on a line of its own
+    node.store_data(record(4)[1])
+    node.close()
+    assert stored_keys(open_node()) == ["m00000", "m00001", "m00002", "m00004"]
+
+
+def test_compaction_writes_a_snapshot_and_empties_the_log(open_node, record, tmp_path):
+    node = open_node(compact_every=5)
+    for i in range(12):
+        node.store_data(record(i)[1])
+    node.update_data("m00001", record(1, content="editada")[1])
+    node.delete_data("m00002")
+    node.close()
+
+    # Compaction runs in the background, so how much of the log it covered varies
+    assert (tmp_path / DatabaseNode.SNAPSHOT_FILE).exists()
+    assert not (tmp_path / DatabaseNode.COMPACTING_LOG_FILE).exists()
+    with open(tmp_path / DatabaseNode.LOG_FILE, "rb") as f:
+        assert len(f.readlines()) < 14
+
+    reopened = open_node()
+    reopened.compact()
+    assert os.path.getsize(tmp_path / DatabaseNode.LOG_FILE) == 0
+    reopened.close()
+
+    for node in (reopened, open_node()):
+        assert len(node.data_store) == 11
+        assert node.retrieve_data("m00001")["content"] == "editada"
+        assert [m["id"] for m in node.list_data(limit=3)] == ["m00011", "m00010", "m00009"]
+
+
+def test_log_left_by_an_interrupted_compaction_is_replayed_and_compacted(open_node, record, tmp_path):
+    node = open_node()
+    for i in range(3):
+        node.store_data(record(i)[1])
+    node.close()
+    # Crash after the log was moved aside but before the snapshot was written
+    os.replace(tmp_path / DatabaseNode.LOG_FILE, tmp_path / DatabaseNode.COMPACTING_LOG_FILE)
+
+    node = open_node()
+    node.delete_data("m00000")
+    node.store_data(record(3)[1])
+    assert stored_keys(node) == ["m00001", "m00002", "m00003"]
+
+    node.compact()
+    assert not (tmp_path / DatabaseNode.COMPACTING_LOG_FILE).exists()
+    node.close()
+    assert stored_keys(open_node()) == ["m00001", "m00002", "m00003"]
@@ -0,0 +1,20 @@
+from app.protocol.framing import FrameDecoder, encode_frame, frame_bytes, Frame, FRAME_FILE, FRAME_TEXT
+
+
+def test_decoded_frames_keep_their_received_bytes():
+    first = encode_frame(FRAME_TEXT, b'{"type": "text"}')
+    second = encode_frame(FRAME_FILE, b"\x00" * 1000, flags=2)
+    decoder = FrameDecoder()
+    stream = first + second
+
+    frames = decoder.feed(stream[:len(first) + 10]) + decoder.feed(stream[len(first) + 10:])
+
+    assert [frame.raw for frame in frames] == [first, second]
+    assert frames[1].payload == b"\x00" * 1000 and frames[1].flags == 2
+    # Relaying hands out the received bytes instead of rebuilding the frame
+    assert all(frame_bytes(frame) is frame.raw for frame in frames)
+    assert decoder.pending() == 0
+
+
+def test_frames_built_locally_are_encoded():
+    assert frame_bytes(Frame(FRAME_TEXT, 0, b"abc")) == encode_frame(FRAME_TEXT, b"abc")
@@ -0,0 +1,70 @@
+import pytest
+
+from app.storage.hash_ring import HashRing
+
+KEYS = [f"m{i:05d}" for i in range(2000)]
+
+
+def owners(ring, count=2):
+    return {key: ring.nodes_for_key(key, count) for key in KEYS}
+
+
+def test_adding_a_node_only_moves_keys_to_it():
+    ring = HashRing(["a", "b", "c", "d"])
+    before = owners(ring)
+    ring.add_node("e")
+    after = owners(ring)
+
+    moved = [key for key in KEYS if set(before[key]) != set(after[key])]
+    assert moved
+    for key in moved:
+        assert "e" in after[key]
+        assert set(after[key]) - {"e"} <= set(before[key])
+    # Roughly the new node's share of the replicas, far from a full reshuffle
+    assert len(moved) < len(KEYS) * 0.6
+
+
+def test_removing_a_node_restores_previous_owners():
+    ring = HashRing(["a", "b", "c", "d"])
+    before = owners(ring)
+    ring.add_node("e")
+    ring.remove_node("e")
+    assert owners(ring) == before
+
+    ring.remove_node("b")
+    for key, previous in before.items():
+        if "b" not in previous:
+            assert ring.nodes_for_key(key, 2) == previous
+
+
+@pytest.fixture
+def stored(partitioned_cluster, record):
+    coordinator, manager, _ = partitioned_cluster
+    assert manager.store_batch_with_replication([record(i) for i in range(500)])
+    # Lets the writes past the quorum finish before the nodes are counted
+    manager.executor.shutdown(wait=True)
+    return coordinator, manager
+
+
+def assert_placed(coordinator, record):
+    # Every record is on exactly its replicas and nowhere else
+    for key in (record(i)[0] for i in range(0, 500, 7)):
+        expected = {node.node_id for node in coordinator.get_nodes_for_record(key)}
+        holders = {node.node_id for node in coordinator.nodes if node.retrieve_data(key)}
+        assert holders == expected, key
+    assert sum(node.count_records() for node in coordinator.nodes) == 500 * 2
+
+
+def test_rebalance_on_add_and_remove(stored, make_node, record):
+    coordinator, manager = stored
+    assert_placed(coordinator, record)
+
+    new = make_node(4)
+    manager.add_node(new)
+    assert new.count_records() > 0
+    assert_placed(coordinator, record)
+
+    leaving = coordinator.nodes[1]
+    manager.remove_node(leaving)
+    assert leaving not in coordinator.nodes
+    assert_placed(coordinator, record)
@@ -0,0 +1,44 @@
+def take_down(node, monkeypatch):
+    def fail(*args, **kwargs):
+        raise OSError("node down")
+    monkeypatch.setattr(node, "store_many", fail)
+
+
+def test_missed_writes_are_replayed_without_recovery(cluster, record, wait_for, monkeypatch):
+    manager, nodes = cluster
+    down = nodes[1]
+    take_down(down, monkeypatch)
+    assert manager.store_batch_with_replication([record(i) for i in range(10)])
+    assert wait_for(lambda: manager.hints.pending(down) == 10)
+
+    monkeypatch.undo()
+    recoveries = []
+    monkeypatch.setattr(manager, "recover_node", lambda node, source_nodes=None: recoveries.append(node))
+    assert manager.replay_hints(down)
+    assert recoveries == []
+    assert not manager.hints.has_hints(down)
+    assert down.count_records() == 10
+
+
+def test_hint_overflow_falls_back_to_full_recovery(cluster, record, wait_for, monkeypatch):
+    manager, nodes = cluster
+    down = nodes[1]
+    take_down(down, monkeypatch)
+    for start in range(0, 50, 10):
+        assert manager.store_batch_with_replication([record(i) for i in range(start, start + 10)])
+    assert wait_for(lambda: manager.hints.needs_recovery(down))
+    assert manager.hints.pending(down) == 0
+
+    monkeypatch.undo()
+    assert manager.replay_hints(down)
+    assert not manager.hints.has_hints(down)
+    assert down.count_records() == nodes[0].count_records() == 50
+
+
+def test_failed_recovery_keeps_the_node_flagged(cluster, monkeypatch):
+    manager, nodes = cluster
+    down = nodes[1]
+    manager.hints.flag_for_recovery(down)
+    monkeypatch.setattr(manager, "recover_node", lambda node, source_nodes=None: False)
+    assert not manager.replay_hints(down)
+    assert manager.hints.needs_recovery(down)
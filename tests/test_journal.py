@@ -0,0 +1,99 @@
+import glob
+import os
+import threading
+
+from app.storage.journal import MessageJournal
+
+
+class Replicas:
+    """Stands in for the ReplicationManager and records what it was sent."""
+
+    def __init__(self, available=True):
+        self.available = available
+        self.records = []
+        self._lock = threading.Lock()
+
+    def store_batch_with_replication(self, records):
+        if not self.available:
+            return False
+        with self._lock:
+            self.records.extend(records)
+        return True
+
+    def keys(self):
+        return [key for key, _ in self.records]
+
+
+def segment_files(directory):
+    return sorted(glob.glob(os.path.join(directory, "segment-*.log")))
+
+
+def crash(journal):
+    # Stops the replayer without waiting for the pending entries
+    journal.close(timeout=0.1)
+
+
+def test_torn_tail_is_truncated_and_complete_entries_replayed(tmp_path, record):
+    directory = str(tmp_path / "journal")
+    journal = MessageJournal(Replicas(available=False), directory, segment_bytes=1024, retry_interval_s=0.01)
+    for i in range(40):
+        journal.append(*record(i))
+    crash(journal)
+
+    last = segment_files(directory)[-1]
+    size = os.path.getsize(last)
+    with open(last, "ab") as f:
+        f.write(b"\x00\x00\x01\x00partial")
+
+    replicas = Replicas()
+    journal = MessageJournal(replicas, directory, segment_bytes=1024)
+    assert os.path.getsize(last) == size
+    assert journal.flush(5)
+    assert replicas.keys() == [record(i)[0] for i in range(40)]
+    journal.close(1)
+
+
+def test_replay_resumes_from_committed_offset(tmp_path, record):
+    directory = str(tmp_path / "journal")
+    replicas = Replicas()
+    journal = MessageJournal(replicas, directory, retry_interval_s=0.01)
+    for i in range(5):
+        journal.append(*record(i))
+    assert journal.flush(5)
+    committed = journal.stats()["committed_offset"]
+    with open(os.path.join(directory, MessageJournal.OFFSET_FILE)) as f:
+        assert int(f.read()) == committed
+
+    replicas.available = False
+    for i in range(5, 10):
+        journal.append(*record(i))
+    crash(journal)
+
+    restarted = Replicas()
+    journal = MessageJournal(restarted, directory)
+    assert journal.flush(5)
+    assert restarted.keys() == [record(i)[0] for i in range(5, 10)]
+    journal.close(1)
+
+
+def test_replayed_segments_are_deleted(tmp_path, record):
+    directory = str(tmp_path / "journal")
+    replicas = Replicas(available=False)
+    journal = MessageJournal(replicas, directory, segment_bytes=256, retry_interval_s=0.01)
+    for i in range(50):
+        journal.append(*record(i))
+    assert len(segment_files(directory)) > 1
+
+    replicas.available = True
+    assert journal.flush(5)
+    assert len(segment_files(directory)) == 1
+    assert journal.stats()["segments"] == 1
+    assert journal.pending_bytes() == 0
+    journal.close(1)
+
+    # Nothing is replayed again after a clean restart
+    replicas = Replicas()
+    journal = MessageJournal(replicas, directory)
+    assert journal.pending_bytes() == 0
+    journal.close(1)
+    assert replicas.records == []
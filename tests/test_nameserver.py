@@ -0,0 +1,31 @@
+import pytest
+
+from app.chat.nameserver import NameServer
+
+ADDR = ("10.0.0.1", 40000)
+
+
+def register(server, port, load):
+    return server.register({'name': 'Servidor.com', 'port': port, 'load': load}, ADDR)
+
+
+def test_invalid_load_is_rejected_and_lookup_keeps_working():
+    server = NameServer()
+    register(server, 1, {'clients': 5, 'cpu': 0.5})
+
+    for load in ({'cpu': 'high'}, {'cpu': 2}, {'clients': -1}, {'queue': float('inf')}, {'cpu': float('nan')}, [1]):
+        with pytest.raises(ValueError):
+            register(server, 2, load)
+
+    response = server.lookup({'name': 'Servidor.com'}, ADDR)
+    assert response['status'] == 'found'
+    assert response['instances'] == 1
+
+
+def test_load_values_are_coerced_and_missing_ones_default():
+    server = NameServer()
+    register(server, 1, {'clients': '3', 'cpu': '0.25', 'extra': 'ignored'})
+    register(server, 2, {})
+    assert server.name_mapping['Servidor.com'][(ADDR[0], 1)][1] == {'clients': 3, 'cpu': 0.25}
+    # The idle instance wins
+    assert server.lookup({'name': 'Servidor.com'}, ADDR)['address'] == [ADDR[0], 2]
@@ -0,0 +1,107 @@
+import threading
+
+import pytest
+
+from app.chat.persistencia import FilaPersistencia
+
+
+class Storage:
+    """gravar_lote that records each batch and can be held to keep the queue full."""
+
+    def __init__(self):
+        self.stored = []
+        self.released = threading.Event()
+        self.released.set()
+        self.fail = False
+
+    def gravar_lote(self, lote):
+        self.released.wait(5)
+        if self.fail:
+            raise OSError("disco indisponível")
+        self.stored.extend(lote)
+        return len(lote)
+
+
+@pytest.fixture
+def storage():
+    return Storage()
+
+
+@pytest.fixture
+def make_queue(storage, wait_for):
+    queues = []
+
+    def make(politica, espera_maxima=1.0):
+        # Limit of two, with the worker holding record 0 until storage is released
+        fila = FilaPersistencia(storage.gravar_lote, limite=2, politica=politica,
+                                espera_maxima=espera_maxima, tamanho_lote=1)
+        queues.append(fila)
+        storage.released.clear()
+        assert fila.enfileirar(0)
+        assert wait_for(lambda: len(fila) == 0)
+        assert fila.enfileirar(1) and fila.enfileirar(2)
+        return fila
+
+    yield make
+    storage.released.set()
+    for fila in queues:
+        fila.encerrar(1)
+
+
+def test_drop_oldest_discards_the_head_of_the_queue(storage, make_queue):
+    fila = make_queue('drop_oldest')
+    assert fila.enfileirar(3)
+    storage.released.set()
+
+    assert fila.esvaziar(1)
+    assert storage.stored == [0, 2, 3]
+    metricas = fila.metricas()
+    assert (metricas['queued'], metricas['stored'], metricas['dropped'], metricas['peak']) == (4, 3, 1, 2)
+
+
+def test_drop_newest_rejects_the_incoming_record(storage, make_queue):
+    fila = make_queue('drop_newest')
+    assert not fila.enfileirar(3)
+    storage.released.set()
+
+    assert fila.esvaziar(1)
+    assert storage.stored == [0, 1, 2]
+    assert fila.metricas()['dropped'] == 1
+
+
+def test_block_gives_up_after_the_maximum_wait(storage, make_queue):
+    fila = make_queue('block', espera_maxima=0.05)
+    # The event-loop variant never waits and counts nothing
+    assert fila.tentar_enfileirar(3) is None
+    assert fila.metricas()['waits'] == 0
+
+    assert not fila.enfileirar(3)
+    metricas = fila.metricas()
+    assert (metricas['waits'], metricas['dropped'], metricas['depth']) == (1, 1, 3)
+    assert metricas['wait_seconds'] >= 0.04
+
+
+def test_block_waits_for_space(storage, make_queue):
+    fila = make_queue('block', espera_maxima=5)
+    result = []
+    producer = threading.Thread(target=lambda: result.append(fila.enfileirar(3)))
+    producer.start()
+    producer.join(0.1)
+    assert producer.is_alive()
+
+    storage.released.set()
+    producer.join(5)
+    assert result == [True]
+    assert fila.esvaziar(1)
+    assert storage.stored == [0, 1, 2, 3]
+
+
+def test_failed_batches_and_closed_queue_are_counted(storage):
+    storage.fail = True
+    fila = FilaPersistencia(storage.gravar_lote, limite=10)
+    assert fila.enfileirar(0)
+    assert fila.encerrar(1)
+    assert not fila.enfileirar(1)
+
+    metricas = fila.metricas()
+    assert (metricas['stored'], metricas['failed'], metricas['dropped']) == (0, 1, 1)
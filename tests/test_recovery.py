@@ -0,0 +1,18 @@
+def test_recovery_succeeds_when_the_source_is_written_during_the_copy(cluster, record, monkeypatch):
+    manager, nodes = cluster
+    for i in range(50):
+        for node in nodes:
+            node.store_data(*record(i))
+    target, sources = nodes[0], nodes[1:]
+    copy_from = target.copy_from
+
+    def copy_while_writing(source):
+        # The source count was read before the copy, as in a live cluster
+        for node in sources:
+            node.store_data(*record(50))
+        return copy_from(source)
+    monkeypatch.setattr(target, "copy_from", copy_while_writing)
+
+    assert manager.recover_node(target, sources)
+    assert target.count_records() == 51
+    assert manager.delta_sync.in_sync(nodes)
@@ -0,0 +1,34 @@
+def page_all(api, query, limit=20):
+    results, cursor, pages = [], None, 0
+    while True:
+        page, cursor = api.search_messages(query, limit=limit, cursor=cursor)
+        results.extend(page)
+        pages += 1
+        if cursor is None:
+            return results, pages
+        assert pages < 100, "search paging did not terminate"
+
+
+def test_search_pages_newest_first_until_the_cursor_ends(partitioned_cluster, record):
+    _, manager, api = partitioned_cluster
+    matches = [record(i, content=f"reunião {i}") for i in range(0, 200, 2)]
+    others = [record(i, content=f"almoço {i}") for i in range(1, 200, 2)]
+    assert manager.store_batch_with_replication(matches + others)
+
+    results, _ = page_all(api, "reuniao", limit=15)
+    assert [m["id"] for m in results] == [key for key, _ in reversed(matches)]
+
+
+def test_search_paging_ends_after_a_node_joins(partitioned_cluster, make_node, record):
+    # Rows copied to the new node get higher FTS rowids than their
+    # timestamps suggest; paging must still follow (timestamp, id)
+    _, manager, api = partitioned_cluster
+    assert manager.store_batch_with_replication([record(i, content=f"reunião {i}") for i in range(400)])
+    manager.executor.shutdown(wait=True)
+    manager.add_node(make_node(4))
+
+    results, pages = page_all(api, "reuniao")
+    ids = [m["id"] for m in results]
+    assert len(ids) == len(set(ids)) == 400
+    assert ids == sorted(ids, reverse=True)
+    assert pages == 21
@@ -0,0 +1,70 @@
+import errno
+import socket
+
+import pytest
+
+from app.chat.Servidor import ServidorChat
+from app.protocol.framing import FrameDecoder
+from app.protocol.marshaller import marshall_message
+from app.protocol.message import create_message
+from app.protocol.unmarshaller import unmarshall_frame
+from app.storage.journal import MessageJournal
+from app.storage.storage_api import StorageAPI
+
+
+def received(sock, timeout=0.3):
+    sock.settimeout(timeout)
+    decoder = FrameDecoder()
+    frames = []
+    try:
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            frames += decoder.feed(data)
+    except socket.timeout:
+        pass
+    return [unmarshall_frame(frame) for frame in frames]
+
+
+@pytest.fixture
+def journaled_server(cluster, tmp_path):
+    manager, _ = cluster
+    journal = MessageJournal(manager, str(tmp_path / "journal"))
+    server = ServidorChat(storage_api=StorageAPI(manager, journal=journal))
+    clients = {}
+    for name in ("a", "b"):
+        server_side, client_side = socket.socketpair()
+        sessao, _ = server._registrar_cliente(server_side, ("local", 0))
+        sessao.usuario = name
+        sessao.aguardando_historico = False
+        clients[name] = (sessao, client_side)
+    yield server, journal, clients
+    for sessao, client_side in clients.values():
+        server.remover_cliente(sessao)
+        client_side.close()
+    journal.close(1)
+
+
+def send(server, sessao, content):
+    msg_dict = create_message(sessao.usuario, content)
+    (frame,) = FrameDecoder().feed(marshall_message(msg_dict))
+    server.transmitir_mensagem(frame, sessao, msg_dict)
+
+
+def test_message_is_not_delivered_when_the_journal_write_fails(journaled_server, monkeypatch):
+    server, journal, clients = journaled_server
+    (sender, sender_socket), (_, recipient_socket) = clients["a"], clients["b"]
+
+    def disk_full(key, data):
+        raise OSError(errno.ENOSPC, "No space left on device")
+    monkeypatch.setattr(journal, "append", disk_full)
+    send(server, sender, "perdida")
+
+    assert received(recipient_socket) == []
+    assert [m["sender_id"] for m in received(sender_socket)] == ["Sistema"]
+    assert server.historico.mensagens() == []
+
+    monkeypatch.undo()
+    send(server, sender, "gravada")
+    assert [m["content"] for m in received(recipient_socket)] == ["gravada"]